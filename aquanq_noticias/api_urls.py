@@ -24,12 +24,18 @@ from users.views import (
 from eventos.views import EventoViewSet, CategoriaViewSet, EventoFeedView
 from chatbot.views import (
     ChatbotQueryView, 
+    ChatbotAsyncQueryView,
+    ChatbotBatchQueryView,
+    ChatbotStreamQueryView,
     ChatbotRecommendedQuestionsView,
     ChatbotKnowledgeBaseViewSet,
     ChatConversationViewSet,
-    ChatbotCategoryViewSet
+    ChatbotCategoryViewSet,
+    ChatbotAnalyticsTimeseriesView,
+    ChatbotAnalyticsSummaryView,
+    ChatbotPrometheusMetricsView
 )
-from notificaciones.views import DeviceTokenViewSet, NotificacionViewSet
+from notificaciones.views import DeviceTokenViewSet, NotificacionViewSet, SuscripcionCategoriaViewSet
 from almuerzos.views import AlmuerzoViewSet
 
 router = DefaultRouter()
@@ -41,6 +47,7 @@ router.register(r'chatbot-categories', ChatbotCategoryViewSet, basename='chatbot
 router.register(r'users', UsuarioViewSet, basename='users')
 router.register(r'notifications', NotificacionViewSet, basename='notification')
 router.register(r'fcm-token', DeviceTokenViewSet, basename='fcm-token')
+router.register(r'category-subscriptions', SuscripcionCategoriaViewSet, basename='category-subscription')
 router.register(r'almuerzos', AlmuerzoViewSet, basename='almuerzo')
 
 
@@ -58,7 +65,13 @@ urlpatterns = [
 
     # Rutas de Chatbot Corporativo
     path('chatbot/query/', ChatbotQueryView.as_view(), name='chatbot_query'),
+    path('chatbot/query/batch/', ChatbotBatchQueryView.as_view(), name='chatbot_query_batch'),
+    path('chatbot/query/async/', ChatbotAsyncQueryView.as_view(), name='chatbot_query_async'),
+    path('chatbot/query/stream/', ChatbotStreamQueryView.as_view(), name='chatbot_query_stream'),
     path('chatbot/recommended-questions/', ChatbotRecommendedQuestionsView.as_view(), name='recommended_questions'),
     path('chatbot/regenerate-embeddings/', ChatbotKnowledgeBaseViewSet.as_view({'post': 'regenerate_embeddings'}), name='regenerate_embeddings'),
+    path('chatbot/analytics/timeseries/', ChatbotAnalyticsTimeseriesView.as_view(), name='chatbot_analytics_timeseries'),
+    path('chatbot/analytics/summary/', ChatbotAnalyticsSummaryView.as_view(), name='chatbot_analytics_summary'),
+    path('chatbot/metrics/', ChatbotPrometheusMetricsView.as_view(), name='chatbot_metrics_prometheus'),
     
 ] 
\ No newline at end of file
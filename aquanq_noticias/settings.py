@@ -108,6 +108,13 @@ DATABASES = {
     }
 }
 
+# Caché de Django. El limitador del chatbot, la versión del índice vectorial y los contadores
+# de notificaciones se coordinan por aquí, así que con varios workers (gunicorn) debe ser una
+# caché compartida: CACHE_URL=rediscache://127.0.0.1:6379/1 (paquete redis) o
+# CACHE_URL=dbcache://django_cache (tras `python manage.py createcachetable`).
+# Por defecto es LocMem, propia de cada proceso: sirve para desarrollo y para un solo worker.
+CACHES = {'default': env.cache('CACHE_URL', default='locmemcache://')}
+
 
 AUTHENTICATION_BACKENDS = [
     'users.auth_backends.DNIAuthBackend',
@@ -208,3 +215,89 @@ DNI_API_BEARER_TOKEN = env('DNI_API_BEARER_TOKEN')
 # Firebase Cloud Messaging (FCM) para notificaciones push.
 # La inicialización se realiza en notificaciones/apps.py
 FIREBASE_ADMIN_CREDENTIALS_PATH = env('FIREBASE_ADMIN_CREDENTIALS_PATH', default=str(BASE_DIR / 'firebase-credentials.json'))
+
+# Chatbot: retención de conversaciones.
+# Las conversaciones más antiguas que CHATBOT_CONVERSATION_RETENTION_DAYS se exportan a
+# CHATBOT_ARCHIVE_DIR (JSONL comprimido, un archivo por mes) y se eliminan de la tabla.
+# Los agregados diarios se conservan; los horarios se podan tras CHATBOT_HOURLY_ROLLUP_RETENTION_DAYS
+# (None para conservarlos indefinidamente).
+CHATBOT_CONVERSATION_RETENTION_DAYS = env.int('CHATBOT_CONVERSATION_RETENTION_DAYS', default=180)
+CHATBOT_ARCHIVE_DIR = env('CHATBOT_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'chatbot'))
+CHATBOT_HOURLY_ROLLUP_RETENTION_DAYS = env.int('CHATBOT_HOURLY_ROLLUP_RETENTION_DAYS', default=None)
+
+# Índice vectorial del chatbot: 'exact' (matriz completa) o 'ivf' (particiones k-means, para
+# bases grandes). Con menos de CHATBOT_INDEX_IVF_MIN_SIZE entradas siempre se usa el exacto.
+# `python manage.py build_chatbot_index` lo persiste en CHATBOT_INDEX_DIR.
+CHATBOT_INDEX_BACKEND = env('CHATBOT_INDEX_BACKEND', default='exact')
+CHATBOT_INDEX_DIR = env('CHATBOT_INDEX_DIR', default=str(BASE_DIR / 'chatbot_index'))
+CHATBOT_INDEX_IVF_MIN_SIZE = env.int('CHATBOT_INDEX_IVF_MIN_SIZE', default=5000)
+CHATBOT_INDEX_IVF_NPROBE = env.int('CHATBOT_INDEX_IVF_NPROBE', default=8)
+# Cada proceso relee el puntero CURRENT del índice a lo sumo cada VERSION_TTL segundos (los
+# cambios hechos en el mismo proceso se ven al instante). Los cambios de la base de conocimiento
+# se publican en disco PUBLISH_DELAY segundos después del primero, agrupando los siguientes.
+CHATBOT_INDEX_VERSION_TTL = env.float('CHATBOT_INDEX_VERSION_TTL', default=2.0)
+CHATBOT_INDEX_PUBLISH_DELAY = env.float('CHATBOT_INDEX_PUBLISH_DELAY', default=5.0)
+# Vectores adicionales por entrada que se indexan junto a la pregunta ('keyword', 'answer');
+# cada entrada puntúa con el mejor de sus vectores. Vacío = solo la pregunta.
+CHATBOT_INDEX_EXTRA_SOURCES = env.list('CHATBOT_INDEX_EXTRA_SOURCES', default=[])
+# Aprendizaje de alias (`python manage.py mine_question_aliases`): formulaciones que coincidieron
+# semánticamente con la misma entrada al menos N veces con puntaje alto en los últimos días.
+CHATBOT_ALIAS_MINING_DAYS = env.int('CHATBOT_ALIAS_MINING_DAYS', default=30)
+CHATBOT_ALIAS_MIN_SCORE = env.float('CHATBOT_ALIAS_MIN_SCORE', default=0.8)
+CHATBOT_ALIAS_MIN_OCCURRENCES = env.int('CHATBOT_ALIAS_MIN_OCCURRENCES', default=3)
+# Hilos por proceso que codifican preguntas para el endpoint asíncrono (api/chatbot/query/async/,
+# pensado para servirse con ASGI: aquanq_noticias.asgi:application).
+CHATBOT_ENCODE_WORKERS = env.int('CHATBOT_ENCODE_WORKERS', default=2)
+# Máximo de preguntas por petición en api/chatbot/query/batch/.
+CHATBOT_BATCH_MAX_QUESTIONS = env.int('CHATBOT_BATCH_MAX_QUESTIONS', default=50)
+
+# Limitador de consultas del chatbot: cubetas de tokens por usuario autenticado, o por IP y
+# sesión para los anónimos, que se rellenan en CHATBOT_RATE_LIMIT_PERIOD segundos. Una respuesta
+# en caché cuesta CACHE_COST tokens; la inferencia con el modelo cuesta además INFERENCE_COST.
+# Las cubetas viven en CACHES: sin una caché compartida (CACHE_URL) cada worker cuenta por su
+# lado y el límite efectivo se multiplica por el número de workers.
+CHATBOT_RATE_LIMIT_ENABLED = env.bool('CHATBOT_RATE_LIMIT_ENABLED', default=True)
+CHATBOT_RATE_LIMIT_PERIOD = env.int('CHATBOT_RATE_LIMIT_PERIOD', default=60)
+CHATBOT_RATE_LIMIT_USER_CAPACITY = env.int('CHATBOT_RATE_LIMIT_USER_CAPACITY', default=60)
+CHATBOT_RATE_LIMIT_SESSION_CAPACITY = env.int('CHATBOT_RATE_LIMIT_SESSION_CAPACITY', default=30)
+CHATBOT_RATE_LIMIT_IP_CAPACITY = env.int('CHATBOT_RATE_LIMIT_IP_CAPACITY', default=300)
+CHATBOT_RATE_LIMIT_CACHE_COST = env.int('CHATBOT_RATE_LIMIT_CACHE_COST', default=1)
+CHATBOT_RATE_LIMIT_INFERENCE_COST = env.int('CHATBOT_RATE_LIMIT_INFERENCE_COST', default=5)
+# Activar solo detrás de un proxy que agregue X-Forwarded-For (nginx); si no, se usa REMOTE_ADDR.
+CHATBOT_RATE_LIMIT_TRUST_FORWARDED = env.bool('CHATBOT_RATE_LIMIT_TRUST_FORWARDED', default=False)
+
+# Cola de notificaciones push: publicar un evento solo encola el envío y el worker
+# `python manage.py process_notification_queue` lo procesa. Los envíos que fallan se
+# reintentan con espera exponencial con jitter (RETRY_DELAY, 2×, 4×, ... hasta RETRY_MAX) hasta
+# MAX_ATTEMPTS intentos; los lotes ya entregados no se reenvían.
+NOTIFICATIONS_QUEUE_BATCH_SIZE = env.int('NOTIFICATIONS_QUEUE_BATCH_SIZE', default=10)
+NOTIFICATIONS_JOB_MAX_ATTEMPTS = env.int('NOTIFICATIONS_JOB_MAX_ATTEMPTS', default=5)
+NOTIFICATIONS_JOB_RETRY_DELAY = env.int('NOTIFICATIONS_JOB_RETRY_DELAY', default=30)
+NOTIFICATIONS_JOB_RETRY_MAX = env.int('NOTIFICATIONS_JOB_RETRY_MAX', default=3600)
+NOTIFICATIONS_JOB_LOCK_TIMEOUT = env.int('NOTIFICATIONS_JOB_LOCK_TIMEOUT', default=600)
+# Hilos por worker que envían lotes de hasta 500 tokens a FCM en paralelo.
+NOTIFICATIONS_SEND_WORKERS = env.int('NOTIFICATIONS_SEND_WORKERS', default=4)
+# Dentro de cada lote, los tokens con errores transitorios de FCM (UNAVAILABLE, INTERNAL, cuota)
+# se reintentan hasta SEND_MAX_RETRIES veces con espera exponencial desde SEND_RETRY_BASE segundos.
+NOTIFICATIONS_SEND_MAX_RETRIES = env.int('NOTIFICATIONS_SEND_MAX_RETRIES', default=3)
+NOTIFICATIONS_SEND_RETRY_BASE = env.float('NOTIFICATIONS_SEND_RETRY_BASE', default=1.0)
+NOTIFICATIONS_SEND_RETRY_MAX = env.float('NOTIFICATIONS_SEND_RETRY_MAX', default=30.0)
+# Transporte push: 'fcm' (Firebase) o 'fake' (FCM simulado en proceso, para pruebas de carga;
+# ver `python manage.py simulate_push_broadcast`). Latencia en segundos y tasas de fallo por token.
+NOTIFICATIONS_PUSH_TRANSPORT = env('NOTIFICATIONS_PUSH_TRANSPORT', default='fcm')
+NOTIFICATIONS_FAKE_LATENCY = env.float('NOTIFICATIONS_FAKE_LATENCY', default=0.05)
+NOTIFICATIONS_FAKE_FAILURE_RATE = env.float('NOTIFICATIONS_FAKE_FAILURE_RATE', default=0.0)
+NOTIFICATIONS_FAKE_INVALID_RATE = env.float('NOTIFICATIONS_FAKE_INVALID_RATE', default=0.0)
+NOTIFICATIONS_FAKE_BATCH_FAILURE_RATE = env.float('NOTIFICATIONS_FAKE_BATCH_FAILURE_RATE', default=0.0)
+# Contador de notificaciones no leídas por usuario (api/notifications/unread-count/) en caché;
+# se invalida al crear notificaciones, al marcarlas como leídas y al cambiar la audiencia del
+# usuario. Las invalidaciones solo alcanzan a todos los workers con una caché compartida
+# (CACHE_URL); con LocMem el contador dura LOCAL_CACHE_TIMEOUT segundos.
+NOTIFICATIONS_UNREAD_CACHE_TIMEOUT = env.int('NOTIFICATIONS_UNREAD_CACHE_TIMEOUT', default=60 * 60 * 24)
+NOTIFICATIONS_UNREAD_LOCAL_CACHE_TIMEOUT = env.int('NOTIFICATIONS_UNREAD_LOCAL_CACHE_TIMEOUT', default=30)
+# `python manage.py prune_device_tokens`: desactiva los tokens con TOKEN_MAX_FAILURES envíos
+# fallidos o sin registrarse en TOKEN_STALE_DAYS días, y elimina los inactivos TOKEN_PRUNE_DAYS
+# días después de su último fallo o de su desactivación por falta de uso.
+NOTIFICATIONS_TOKEN_MAX_FAILURES = env.int('NOTIFICATIONS_TOKEN_MAX_FAILURES', default=10)
+NOTIFICATIONS_TOKEN_PRUNE_DAYS = env.int('NOTIFICATIONS_TOKEN_PRUNE_DAYS', default=90)
+NOTIFICATIONS_TOKEN_STALE_DAYS = env.int('NOTIFICATIONS_TOKEN_STALE_DAYS', default=270)
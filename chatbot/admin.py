@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ChatbotKnowledgeBase, ChatbotCategory, ChatConversation
+from .models import ChatbotKnowledgeBase, ChatbotCategory, ChatConversation, ChatbotDailyStats, ChatConversationRollup, ChatbotKnowledgeVector, ChatbotQuestionAlias
 from core.admin import AuditModelAdmin
 
 @admin.register(ChatbotCategory)
@@ -7,6 +7,17 @@ class ChatbotCategoryAdmin(AuditModelAdmin):
     list_display = ('name', 'created_at', 'updated_at')
     search_fields = ('name',)
 
+class ChatbotKnowledgeVectorInline(admin.TabularInline):
+    """Vectores adicionales generados automáticamente (solo lectura)."""
+    model = ChatbotKnowledgeVector
+    fields = ('source', 'text', 'created_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(ChatbotKnowledgeBase)
 class ChatbotKnowledgeBaseAdmin(AuditModelAdmin):
     list_display = ('question', 'category', 'view_count', 'is_active', 'created_at')
@@ -14,6 +25,36 @@ class ChatbotKnowledgeBaseAdmin(AuditModelAdmin):
     search_fields = ('question', 'answer', 'keywords')
     autocomplete_fields = ['category', 'recommended_questions']
     filter_horizontal = ('recommended_questions',)
+    inlines = [ChatbotKnowledgeVectorInline]
+
+@admin.register(ChatbotQuestionAlias)
+class ChatbotQuestionAliasAdmin(AuditModelAdmin):
+    list_display = ('alias', 'knowledge', 'status', 'occurrences', 'average_score', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('alias', 'knowledge__question')
+    autocomplete_fields = ['knowledge']
+    readonly_fields = ('normalized_alias', 'occurrences', 'average_score', 'created_by', 'created_at', 'updated_by', 'updated_at')
+    exclude = ('embedding',)
+    list_select_related = ('knowledge',)
+    actions = ['aprobar', 'rechazar']
+
+    @admin.action(description='Aprobar alias seleccionados')
+    def aprobar(self, request, queryset):
+        from .services.service_ai import _model_manager
+        from .services.service_alias import aprobar_alias
+        total = aprobar_alias(queryset, encoder=_model_manager.model, usuario=request.user)
+        self.message_user(request, f'{total} alias aprobados.')
+
+    @admin.action(description='Rechazar alias seleccionados')
+    def rechazar(self, request, queryset):
+        from .services.service_alias import rechazar_alias
+        total = rechazar_alias(queryset, usuario=request.user)
+        self.message_user(request, f'{total} alias rechazados.')
+
+    def save_model(self, request, obj, form, change):
+        from .services.service_alias import normalizar_texto
+        obj.normalized_alias = normalizar_texto(obj.alias)
+        super().save_model(request, obj, form, change)
 
 @admin.register(ChatConversation)
 class ChatConversationAdmin(AuditModelAdmin):
@@ -22,3 +63,18 @@ class ChatConversationAdmin(AuditModelAdmin):
     search_fields = ('question_text', 'answer_text', 'user__username')
     autocomplete_fields = ['user', 'matched_knowledge']
     readonly_fields = ('session_id', 'question_text', 'answer_text', 'matched_knowledge', 'user', 'created_by', 'created_at', 'updated_by', 'updated_at')
+
+
+@admin.register(ChatbotDailyStats)
+class ChatbotDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'total_conversations', 'matched_conversations', 'updated_at')
+    date_hierarchy = 'fecha'
+    readonly_fields = ('fecha', 'total_conversations', 'matched_conversations', 'updated_at')
+
+
+@admin.register(ChatConversationRollup)
+class ChatConversationRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket_start', 'granularity', 'category', 'knowledge', 'matched', 'search_method', 'conversations')
+    list_filter = ('granularity', 'matched', 'search_method')
+    date_hierarchy = 'bucket_start'
+    list_select_related = ('category', 'knowledge')
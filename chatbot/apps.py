@@ -6,4 +6,5 @@ class ChatbotConfig(AppConfig):
     name = 'chatbot'
     
     def ready(self):
-        import chatbot.models  # Esto activará los signals
\ No newline at end of file
+        import chatbot.models  # Esto activará los signals
+        import chatbot.signals
\ No newline at end of file
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from chatbot.services.service_retention import (
+    ARCHIVE_DIR,
+    BATCH_SIZE,
+    HOURLY_ROLLUP_RETENTION_DAYS,
+    RETENTION_DAYS,
+    archivar_conversaciones,
+    podar_rollups_horarios,
+)
+
+
+class Command(BaseCommand):
+    help = 'Archiva en JSONL comprimido y elimina por lotes las conversaciones del chatbot más antiguas que la retención.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=RETENTION_DAYS, help=f'Días de retención (default: {RETENTION_DAYS}).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Conversaciones por lote (default: {BATCH_SIZE}).')
+        parser.add_argument('--output-dir', type=str, default=ARCHIVE_DIR, help='Directorio de los archivos .jsonl.gz.')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pausa en segundos entre lotes para aliviar la base de datos.')
+        parser.add_argument('--no-rollup', action='store_true', help='No consolidar los agregados antes de eliminar.')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar las conversaciones que se archivarían.')
+
+    def handle(self, *args, **options):
+        """
+        Mantiene pequeña la tabla de conversaciones. Los agregados diarios conservan el
+        resumen de lo archivado; los horarios se podan según CHATBOT_HOURLY_ROLLUP_RETENTION_DAYS.
+        """
+        resumen = archivar_conversaciones(
+            dias=options['days'],
+            directorio=options['output_dir'],
+            batch_size=options['batch_size'],
+            pausa=options['sleep'],
+            consolidar=not options['no_rollup'],
+            dry_run=options['dry_run'],
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"Se archivarían {resumen['archivadas']} conversaciones anteriores a {resumen['limite']:%Y-%m-%d %H:%M}.")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archivadas {resumen['archivadas']} conversaciones en {resumen['lotes']} lotes ({resumen['directorio']})."
+        ))
+
+        podados = podar_rollups_horarios(HOURLY_ROLLUP_RETENTION_DAYS, dias_conversaciones=options['days'])
+        if podados:
+            self.stdout.write(f"Agregados horarios podados: {podados}.")
@@ -0,0 +1,79 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.services.service_benchmark import TIPOS_CONSULTA, EncoderSimulado, ejecutar_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia y las consultas SQL del chatbot sobre bases de conocimiento sintéticas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='100,1000', help='Tamaños de la base sintética, separados por coma (default: 100,1000).')
+        parser.add_argument('--queries-per-type', type=int, default=25, help='Consultas por tipo (default: 25).')
+        parser.add_argument('--types', type=str, default=','.join(TIPOS_CONSULTA), help=f"Tipos de consulta ({', '.join(TIPOS_CONSULTA)}).")
+        parser.add_argument('--seed', type=int, default=42, help='Semilla para generar la base y las consultas.')
+        parser.add_argument('--stub-encoder', action='store_true', help='Usar un encoder simulado en lugar del modelo real.')
+        parser.add_argument('--dimension', type=int, default=256, help='Dimensión del encoder simulado (default: 256).')
+        parser.add_argument('--use-cache', action='store_true', help='Medir con la caché de respuestas activada.')
+        parser.add_argument('--keep-existing', action='store_true', help='No desactivar la base real durante la corrida.')
+        parser.add_argument('--allow-production', action='store_true', help='Permitir desactivar (y bloquear) las entradas reales durante la corrida.')
+        parser.add_argument('--json', type=str, default=None, help='Guardar el informe completo en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        """
+        Todo se hace dentro de una transacción revertida: la base sintética no se conserva.
+        Sobre una base con entradas activas exige --keep-existing o --allow-production.
+        Ejemplo: python manage.py benchmark_chatbot --sizes 100,1000,10000,50000 --stub-encoder
+        """
+        try:
+            tamanos = [int(t) for t in options['sizes'].split(',') if t.strip()]
+        except ValueError:
+            raise CommandError('--sizes debe ser una lista de enteros separados por coma.')
+        tipos = [t.strip() for t in options['types'].split(',') if t.strip()]
+        desconocidos = set(tipos) - set(TIPOS_CONSULTA)
+        if desconocidos:
+            raise CommandError(f"Tipos de consulta desconocidos: {', '.join(sorted(desconocidos))}")
+
+        encoder = EncoderSimulado(options['dimension']) if options['stub_encoder'] else None
+        informes = []
+        for tamano in tamanos:
+            self.stdout.write(f"Base sintética de {tamano} entradas...")
+            try:
+                informe = ejecutar_benchmark(
+                    tamano,
+                    por_tipo=options['queries_per_type'],
+                    seed=options['seed'],
+                    encoder=encoder,
+                    use_cache=options['use_cache'],
+                    aislar=not options['keep_existing'],
+                    permitir_produccion=options['allow_production'],
+                    tipos=tipos,
+                )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            informes.append(informe)
+            self._imprimir(informe)
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as archivo:
+                json.dump(informes, archivo, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Informe guardado en {options['json']}"))
+
+    def _imprimir(self, informe):
+        latencia = informe['latency']
+        self.stdout.write(self.style.SUCCESS(
+            f"{informe['kb_size']} entradas ({informe['encoder']}, carga {informe['seed_seconds']}s): "
+            f"p50 {latencia['p50_ms']} ms | p90 {latencia['p90_ms']} ms | p99 {latencia['p99_ms']} ms"
+        ))
+        self.stdout.write(f"  {'tipo':<15}{'n':>5}{'acierto':>9}{'p50 ms':>10}{'p99 ms':>10}{'sql/cons':>10}")
+        for tipo, datos in informe['by_type'].items():
+            self.stdout.write(
+                f"  {tipo:<15}{datos['queries']:>5}{datos['accuracy']:>9.2f}"
+                f"{datos['p50_ms']:>10.2f}{datos['p99_ms']:>10.2f}{datos['sql_per_query']:>10.2f}"
+            )
+        self.stdout.write(f"  {'etapa':<19}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'sql':>8}{'sql/cons':>10}")
+        for etapa, datos in sorted(informe['stages'].items()):
+            p50 = f"{datos['p50_ms']:.2f}" if datos.get('p50_ms') is not None else '-'
+            p99 = f"{datos['p99_ms']:.2f}" if datos.get('p99_ms') is not None else '-'
+            self.stdout.write(
+                f"  {etapa:<19}{datos['count']:>6}{p50:>10}{p99:>10}{datos['sql_queries']:>8}{datos['sql_per_query']:>10.2f}"
+            )
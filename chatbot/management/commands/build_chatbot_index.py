@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.services.service_index import INDEX_BACKEND, INDEX_DIR, INDICES, publicar_indice
+
+
+class Command(BaseCommand):
+    help = 'Construye el índice vectorial del chatbot, lo guarda en disco y publica su versión.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', type=str, default=INDEX_BACKEND, choices=sorted(INDICES), help=f'Backend del índice (default: {INDEX_BACKEND}).')
+        parser.add_argument('--output-dir', type=str, default=INDEX_DIR, help='Directorio del índice persistido.')
+
+    def handle(self, *args, **options):
+        """
+        Los procesos cargan el índice persistido con memory mapping al notar el cambio de
+        CURRENT. Los cambios posteriores de la base se publican solos (ver service_index).
+        """
+        try:
+            indice = publicar_indice(options['backend'], options['output_dir'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Índice '{indice.backend}' con {len(indice)} entradas (dimensión {indice.dimension}) guardado en {options['output_dir']}."
+        ))
@@ -0,0 +1,55 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.services.service_ai import ChatbotServiceError
+from chatbot.services.service_evaluation import CONFIGURACIONES, TOP_K, cargar_casos, evaluar
+
+
+class Command(BaseCommand):
+    help = 'Evalúa offline la calidad de recuperación (accuracy@1/@3, MRR y latencia) de las configuraciones de búsqueda.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('labeled_file', type=str, help='Archivo JSON con consultas etiquetadas (p. ej. kb_data.json con "paraphrases").')
+        parser.add_argument('--configs', type=str, default='pipeline,embeddings', help='Configuraciones a comparar, separadas por coma.')
+        parser.add_argument('--k', type=int, default=TOP_K, help=f'Candidatos por consulta para el MRR (default: {TOP_K}).')
+        parser.add_argument('--allow-production', action='store_true', help="Permitir que 'pipeline' bloquee las entradas reales durante la evaluación.")
+        parser.add_argument('--json', type=str, default=None, help='Guardar los resultados en este archivo JSON.')
+
+    def handle(self, *args, **options):
+        """
+        Se evalúa contra la base de conocimiento actual; los contadores de vistas que
+        incremente el pipeline se revierten al terminar. Con entradas activas, la
+        configuración 'pipeline' exige --allow-production.
+        """
+        try:
+            casos, omitidas = cargar_casos(options['labeled_file'])
+        except FileNotFoundError:
+            raise CommandError(f'El archivo "{options["labeled_file"]}" no fue encontrado.')
+        except json.JSONDecodeError:
+            raise CommandError('Error al decodificar el JSON. Asegúrate de que el archivo tiene un formato válido.')
+
+        for pregunta in omitidas:
+            self.stderr.write(self.style.WARNING(f'Omitida (no está activa en la base): {pregunta}'))
+        if not casos:
+            raise CommandError('El archivo no contiene consultas evaluables.')
+
+        configuraciones = [c.strip() for c in options['configs'].split(',') if c.strip()]
+        try:
+            resultados = evaluar(casos, configuraciones, k=options['k'], permitir_produccion=options['allow_production'])
+        except ValueError as e:
+            raise CommandError(f"{e}. Disponibles: {', '.join(sorted(CONFIGURACIONES))}")
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        except ChatbotServiceError as e:
+            raise CommandError(f'No se pudo evaluar: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{len(casos)} consultas evaluadas.'))
+        self.stdout.write(f"{'configuración':<20}{'acc@1':>8}{'acc@3':>8}{'MRR':>8}{'FP ood':>8}{'p50 ms':>10}{'p99 ms':>10}")
+        for nombre, r in resultados.items():
+            celdas = [r['accuracy@1'], r['accuracy@3'], r['mrr'], r['false_positive_rate']]
+            texto = ''.join(f'{valor:>8.3f}' if valor is not None else f"{'-':>8}" for valor in celdas)
+            self.stdout.write(f"{nombre:<20}{texto}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as archivo:
+                json.dump({'queries': len(casos), 'results': resultados}, archivo, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['json']}"))
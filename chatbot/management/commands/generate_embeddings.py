@@ -1,34 +1,34 @@
 from django.core.management.base import BaseCommand
-from django.db.models import F
 from chatbot.models import ChatbotKnowledgeBase
-from sentence_transformers import SentenceTransformer
-import torch
+from chatbot.services.service_ai import _model_manager
+from chatbot.services.service_index import INDEX_DIR, publicar_indice
+from chatbot.services.service_vectors import EXTRA_SOURCES, FUENTES, regenerar_vectores
 
 class Command(BaseCommand):
     help = 'Genera y guarda los embeddings para las preguntas de la base de conocimiento del chatbot.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Entradas por actualización en la base de datos (default: 500).')
+        parser.add_argument(
+            '--extra-sources', type=str, default=','.join(EXTRA_SOURCES),
+            help=f"Vectores adicionales por entrada, separados por coma ({', '.join(FUENTES)}). Por defecto CHATBOT_INDEX_EXTRA_SOURCES."
+        )
+        parser.add_argument('--index-dir', type=str, default=INDEX_DIR, help='Directorio donde se publica el índice .npy versionado.')
+
     def handle(self, *args, **options):
         """
         El punto de entrada principal para el comando de Django.
-        Carga el modelo, procesa las preguntas y guarda los embeddings.
+        Usa el modelo del servicio, procesa las preguntas, guarda los embeddings y
+        publica una versión nueva del índice en disco para todos los workers.
         """
         self.stdout.write("Iniciando la generación de embeddings para el chatbot...")
 
-        # Determinar el dispositivo a usar (GPU si está disponible, si no CPU)
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.stdout.write(f"Usando dispositivo: {device}")
-
-        try:
-            # Cargar un modelo de transformador de frases pre-entrenado para español.
-            # Este modelo es excelente para tareas de similitud de texto.
-            # La primera vez que se ejecute, descargará el modelo (puede tardar).
-            model = SentenceTransformer('hiiamsid/sentence_similarity_spanish_es', device=device)
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f"Error al cargar el modelo de SentenceTransformer: {e}"))
+        if not _model_manager.is_available():
+            self.stderr.write(self.style.ERROR("Error al cargar el modelo de SentenceTransformer."))
             return
 
         # Obtener todas las preguntas de la base de conocimiento que necesitan un embedding.
-        knowledge_base = ChatbotKnowledgeBase.objects.all()
+        knowledge_base = list(ChatbotKnowledgeBase.objects.only('id', 'question', 'keywords', 'answer'))
         questions_to_process = [item.question for item in knowledge_base]
 
         if not questions_to_process:
@@ -40,16 +40,26 @@ class Command(BaseCommand):
         try:
             # Convertir todas las preguntas a embeddings.
             # La librería procesa esto en un lote (batch), lo cual es muy eficiente.
-            embeddings = model.encode(questions_to_process, show_progress_bar=True)
+            embeddings = _model_manager.model.encode(questions_to_process, show_progress_bar=True)
         except Exception as e:
             self.stderr.write(self.style.ERROR(f"Error durante la codificación de las preguntas: {e}"))
             return
 
-        # Guardar cada embedding en su objeto correspondiente en la base de datos.
+        # Guardar los embeddings por lotes (bulk_update no dispara signals).
         self.stdout.write("Guardando los embeddings en la base de datos...")
         for i, item in enumerate(knowledge_base):
             # El embedding se convierte a una lista de Python para ser compatible con el JSONField.
             item.question_embedding = embeddings[i].tolist()
-            item.save(update_fields=['question_embedding'])
+        ChatbotKnowledgeBase.objects.bulk_update(knowledge_base, ['question_embedding'], batch_size=options['batch_size'])
+
+        fuentes = [f.strip() for f in options['extra_sources'].split(',') if f.strip() in FUENTES]
+        if fuentes:
+            self.stdout.write(f"Generando vectores adicionales ({', '.join(fuentes)})...")
+            total = regenerar_vectores(knowledge_base, _model_manager.model, fuentes=fuentes, batch_size=options['batch_size'])
+            self.stdout.write(f"{total} vectores adicionales guardados.")
+
+        # Publicar el índice: nuevo .npy versionado y cambio atómico del puntero CURRENT.
+        indice = publicar_indice(directorio=options['index_dir'])
+        self.stdout.write(f"Índice '{indice.backend}' publicado en {options['index_dir']} ({len(indice)} entradas).")
 
-        self.stdout.write(self.style.SUCCESS(f"¡Proceso completado! Se han generado y guardado {len(knowledge_base)} embeddings.")) 
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"¡Proceso completado! Se han generado y guardado {len(knowledge_base)} embeddings."))
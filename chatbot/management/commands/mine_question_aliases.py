@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from chatbot.services.service_alias import ALIAS_MIN_OCCURRENCES, ALIAS_MIN_SCORE, ALIAS_MINING_DAYS, minar_alias
+
+
+class Command(BaseCommand):
+    help = 'Propone alias de preguntas a partir de las conversaciones resueltas por similitud semántica.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ALIAS_MINING_DAYS, help=f'Ventana de conversaciones a revisar (default: {ALIAS_MINING_DAYS}).')
+        parser.add_argument('--min-score', type=float, default=ALIAS_MIN_SCORE, help=f'Puntaje mínimo de la coincidencia (default: {ALIAS_MIN_SCORE}).')
+        parser.add_argument('--min-occurrences', type=int, default=ALIAS_MIN_OCCURRENCES, help=f'Repeticiones mínimas de la formulación (default: {ALIAS_MIN_OCCURRENCES}).')
+
+    def handle(self, *args, **options):
+        """
+        Los alias quedan pendientes: se aprueban o rechazan desde el admin, y solo los
+        aprobados se resuelven por búsqueda exacta.
+        """
+        resultado = minar_alias(options['days'], options['min_score'], options['min_occurrences'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['propuestos']} alias propuestos, {resultado['actualizados']} actualizados, "
+            f"{resultado['ambiguos']} formulaciones ambiguas descartadas."
+        ))
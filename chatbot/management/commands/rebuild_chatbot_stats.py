@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chatbot.services.service_statistics import reconstruir_estadisticas_diarias
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las estadísticas diarias del chatbot a partir del historial de conversaciones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Recalcular solo los últimos N días (por defecto, todo el historial).'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Los contadores se mantienen de forma incremental; este comando sirve para
+        el backfill inicial o para corregir desvíos.
+        """
+        desde = None
+        if options['days'] is not None:
+            desde = timezone.localdate() - timedelta(days=max(options['days'] - 1, 0))
+
+        dias = reconstruir_estadisticas_diarias(desde=desde)
+        self.stdout.write(self.style.SUCCESS(f"Estadísticas recalculadas para {dias} días."))
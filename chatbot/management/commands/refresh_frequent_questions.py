@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from chatbot.services.service_leaderboard import refrescar_ranking, LEADERBOARD_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el ranking de preguntas frecuentes del chatbot y lo guarda en caché.'
+
+    def handle(self, *args, **options):
+        """
+        Pensado para ejecutarse de forma programada (cron) y mantener caliente
+        el ranking que leen los endpoints de preguntas frecuentes y recomendadas.
+        """
+        ranking = refrescar_ranking()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranking actualizado: {len(ranking)} preguntas (top {LEADERBOARD_SIZE})."
+        ))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chatbot.services.service_rollup import consolidar_conversaciones, consolidar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Consolida las conversaciones del chatbot en agregados por hora y por día.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=None,
+            help='Recalcular las últimas N horas. Por defecto continúa desde el último agregado.'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Pensado para ejecutarse de forma programada (por ejemplo, cada 15 minutos).
+        Cada intervalo se reemplaza completo, por lo que es seguro repetirlo.
+        """
+        if options['hours'] is not None:
+            fin = timezone.now()
+            horas = consolidar_conversaciones(fin - timedelta(hours=options['hours']), fin)
+        else:
+            horas = consolidar_pendientes()
+        self.stdout.write(self.style.SUCCESS(f"Agregados actualizados ({horas} intervalos horarios procesados)."))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0010_add_is_active_to_category'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatbotknowledgebase',
+            index=models.Index(fields=['is_active', 'view_count'], name='chatbot_kb_active_views_idx'),
+        ),
+    ]
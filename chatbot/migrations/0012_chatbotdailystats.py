@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:25
+
+from collections import Counter
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def poblar_estadisticas_diarias(apps, schema_editor):
+    """Backfill de los contadores diarios con el historial existente (una sola pasada)."""
+    ChatConversation = apps.get_model('chatbot', 'ChatConversation')
+    ChatbotDailyStats = apps.get_model('chatbot', 'ChatbotDailyStats')
+
+    totales = Counter()
+    con_coincidencia = Counter()
+    filas = ChatConversation.objects.values_list('created_at', 'matched_knowledge_id').iterator(chunk_size=2000)
+    for created_at, matched_knowledge_id in filas:
+        fecha = timezone.localtime(created_at).date()
+        totales[fecha] += 1
+        if matched_knowledge_id:
+            con_coincidencia[fecha] += 1
+
+    ChatbotDailyStats.objects.bulk_create([
+        ChatbotDailyStats(fecha=fecha, total_conversations=total, matched_conversations=con_coincidencia[fecha])
+        for fecha, total in totales.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_chatbotknowledgebase_active_views_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatbotDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('total_conversations', models.PositiveIntegerField(default=0, verbose_name='Conversaciones')),
+                ('matched_conversations', models.PositiveIntegerField(default=0, verbose_name='Conversaciones con coincidencia')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Fecha de actualización')),
+            ],
+            options={
+                'verbose_name': 'Estadística Diaria del Chatbot',
+                'verbose_name_plural': 'Estadísticas Diarias del Chatbot',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chatconversation',
+            index=models.Index(fields=['created_at'], name='chatbot_conv_created_idx'),
+        ),
+        migrations.RunPython(poblar_estadisticas_diarias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_chatbotdailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatconversation',
+            name='score',
+            field=models.FloatField(blank=True, null=True, verbose_name='Puntaje de similitud'),
+        ),
+        migrations.AddField(
+            model_name='chatconversation',
+            name='search_method',
+            field=models.CharField(blank=True, default='', max_length=30, verbose_name='Método de búsqueda'),
+        ),
+        migrations.CreateModel(
+            name='ChatConversationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hora'), ('day', 'Día')], max_length=4, verbose_name='Granularidad')),
+                ('bucket_start', models.DateTimeField(verbose_name='Inicio del intervalo')),
+                ('matched', models.BooleanField(default=False, verbose_name='Con coincidencia')),
+                ('search_method', models.CharField(blank=True, default='', max_length=30, verbose_name='Método de búsqueda')),
+                ('conversations', models.PositiveIntegerField(default=0, verbose_name='Conversaciones')),
+                ('score_sum', models.FloatField(default=0, verbose_name='Suma de puntajes')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chatbot.chatbotcategory', verbose_name='Categoría')),
+                ('knowledge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chatbot.chatbotknowledgebase', verbose_name='Conocimiento')),
+            ],
+            options={
+                'verbose_name': 'Agregado de Conversaciones',
+                'verbose_name_plural': 'Agregados de Conversaciones',
+                'ordering': ['-bucket_start'],
+                'indexes': [models.Index(fields=['granularity', 'bucket_start'], name='chatbot_rollup_bucket_idx')],
+            },
+        ),
+    ]
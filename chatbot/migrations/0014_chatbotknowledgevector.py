@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0013_chatconversationrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatbotKnowledgeVector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('keyword', 'Frase de keywords'), ('answer', 'Resumen de la respuesta')], max_length=20, verbose_name='Origen')),
+                ('text', models.CharField(max_length=300, verbose_name='Texto')),
+                ('embedding', models.JSONField(verbose_name='Embedding')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('knowledge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vectors', to='chatbot.chatbotknowledgebase', verbose_name='Conocimiento')),
+            ],
+            options={
+                'verbose_name': 'Vector Adicional de Conocimiento',
+                'verbose_name_plural': 'Vectores Adicionales de Conocimiento',
+                'indexes': [models.Index(fields=['knowledge', 'source'], name='chatbot_vector_source_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0014_chatbotknowledgevector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatbotQuestionAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Fecha de actualización')),
+                ('alias', models.CharField(max_length=255, verbose_name='Alias')),
+                ('normalized_alias', models.CharField(max_length=255, unique=True, verbose_name='Alias normalizado')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('approved', 'Aprobado'), ('rejected', 'Rechazado')], default='pending', max_length=10, verbose_name='Estado')),
+                ('occurrences', models.PositiveIntegerField(default=0, verbose_name='Ocurrencias')),
+                ('average_score', models.FloatField(blank=True, null=True, verbose_name='Puntaje promedio')),
+                ('embedding', models.JSONField(blank=True, null=True, verbose_name='Embedding')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_created_by', to=settings.AUTH_USER_MODEL, verbose_name='Creado por')),
+                ('knowledge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='chatbot.chatbotknowledgebase', verbose_name='Conocimiento')),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_updated_by', to=settings.AUTH_USER_MODEL, verbose_name='Actualizado por')),
+            ],
+            options={
+                'verbose_name': 'Alias de Pregunta',
+                'verbose_name_plural': 'Alias de Preguntas',
+                'ordering': ['-occurrences'],
+                'indexes': [models.Index(fields=['status', 'knowledge'], name='chatbot_alias_status_idx')],
+            },
+        ),
+    ]
@@ -42,6 +42,10 @@ class ChatbotKnowledgeBase(BaseModelWithAudit):
         verbose_name = "Base de Conocimiento del Chatbot"
         verbose_name_plural = "Bases de Conocimiento del Chatbot"
         ordering = ['-created_at']  # Ordenar por más reciente primero
+        indexes = [
+            # Consulta de respaldo del ranking de preguntas frecuentes
+            models.Index(fields=['is_active', 'view_count'], name='chatbot_kb_active_views_idx'),
+        ]
 
     def __str__(self):
         return self.question
@@ -49,11 +53,7 @@ class ChatbotKnowledgeBase(BaseModelWithAudit):
     def generate_embedding(self):
         """Generar embedding para la pregunta usando el modelo AI"""
         try:
-            from .services.service_ai import _ModelManager
-            
-            model_manager = _ModelManager()
-            if not model_manager.model:
-                model_manager._load_model()
+            from .services.service_ai import _model_manager as model_manager
             
             if model_manager.model:
                 embedding = model_manager.model.encode([self.question])
@@ -97,12 +97,166 @@ class ChatConversation(BaseModelWithAudit):
         blank=True,
         verbose_name="Conocimiento Coincidente"
     )
+    search_method = models.CharField(max_length=30, blank=True, default='', verbose_name="Método de búsqueda")
+    score = models.FloatField(null=True, blank=True, verbose_name="Puntaje de similitud")
 
     class Meta:
         verbose_name = "Conversación de Chat"
         verbose_name_plural = "Conversaciones de Chat"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='chatbot_conv_created_idx'),
+        ]
 
     def __str__(self):
         user_display = self.user.username if self.user else "Anónimo"
         return f"Conversación con {user_display} a las {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ChatbotDailyStats(models.Model):
+    """
+    Contadores diarios de conversaciones del chatbot.
+
+    Se actualizan de forma incremental al registrar cada conversación, de modo que
+    las estadísticas no necesitan recorrer la tabla de conversaciones.
+    """
+    fecha = models.DateField(unique=True, verbose_name="Fecha")
+    total_conversations = models.PositiveIntegerField(default=0, verbose_name="Conversaciones")
+    matched_conversations = models.PositiveIntegerField(default=0, verbose_name="Conversaciones con coincidencia")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Fecha de actualización")
+
+    class Meta:
+        verbose_name = "Estadística Diaria del Chatbot"
+        verbose_name_plural = "Estadísticas Diarias del Chatbot"
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"{self.fecha}: {self.total_conversations} conversaciones"
+
+
+class ChatConversationRollup(models.Model):
+    """
+    Agregado de conversaciones por hora o día × categoría × entrada × coincidencia × método.
+
+    Lo pobla el comando `rollup_conversations`; los endpoints de analítica leen de aquí
+    en lugar de recorrer `ChatConversation`.
+    """
+    GRANULARITY_HOUR = 'hour'
+    GRANULARITY_DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (GRANULARITY_HOUR, 'Hora'),
+        (GRANULARITY_DAY, 'Día'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES, verbose_name="Granularidad")
+    bucket_start = models.DateTimeField(verbose_name="Inicio del intervalo")
+    category = models.ForeignKey(
+        ChatbotCategory,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Categoría"
+    )
+    knowledge = models.ForeignKey(
+        ChatbotKnowledgeBase,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Conocimiento"
+    )
+    matched = models.BooleanField(default=False, verbose_name="Con coincidencia")
+    search_method = models.CharField(max_length=30, blank=True, default='', verbose_name="Método de búsqueda")
+    conversations = models.PositiveIntegerField(default=0, verbose_name="Conversaciones")
+    score_sum = models.FloatField(default=0, verbose_name="Suma de puntajes")
+
+    class Meta:
+        verbose_name = "Agregado de Conversaciones"
+        verbose_name_plural = "Agregados de Conversaciones"
+        ordering = ['-bucket_start']
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start'], name='chatbot_rollup_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_granularity_display()} {self.bucket_start:%Y-%m-%d %H:%M}: {self.conversations}"
+
+
+
+class ChatbotKnowledgeVector(models.Model):
+    """
+    Vector adicional de una entrada (frase de keywords, primera oración de la respuesta...).
+
+    El índice vectorial los incluye junto al de la pregunta y, al buscar, cada entrada
+    puntúa con el mejor de sus vectores (max-pooling). Se regeneran con `generate_embeddings`
+    o al guardar la entrada (en segundo plano), según CHATBOT_INDEX_EXTRA_SOURCES.
+    """
+    SOURCE_KEYWORD = 'keyword'
+    SOURCE_ANSWER = 'answer'
+    SOURCE_CHOICES = [
+        (SOURCE_KEYWORD, 'Frase de keywords'),
+        (SOURCE_ANSWER, 'Resumen de la respuesta'),
+    ]
+
+    knowledge = models.ForeignKey(
+        ChatbotKnowledgeBase,
+        on_delete=models.CASCADE,
+        related_name='vectors',
+        verbose_name="Conocimiento"
+    )
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, verbose_name="Origen")
+    text = models.CharField(max_length=300, verbose_name="Texto")
+    embedding = models.JSONField(verbose_name="Embedding")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+
+    class Meta:
+        verbose_name = "Vector Adicional de Conocimiento"
+        verbose_name_plural = "Vectores Adicionales de Conocimiento"
+        indexes = [
+            models.Index(fields=['knowledge', 'source'], name='chatbot_vector_source_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_source_display()}: {self.text}"
+
+
+class ChatbotQuestionAlias(BaseModelWithAudit):
+    """
+    Forma alternativa de formular la pregunta de una entrada, aprendida de las conversaciones.
+
+    Las aprobadas se resuelven por búsqueda exacta (texto normalizado) y se incluyen en el
+    índice vectorial. El comando `mine_question_aliases` propone alias pendientes de revisión.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_APPROVED = 'approved'
+    STATUS_REJECTED = 'rejected'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendiente'),
+        (STATUS_APPROVED, 'Aprobado'),
+        (STATUS_REJECTED, 'Rechazado'),
+    ]
+
+    knowledge = models.ForeignKey(
+        ChatbotKnowledgeBase,
+        on_delete=models.CASCADE,
+        related_name='aliases',
+        verbose_name="Conocimiento"
+    )
+    alias = models.CharField(max_length=255, verbose_name="Alias")
+    normalized_alias = models.CharField(max_length=255, unique=True, verbose_name="Alias normalizado")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Estado")
+    occurrences = models.PositiveIntegerField(default=0, verbose_name="Ocurrencias")
+    average_score = models.FloatField(null=True, blank=True, verbose_name="Puntaje promedio")
+    embedding = models.JSONField(null=True, blank=True, verbose_name="Embedding")
+
+    class Meta:
+        verbose_name = "Alias de Pregunta"
+        verbose_name_plural = "Alias de Preguntas"
+        ordering = ['-occurrences']
+        indexes = [
+            models.Index(fields=['status', 'knowledge'], name='chatbot_alias_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.alias} → {self.knowledge_id}"
@@ -6,24 +6,43 @@ from rest_framework import serializers
 from .models import ChatbotKnowledgeBase, ChatbotCategory, ChatConversation
 
 
+def _validar_pregunta(value):
+    if not value or not value.strip():
+        raise serializers.ValidationError("La pregunta no puede estar vacía.")
+    
+    value = value.strip()
+    
+    if len(value) < 3:
+        raise serializers.ValidationError("La pregunta debe tener al menos 3 caracteres.")
+    
+    if not any(c.isalpha() for c in value):
+        raise serializers.ValidationError("La pregunta debe contener al menos una letra.")
+    
+    return value
+
+
 class ChatbotQuerySerializer(serializers.Serializer):
     question = serializers.CharField(max_length=500, min_length=3)
     session_id = serializers.CharField(max_length=255, required=False, default='anonymous')
     use_cache = serializers.BooleanField(default=True, required=False)
 
     def validate_question(self, value):
-        if not value or not value.strip():
-            raise serializers.ValidationError("La pregunta no puede estar vacía.")
-        
-        value = value.strip()
-        
-        if len(value) < 3:
-            raise serializers.ValidationError("La pregunta debe tener al menos 3 caracteres.")
-        
-        if not any(c.isalpha() for c in value):
-            raise serializers.ValidationError("La pregunta debe contener al menos una letra.")
-        
-        return value
+        return _validar_pregunta(value)
+
+
+class ChatbotBatchQuerySerializer(serializers.Serializer):
+    questions = serializers.ListField(
+        child=serializers.CharField(max_length=500, min_length=3, validators=[_validar_pregunta]),
+        allow_empty=False
+    )
+    session_id = serializers.CharField(max_length=255, required=False, default='anonymous')
+    use_cache = serializers.BooleanField(default=True, required=False)
+
+    def validate_questions(self, value):
+        from .services.service_batch import BATCH_MAX_QUESTIONS
+        if len(value) > BATCH_MAX_QUESTIONS:
+            raise serializers.ValidationError(f"Se permiten como máximo {BATCH_MAX_QUESTIONS} preguntas por lote.")
+        return [_validar_pregunta(pregunta) for pregunta in value]
 
 
 class ChatbotKnowledgeBaseSerializer(serializers.ModelSerializer):
@@ -154,6 +173,7 @@ class ChatbotStatsSerializer(serializers.Serializer):
     total_knowledge_base = serializers.IntegerField()
     total_views = serializers.IntegerField()
     conversations_today = serializers.IntegerField()
+    matched_conversations_today = serializers.IntegerField(required=False)
     top_categories = serializers.ListField(child=serializers.DictField())
     average_score = serializers.FloatField(required=False)
     cache_hit_rate = serializers.FloatField(required=False) 
\ No newline at end of file
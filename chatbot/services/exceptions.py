@@ -25,7 +25,11 @@ class InvalidQuestionError(ChatbotServiceError):
 
 class RateLimitError(ChatbotServiceError):
     """Se lanza cuando se excede el límite de consultas."""
-    pass
+
+    def __init__(self, mensaje: str = '', retry_after: int = None):
+        super().__init__(mensaje)
+        # Segundos sugeridos antes de reintentar (cabecera Retry-After)
+        self.retry_after = retry_after
 
 
 # Nuevas excepciones para Knowledge Management
@@ -4,16 +4,28 @@ Servicio de IA para el chatbot.
 
 import logging
 import hashlib
+import time
 import numpy as np
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.db import transaction
-from sentence_transformers import SentenceTransformer, util
+from django.db.models import F
+from sentence_transformers import SentenceTransformer
 import torch
 
 from ..models import ChatbotKnowledgeBase, ChatConversation
+from .service_leaderboard import obtener_preguntas_frecuentes, registrar_vistas_en_ranking
+from .service_conversation import registrar_conversacion
+from .service_statistics import registrar_vista_en_estadisticas
+from .service_metrics import medir, incrementar, fijar
+from .service_index import normalizar, obtener_indice
+from .service_alias import SIN_BUSCAR, buscar_coincidencia_exacta
+from .service_rate_limit import COSTO_CACHE, COSTO_INFERENCIA, consumir, devolver, identidades
+from .exceptions import (
+    ChatbotServiceError, InvalidQuestionError, ModelNotAvailableError, NoKnowledgeBaseError, RateLimitError
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,22 +36,6 @@ CACHE_TIMEOUT = 3600
 CACHE_PREFIX = 'chatbot'
 
 
-class ChatbotServiceError(Exception):
-    pass
-
-class ModelNotAvailableError(ChatbotServiceError):
-    pass
-
-class NoKnowledgeBaseError(ChatbotServiceError):
-    pass
-
-class InvalidQuestionError(ChatbotServiceError):
-    pass
-
-class RateLimitError(ChatbotServiceError):
-    pass
-
-
 class ChatbotModelManager:
     _instance = None
     _model = None
@@ -52,6 +48,7 @@ class ChatbotModelManager:
     
     @classmethod
     def _load_model(cls):
+        inicio = time.perf_counter()
         try:
             device = 'cuda' if torch.cuda.is_available() else 'cpu'
             logger.info(f"Cargando modelo '{MODEL_NAME}' en {device}")
@@ -60,6 +57,8 @@ class ChatbotModelManager:
         except Exception as e:
             logger.error(f"Error al cargar modelo: {e}")
             cls._model = None
+        fijar('model_load_seconds', round(time.perf_counter() - inicio, 3))
+        fijar('model_loaded', 1 if cls._model is not None else 0)
     
     @property
     def model(self):
@@ -85,9 +84,11 @@ def _set_cached_response(question: str, response: Dict) -> None:
     cache.set(cache_key, response, CACHE_TIMEOUT)
 
 
-def _buscar_por_keywords(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
+def _buscar_por_keywords(pregunta: str, entradas: Optional[List[ChatbotKnowledgeBase]] = None
+                         ) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
     """
     Busca coincidencias usando palabras clave en preguntas, respuestas y keywords.
+    `entradas` permite reutilizar las entradas activas ya leídas (consultas en lote).
     """
     import re
     from django.db.models import Q
@@ -103,7 +104,7 @@ def _buscar_por_keywords(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase],
         return None, 0.0
     
     # Buscar en la base de conocimiento activa
-    knowledge_items = ChatbotKnowledgeBase.objects.filter(is_active=True)
+    knowledge_items = entradas if entradas is not None else ChatbotKnowledgeBase.objects.filter(is_active=True)
     
     mejor_match = None
     mejor_score = 0.0
@@ -140,7 +141,8 @@ def _buscar_por_keywords(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase],
     return mejor_match, mejor_score
 
 
-def _buscar_fuzzy(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
+def _buscar_fuzzy(pregunta: str, entradas: Optional[List[ChatbotKnowledgeBase]] = None
+                  ) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
     """
     Búsqueda fuzzy para manejar errores de tipeo y variaciones.
     """
@@ -149,7 +151,7 @@ def _buscar_fuzzy(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase], float]
     # Normalizar pregunta
     pregunta_normalizada = pregunta.lower().strip()
     
-    knowledge_items = ChatbotKnowledgeBase.objects.filter(is_active=True)
+    knowledge_items = entradas if entradas is not None else ChatbotKnowledgeBase.objects.filter(is_active=True)
     
     mejor_match = None
     mejor_score = 0.0
@@ -176,50 +178,58 @@ def _buscar_fuzzy(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase], float]
     return mejor_match, mejor_score
 
 
-def _encontrar_mejor_coincidencia(pregunta: str) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
+def codificar_pregunta(pregunta: str) -> np.ndarray:
+    """Embedding normalizado (float32) de la pregunta del usuario."""
+    if not _model_manager.is_available():
+        raise ModelNotAvailableError("El modelo de IA no está disponible")
+    with medir('encode'):
+        question_embedding = _model_manager.model.encode([pregunta])
+    return normalizar(np.asarray(question_embedding, dtype=np.float32).reshape(-1))
+
+
+def buscar_candidatos_embeddings(pregunta: str, k: int = 3,
+                                  vector: Optional[np.ndarray] = None) -> List[Tuple[ChatbotKnowledgeBase, float]]:
     """
-    Encuentra la mejor coincidencia para una pregunta usando IA.
+    Devuelve las `k` entradas más similares a la pregunta según sus embeddings,
+    ordenadas de mayor a menor similitud (solo similitudes positivas).
     
-    Returns:
-        Tuple con el objeto ChatbotKnowledgeBase más similar y su score de similitud
+    La búsqueda se resuelve en el índice vectorial del proceso (ver service_index);
+    solo se consulta la base de datos para leer las entradas ganadoras. Si ya se
+    codificó la pregunta (p. ej. en el pool del endpoint asíncrono) se pasa en `vector`.
     """
     if not _model_manager.is_available():
         raise ModelNotAvailableError("El modelo de IA no está disponible")
     
-    # Obtener todas las preguntas con embeddings
-    knowledge_items = ChatbotKnowledgeBase.objects.filter(
-        is_active=True,
-        question_embedding__isnull=False
-    )
-    
-    if not knowledge_items.exists():
+    indice = obtener_indice()
+    if not len(indice):
         raise NoKnowledgeBaseError("No hay elementos en la base de conocimiento con embeddings")
     
-    # Generar embedding para la pregunta del usuario
-    question_embedding = _model_manager.model.encode([pregunta])
+    if vector is None:
+        vector = codificar_pregunta(pregunta)
+    if vector.shape[0] != indice.dimension:
+        raise NoKnowledgeBaseError(
+            f"Los embeddings guardados ({indice.dimension}) no corresponden al modelo actual ({vector.shape[0]})"
+        )
     
-    best_match = None
-    best_score = 0.0
+    resultados = [(knowledge_id, score) for knowledge_id, score in indice.buscar(vector, k) if score > 0]
+    items = ChatbotKnowledgeBase.objects.filter(is_active=True).select_related('category').in_bulk(
+        [knowledge_id for knowledge_id, _ in resultados]
+    )
+    return [(items[knowledge_id], score) for knowledge_id, score in resultados if knowledge_id in items]
+
+
+def _encontrar_mejor_coincidencia(pregunta: str, vector: Optional[np.ndarray] = None) -> Tuple[Optional[ChatbotKnowledgeBase], float]:
+    """
+    Encuentra la mejor coincidencia para una pregunta usando IA.
     
-    for item in knowledge_items:
-        if item.question_embedding:
-            # Convertir embedding guardado a numpy array con el tipo correcto
-            stored_embedding = np.array(item.question_embedding, dtype=np.float32).reshape(1, -1)
-            
-            # Asegurar que el question_embedding también sea float32
-            question_embedding_float32 = question_embedding.astype(np.float32)
-            
-            # Calcular similitud coseno
-            similarity = util.cos_sim(question_embedding_float32, stored_embedding).item()
-            
-            if similarity > best_score:
-                best_score = similarity
-                best_match = item
-    
-    return best_match, best_score
-
-
-def procesar_consulta_con_ia(pregunta: str, user_id=None, session_id='anonymous', use_cache=True) -> Dict:
+    Returns:
+        Tuple con el objeto ChatbotKnowledgeBase más similar y su score de similitud
+    """
+    candidatos = buscar_candidatos_embeddings(pregunta, k=1, vector=vector)
+    return candidatos[0] if candidatos else (None, 0.0)
+
+
+def procesar_consulta_con_ia(pregunta: str, user_id=None, session_id='anonymous', use_cache=True, ip=None) -> Dict:
     """
     Procesa una consulta del chatbot usando IA para encontrar la mejor respuesta.
     
@@ -228,86 +238,191 @@ def procesar_consulta_con_ia(pregunta: str, user_id=None, session_id='anonymous'
         user_id: ID del usuario (opcional)
         session_id: ID de sesión
         use_cache: Si usar caché para respuestas
+        ip: IP del cliente, para limitar a los anónimos (opcional)
         
     Returns:
         Dict con la respuesta y metadatos
+    
+    Raises:
+        RateLimitError: si el usuario, la IP o la sesión agotaron su cupo
     """
+    incrementar('queries')
+    try:
+        with medir('total'):
+            return _procesar_consulta(
+                pregunta, user_id, session_id, use_cache, limites=identidades(user_id, session_id, ip)
+            )
+    except Exception as e:
+        incrementar('errors', type(e).__name__)
+        raise
+
+
+def _procesar_consulta(pregunta: str, user_id, session_id: str, use_cache: bool,
+                       vector: Optional[np.ndarray] = None, limites: Sequence[str] = (),
+                       exacto=SIN_BUSCAR) -> Dict:
     if len(pregunta.strip()) < 3:
         raise InvalidQuestionError("La pregunta es demasiado corta")
     
+    # Toda consulta paga la lectura de caché; la inferencia se cobra aparte al fallar la caché
+    consumir(limites, COSTO_CACHE)
+    
     # Verificar caché primero
     if use_cache:
-        cached_response = _get_cached_response(pregunta)
+        with medir('cache_lookup'):
+            cached_response = _get_cached_response(pregunta)
+        incrementar('cache_lookups', 'hit' if cached_response else 'miss')
         if cached_response:
             cached_response['cached'] = True
             return cached_response
     
     try:
-        # SISTEMA DE BÚSQUEDA MULTI-NIVEL
-        best_match = None
-        similarity_score = 0.0
-        search_method = "none"
+        consumir(limites, COSTO_INFERENCIA)
+    except RateLimitError:
+        # Una consulta rechazada no gasta cupo: se reintegra la lectura de caché
+        devolver(limites, COSTO_CACHE)
+        raise
+    
+    try:
+        best_match, similarity_score, search_method = buscar_mejor_coincidencia(pregunta, vector, exacto)
+        response = construir_respuesta(best_match, similarity_score, search_method)
+        completar_respuesta(response, best_match)
         
-        # NIVEL 1: Búsqueda por Embeddings/IA (más precisa)
-        try:
-            best_match, similarity_score = _encontrar_mejor_coincidencia(pregunta)
-            if best_match and similarity_score >= SIMILARITY_THRESHOLD:
-                search_method = "ai_embeddings"
-                logger.info(f"Encontrado por IA: {similarity_score:.3f}")
-        except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
-            logger.warning(f"Embeddings no disponibles: {e}")
+        # Registrar conversación si hay usuario
+        if user_id:
+            with medir('conversation_log'):
+                registrar_conversacion(
+                    session_id=session_id,
+                    user_id=user_id,
+                    question_text=pregunta,
+                    answer_text=response['answer'],
+                    matched_knowledge=best_match if response['knowledge_id'] else None,
+                    search_method=search_method,
+                    score=float(similarity_score)
+                )
         
-        # NIVEL 2: Búsqueda por Keywords (si IA no encontró nada bueno)
-        if not best_match or similarity_score < SIMILARITY_THRESHOLD:
-            keyword_match, keyword_score = _buscar_por_keywords(pregunta)
-            if keyword_match and keyword_score >= KEYWORD_MINIMUM_SCORE:
-                # Si keyword es mejor que AI, usar keyword
-                if keyword_score > similarity_score:
-                    best_match = keyword_match
-                    similarity_score = keyword_score
-                    search_method = "keywords"
-                    logger.info(f"Encontrado por keywords: {keyword_score:.3f}")
+        # Guardar en caché
+        if use_cache and response['answer']:
+            _set_cached_response(pregunta, response)
         
-        # NIVEL 3: Búsqueda Fuzzy (si nada anterior funcionó)
-        if not best_match or similarity_score < KEYWORD_MINIMUM_SCORE:
-            fuzzy_match, fuzzy_score = _buscar_fuzzy(pregunta)
-            if fuzzy_match and fuzzy_score > similarity_score:
-                best_match = fuzzy_match
-                similarity_score = fuzzy_score
-                search_method = "fuzzy"
-                logger.info(f"Encontrado por fuzzy: {fuzzy_score:.3f}")
+        return response
         
-        # Preparar respuesta
-        response = {
-            'answer': None,
-            'match_question': None,
-            'score': similarity_score,
-            'search_method': search_method,
-            'recommended_questions': [],
-            'knowledge_id': None,
-            'category': None,
-            'cached': False
-        }
+    except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
+        logger.error(f"Error en procesamiento de consulta: {e}")
+        return respuesta_no_disponible(e)
+
+
+def buscar_mejor_coincidencia(pregunta: str, vector: Optional[np.ndarray] = None, exacto=SIN_BUSCAR
+                              ) -> Tuple[Optional[ChatbotKnowledgeBase], float, str]:
+    """
+    Sistema de búsqueda multi-nivel: exacta, embeddings, keywords y fuzzy.
+    
+    Si quien llama ya buscó la coincidencia exacta, pasa el id encontrado (o None) en `exacto`.
+    
+    Returns:
+        Tuple con la mejor entrada encontrada (o None), su score y el método que la encontró
+    """
+    best_match = None
+    similarity_score = 0.0
+    
+    # NIVEL 0: Coincidencia exacta con una pregunta o alias aprobado (texto normalizado, O(1))
+    with medir('exact_lookup'):
+        knowledge_id = buscar_coincidencia_exacta(pregunta) if exacto is SIN_BUSCAR else exacto
+        if knowledge_id:
+            best_match = ChatbotKnowledgeBase.objects.select_related('category').filter(
+                pk=knowledge_id, is_active=True
+            ).first()
+    if best_match:
+        return best_match, 1.0, "exact"
+    
+    # NIVEL 1: Búsqueda por Embeddings/IA (más precisa; su tiempo incluye 'encode')
+    try:
+        with medir('search_embeddings'):
+            best_match, similarity_score = _encontrar_mejor_coincidencia(pregunta, vector)
+        if best_match and similarity_score >= SIMILARITY_THRESHOLD:
+            logger.info(f"Encontrado por IA: {similarity_score:.3f}")
+    except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
+        logger.warning(f"Embeddings no disponibles: {e}")
+    
+    return buscar_en_niveles_lexicos(pregunta, best_match, similarity_score)
+
+
+def buscar_en_niveles_lexicos(pregunta: str, best_match: Optional[ChatbotKnowledgeBase], similarity_score: float,
+                              entradas: Optional[List[ChatbotKnowledgeBase]] = None
+                              ) -> Tuple[Optional[ChatbotKnowledgeBase], float, str]:
+    """
+    Niveles de respaldo (keywords y fuzzy) a partir del resultado semántico de la pregunta.
+    Solo recorren la base de conocimiento si la similitud no alcanza el umbral.
+    """
+    search_method = "ai_embeddings" if best_match and similarity_score >= SIMILARITY_THRESHOLD else "none"
+    
+    # NIVEL 2: Búsqueda por Keywords (si IA no encontró nada bueno)
+    if not best_match or similarity_score < SIMILARITY_THRESHOLD:
+        with medir('search_keywords'):
+            keyword_match, keyword_score = _buscar_por_keywords(pregunta, entradas)
+        if keyword_match and keyword_score >= KEYWORD_MINIMUM_SCORE:
+            # Si keyword es mejor que AI, usar keyword
+            if keyword_score > similarity_score:
+                best_match = keyword_match
+                similarity_score = keyword_score
+                search_method = "keywords"
+                logger.info(f"Encontrado por keywords: {keyword_score:.3f}")
+    
+    # NIVEL 3: Búsqueda Fuzzy (si nada anterior funcionó)
+    if not best_match or similarity_score < KEYWORD_MINIMUM_SCORE:
+        with medir('search_fuzzy'):
+            fuzzy_match, fuzzy_score = _buscar_fuzzy(pregunta, entradas)
+        if fuzzy_match and fuzzy_score > similarity_score:
+            best_match = fuzzy_match
+            similarity_score = fuzzy_score
+            search_method = "fuzzy"
+            logger.info(f"Encontrado por fuzzy: {fuzzy_score:.3f}")
+    
+    return best_match, similarity_score, search_method
+
+
+def construir_respuesta(best_match: Optional[ChatbotKnowledgeBase], similarity_score: float, search_method: str) -> Dict:
+    """Respuesta de la consulta sin las preguntas recomendadas (ver `completar_respuesta`)."""
+    response = {
+        'answer': None,
+        'match_question': None,
+        'score': similarity_score,
+        'search_method': search_method,
+        'recommended_questions': [],
+        'knowledge_id': None,
+        'category': None,
+        'cached': False
+    }
+    
+    # Si encontramos una coincidencia válida
+    if best_match and (
+        search_method == "exact" or
+        (search_method == "ai_embeddings" and similarity_score >= SIMILARITY_THRESHOLD) or
+        (search_method == "keywords" and similarity_score >= KEYWORD_MINIMUM_SCORE) or
+        (search_method == "fuzzy" and similarity_score >= 0.6)  # Mayor threshold para fuzzy
+    ):
+        response.update({
+            'answer': best_match.answer,
+            'match_question': best_match.question,
+            'knowledge_id': best_match.id,
+            'category': best_match.category.name if best_match.category else None
+        })
+    else:
+        # No se encontró una buena coincidencia
+        response['answer'] = "Lo siento, no tengo información específica sobre eso. ¿Podrías reformular tu pregunta o ser más específico?"
+    return response
+
+
+def completar_respuesta(response: Dict, best_match: Optional[ChatbotKnowledgeBase]) -> None:
+    """Cuenta la vista de la entrada respondida y agrega las preguntas recomendadas."""
+    if response['knowledge_id']:
+        # Incrementar contador de vistas (UPDATE atómico, sin disparar signals)
+        with medir('db_write'):
+            ChatbotKnowledgeBase.objects.filter(pk=best_match.pk).update(view_count=F('view_count') + 1)
+            registrar_vistas_en_ranking([best_match.pk])
+            registrar_vista_en_estadisticas()
         
-        # Si encontramos una coincidencia válida
-        if best_match and (
-            (search_method == "ai_embeddings" and similarity_score >= SIMILARITY_THRESHOLD) or
-            (search_method == "keywords" and similarity_score >= KEYWORD_MINIMUM_SCORE) or
-            (search_method == "fuzzy" and similarity_score >= 0.6)  # Mayor threshold para fuzzy
-        ):
-            # Respuesta encontrada
-            response.update({
-                'answer': best_match.answer,
-                'match_question': best_match.question,
-                'knowledge_id': best_match.id,
-                'category': best_match.category.name if best_match.category else None
-            })
-            
-            # Incrementar contador de vistas
-            best_match.view_count += 1
-            best_match.save(update_fields=['view_count'])
-            
-            # Obtener preguntas recomendadas
+        # Obtener preguntas recomendadas
+        with medir('recommendations'):
             recommended = best_match.recommended_questions.filter(is_active=True)[:3]
             response['recommended_questions'] = [
                 {
@@ -317,57 +432,29 @@ def procesar_consulta_con_ia(pregunta: str, user_id=None, session_id='anonymous'
                 }
                 for q in recommended
             ]
-            
-        else:
-            # No se encontró una buena coincidencia
-            response['answer'] = "Lo siento, no tengo información específica sobre eso. ¿Podrías reformular tu pregunta o ser más específico?"
-            
-            # Obtener preguntas frecuentes como alternativa
-            frequent_questions = ChatbotKnowledgeBase.objects.filter(
-                is_active=True
-            ).order_by('-view_count')[:3]
-            
+    else:
+        # Obtener preguntas frecuentes como alternativa (ranking precalculado)
+        with medir('recommendations'):
             response['recommended_questions'] = [
                 {
-                    'id': q.id,
-                    'question': q.question,
-                    'category': q.category.name if q.category else None
+                    'id': q['id'],
+                    'question': q['question'],
+                    'category': q['category']
                 }
-                for q in frequent_questions
+                for q in obtener_preguntas_frecuentes(limite=3)
             ]
-        
-        # Registrar conversación si hay usuario
-        if user_id:
-            try:
-                from django.contrib.auth import get_user_model
-                User = get_user_model()
-                user = User.objects.get(id=user_id)
-                
-                ChatConversation.objects.create(
-                    user=user,
-                    session_id=session_id,
-                    question_text=pregunta,
-                    answer_text=response['answer'],
-                    matched_knowledge=best_match
-                )
-            except Exception as e:
-                logger.warning(f"Error al registrar conversación: {e}")
-        
-        # Guardar en caché
-        if use_cache and response['answer']:
-            _set_cached_response(pregunta, response)
-        
-        return response
-        
-    except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
-        logger.error(f"Error en procesamiento de consulta: {e}")
-        return {
-            'answer': 'El servicio de chatbot no está disponible temporalmente. Por favor, intenta más tarde.',
-            'match_question': None,
-            'score': 0,
-            'recommended_questions': [],
-            'knowledge_id': None,
-            'category': None,
-            'cached': False,
-            'error': str(e)
-        }
\ No newline at end of file
+    
+    incrementar('search_method', response['search_method'] if response['knowledge_id'] else 'none')
+
+
+def respuesta_no_disponible(error: Exception) -> Dict:
+    return {
+        'answer': 'El servicio de chatbot no está disponible temporalmente. Por favor, intenta más tarde.',
+        'match_question': None,
+        'score': 0,
+        'recommended_questions': [],
+        'knowledge_id': None,
+        'category': None,
+        'cached': False,
+        'error': str(error)
+    }
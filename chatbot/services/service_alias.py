@@ -0,0 +1,172 @@
+"""
+Servicio de alias de preguntas: coincidencia exacta y aprendizaje desde las conversaciones.
+
+Las preguntas activas y los alias aprobados forman un mapa texto normalizado → entrada
+que cada proceso mantiene en memoria (se reconstruye con la versión del índice vectorial),
+de modo que las paráfrasis frecuentes se resuelven con una búsqueda O(1).
+"""
+
+import logging
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from ..models import ChatbotKnowledgeBase, ChatbotQuestionAlias, ChatConversation
+from .service_index import invalidar_indice, version_del_indice
+
+logger = logging.getLogger(__name__)
+
+ALIAS_MINING_DAYS = getattr(settings, 'CHATBOT_ALIAS_MINING_DAYS', 30)
+ALIAS_MIN_SCORE = getattr(settings, 'CHATBOT_ALIAS_MIN_SCORE', 0.8)
+ALIAS_MIN_OCCURRENCES = getattr(settings, 'CHATBOT_ALIAS_MIN_OCCURRENCES', 3)
+# Solo las coincidencias semánticas tienen un puntaje comparable entre consultas.
+METODOS_CONFIABLES = ('ai_embeddings',)
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios simples."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[¿?¡!.,;:"\'()]', ' ', texto)
+    return ' '.join(texto.split())
+
+
+class _MapaExacto:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.mapa: Dict[str, int] = {}
+        self.version: Optional[str] = None
+
+    def obtener(self) -> Dict[str, int]:
+        version = version_del_indice()
+        if version is not None and version == self.version:
+            return self.mapa
+        with self._lock:
+            if version is None or version != self.version:
+                self.mapa, self.version = _construir_mapa(), version
+            return self.mapa
+
+
+def _construir_mapa() -> Dict[str, int]:
+    mapa = dict(ChatbotQuestionAlias.objects.filter(
+        status=ChatbotQuestionAlias.STATUS_APPROVED, knowledge__is_active=True
+    ).values_list('normalized_alias', 'knowledge_id'))
+    # Las preguntas tienen prioridad sobre los alias
+    for pregunta, knowledge_id in ChatbotKnowledgeBase.objects.filter(is_active=True).values_list('question', 'id'):
+        mapa[normalizar_texto(pregunta)] = knowledge_id
+    return mapa
+
+
+_mapa_exacto = _MapaExacto()
+
+# Marca que la coincidencia exacta aún no se buscó (None significa que se buscó y no hubo)
+SIN_BUSCAR = object()
+
+
+def buscar_coincidencia_exacta(pregunta: str) -> Optional[int]:
+    """Id de la entrada cuya pregunta o alias aprobado coincide exactamente (normalizado)."""
+    return _mapa_exacto.obtener().get(normalizar_texto(pregunta))
+
+
+def minar_alias(dias: int = ALIAS_MINING_DAYS, score_minimo: float = ALIAS_MIN_SCORE,
+                ocurrencias_minimas: int = ALIAS_MIN_OCCURRENCES) -> Dict:
+    """
+    Propone como alias pendientes las formulaciones que en los últimos `dias` coincidieron
+    semánticamente con la misma entrada al menos `ocurrencias_minimas` veces con puntaje
+    ≥ `score_minimo`. Las que apuntan a más de una entrada se descartan por ambiguas.
+    """
+    filas = ChatConversation.objects.filter(
+        created_at__gte=timezone.now() - timedelta(days=dias),
+        matched_knowledge__isnull=False,
+        matched_knowledge__is_active=True,
+        search_method__in=METODOS_CONFIABLES,
+        score__gte=score_minimo,
+    ).order_by().values('question_text', 'matched_knowledge_id').annotate(total=Count('id'), promedio=Avg('score'))
+
+    candidatos = defaultdict(lambda: defaultdict(lambda: {'total': 0, 'suma': 0.0, 'texto': None}))
+    for fila in filas:
+        texto = fila['question_text'].strip()
+        normalizado = normalizar_texto(texto)
+        if not normalizado or len(texto) > 255:
+            continue
+        datos = candidatos[normalizado][fila['matched_knowledge_id']]
+        datos['total'] += fila['total']
+        datos['suma'] += fila['promedio'] * fila['total']
+        datos['texto'] = datos['texto'] or texto
+
+    preguntas = {
+        normalizar_texto(pregunta)
+        for pregunta in ChatbotKnowledgeBase.objects.values_list('question', flat=True)
+    }
+    existentes = ChatbotQuestionAlias.objects.in_bulk(list(candidatos), field_name='normalized_alias')
+
+    nuevos, actualizados, ambiguos = [], [], 0
+    for normalizado, por_entrada in candidatos.items():
+        if normalizado in preguntas:
+            continue
+        if len(por_entrada) > 1:
+            ambiguos += 1
+            continue
+        knowledge_id, datos = next(iter(por_entrada.items()))
+        if datos['total'] < ocurrencias_minimas:
+            continue
+        promedio = round(datos['suma'] / datos['total'], 4)
+
+        alias = existentes.get(normalizado)
+        if alias is None:
+            nuevos.append(ChatbotQuestionAlias(
+                knowledge_id=knowledge_id, alias=datos['texto'], normalized_alias=normalizado,
+                occurrences=datos['total'], average_score=promedio
+            ))
+        else:
+            # Las decisiones ya tomadas (aprobado/rechazado) se respetan; solo se actualizan los conteos
+            alias.occurrences, alias.average_score = datos['total'], promedio
+            if alias.status == ChatbotQuestionAlias.STATUS_PENDING:
+                alias.knowledge_id = knowledge_id
+            actualizados.append(alias)
+
+    with transaction.atomic():
+        ChatbotQuestionAlias.objects.bulk_create(nuevos)
+        ChatbotQuestionAlias.objects.bulk_update(actualizados, ['occurrences', 'average_score', 'knowledge'])
+    return {'propuestos': len(nuevos), 'actualizados': len(actualizados), 'ambiguos': ambiguos}
+
+
+def aprobar_alias(alias: Iterable[ChatbotQuestionAlias], encoder=None, usuario=None) -> int:
+    """
+    Aprueba los alias, calcula su embedding (si hay `encoder`) y publica una versión nueva
+    del índice para que entren al mapa exacto y a la búsqueda semántica.
+    """
+    alias = list(alias)
+    if not alias:
+        return 0
+    embeddings = encoder.encode([a.alias for a in alias]) if encoder is not None else [None] * len(alias)
+    ahora = timezone.now()
+    for item, embedding in zip(alias, embeddings):
+        item.status = ChatbotQuestionAlias.STATUS_APPROVED
+        item.embedding = np.asarray(embedding, dtype=np.float32).tolist() if embedding is not None else item.embedding
+        item.updated_by = usuario or item.updated_by
+        item.updated_at = ahora
+    ChatbotQuestionAlias.objects.bulk_update(alias, ['status', 'embedding', 'updated_by', 'updated_at'])
+    invalidar_indice()
+    return len(alias)
+
+
+def rechazar_alias(alias: Iterable[ChatbotQuestionAlias], usuario=None) -> int:
+    alias = list(alias)
+    ahora = timezone.now()
+    for item in alias:
+        item.status = ChatbotQuestionAlias.STATUS_REJECTED
+        item.updated_by = usuario or item.updated_by
+        item.updated_at = ahora
+    ChatbotQuestionAlias.objects.bulk_update(alias, ['status', 'updated_by', 'updated_at'])
+    invalidar_indice()
+    return len(alias)
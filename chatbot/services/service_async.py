@@ -0,0 +1,207 @@
+"""
+Variante asíncrona del pipeline de consultas, para los endpoints servidos por ASGI.
+
+La caché se consulta con `cache.aget` sin bloquear el event loop, la codificación de la
+pregunta corre en un pool de hilos acotado (CHATBOT_ENCODE_WORKERS) y el registro de la
+conversación se agenda en segundo plano cuando el event loop sobrevive a la petición (ASGI); con
+WSGI cada petición corre en un loop que se cierra al responder, así que el registro se espera. Las búsquedas que tocan el ORM se delegan al
+pipeline síncrono con `sync_to_async`, de modo que todos los endpoints responden lo mismo.
+`transmitir_consulta` entrega la respuesta por partes para el endpoint SSE.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import ChatbotKnowledgeBase, ChatConversation
+from .service_ai import (
+    CACHE_TIMEOUT, InvalidQuestionError, ModelNotAvailableError, NoKnowledgeBaseError, RateLimitError,
+    _generate_cache_key, _model_manager, _procesar_consulta, buscar_mejor_coincidencia, codificar_pregunta,
+    completar_respuesta, construir_respuesta, respuesta_no_disponible
+)
+from .service_alias import SIN_BUSCAR, buscar_coincidencia_exacta
+from .service_metrics import incrementar, medir, registrar_duracion
+from .service_rate_limit import COSTO_CACHE, COSTO_INFERENCIA, consumir, devolver, identidades
+
+logger = logging.getLogger(__name__)
+
+# Hilos dedicados a codificar preguntas: acota el uso de CPU del modelo por proceso.
+ENCODE_WORKERS = getattr(settings, 'CHATBOT_ENCODE_WORKERS', 2)
+_pool_codificacion = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix='chatbot-encode')
+
+# Referencias a los registros en curso (el event loop solo guarda referencias débiles a las tareas).
+_registros_pendientes: Set[asyncio.Task] = set()
+
+
+async def procesar_consulta_async(pregunta: str, user_id=None, session_id='anonymous', use_cache=True, ip=None,
+                                  registrar_en_segundo_plano=True) -> Dict:
+    """
+    Equivalente asíncrono de `procesar_consulta_con_ia` (mismas métricas, límites y respuesta).
+    Con `registrar_en_segundo_plano=False` el registro de la conversación se espera antes de volver.
+    """
+    incrementar('queries')
+    try:
+        with medir('total'):
+            return await _procesar_consulta_async(pregunta, user_id, session_id, use_cache, ip, registrar_en_segundo_plano)
+    except Exception as e:
+        incrementar('errors', type(e).__name__)
+        raise
+
+
+async def _procesar_consulta_async(pregunta: str, user_id, session_id: str, use_cache: bool, ip,
+                                   registrar_en_segundo_plano: bool) -> Dict:
+    if len(pregunta.strip()) < 3:
+        raise InvalidQuestionError("La pregunta es demasiado corta")
+
+    limites = identidades(user_id, session_id, ip)
+    await sync_to_async(consumir)(limites, COSTO_CACHE)
+    cache_key = _generate_cache_key(pregunta)
+    if use_cache:
+        with medir('cache_lookup'):
+            cached_response = await cache.aget(cache_key)
+        incrementar('cache_lookups', 'hit' if cached_response else 'miss')
+        if cached_response:
+            cached_response['cached'] = True
+            return cached_response
+
+    await sync_to_async(_cobrar_inferencia)(limites)
+    exacto, vector = await _codificar(pregunta)
+    # La caché y el registro se resuelven aquí, sin bloquear, en lugar de dentro del pipeline
+    response = await sync_to_async(_procesar_consulta)(pregunta, None, session_id, False, vector=vector, exacto=exacto)
+    await _finalizar(pregunta, response, user_id, session_id, cache_key if use_cache else None, registrar_en_segundo_plano)
+    return response
+
+
+# Campos que viajan en el primer evento del stream; el resto llega después.
+CAMPOS_RESPUESTA = ('answer', 'match_question', 'score', 'search_method', 'knowledge_id', 'category', 'cached', 'error')
+
+
+async def transmitir_consulta(pregunta: str, user_id=None, session_id='anonymous',
+                              use_cache=True, ip=None, registrar_en_segundo_plano=True) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Emite la consulta por partes como pares (evento, datos): 'answer' apenas se resuelve la
+    coincidencia, 'recommendations' cuando se cuentan la vista y las recomendaciones, y 'done'.
+    El registro de la conversación se agenda (o se espera) al terminar la transmisión.
+    """
+    incrementar('queries')
+    inicio = time.perf_counter()
+    try:
+        if len(pregunta.strip()) < 3:
+            raise InvalidQuestionError("La pregunta es demasiado corta")
+
+        limites = identidades(user_id, session_id, ip)
+        await sync_to_async(consumir)(limites, COSTO_CACHE)
+        cache_key = _generate_cache_key(pregunta)
+        response = None
+        if use_cache:
+            with medir('cache_lookup'):
+                response = await cache.aget(cache_key)
+            incrementar('cache_lookups', 'hit' if response else 'miss')
+
+        if response:
+            response['cached'] = True
+            yield 'answer', _campos_respuesta(response)
+        else:
+            await sync_to_async(_cobrar_inferencia)(limites)
+            exacto, vector = await _codificar(pregunta)
+            response, best_match = await sync_to_async(_resolver)(pregunta, vector, exacto)
+            registrar_duracion('first_event', time.perf_counter() - inicio)
+            yield 'answer', _campos_respuesta(response)
+            if 'error' not in response:
+                await sync_to_async(completar_respuesta)(response, best_match)
+
+        yield 'recommendations', {'recommended_questions': response['recommended_questions']}
+        registrar_duracion('total', time.perf_counter() - inicio)
+        yield 'done', {'cached': response['cached']}
+    except Exception as e:
+        incrementar('errors', type(e).__name__)
+        raise
+
+    if not response['cached']:
+        await _finalizar(pregunta, response, user_id, session_id, cache_key if use_cache else None, registrar_en_segundo_plano)
+
+
+def _cobrar_inferencia(limites) -> None:
+    """Cobra la inferencia; si se rechaza, reintegra la lectura de caché ya cobrada."""
+    try:
+        consumir(limites, COSTO_INFERENCIA)
+    except RateLimitError:
+        devolver(limites, COSTO_CACHE)
+        raise
+
+
+def _resolver(pregunta: str, vector, exacto=SIN_BUSCAR) -> Tuple[Dict, Optional[ChatbotKnowledgeBase]]:
+    try:
+        best_match, similarity_score, search_method = buscar_mejor_coincidencia(pregunta, vector, exacto)
+        return construir_respuesta(best_match, similarity_score, search_method), best_match
+    except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
+        logger.error(f"Error en procesamiento de consulta: {e}")
+        return respuesta_no_disponible(e), None
+
+
+def _campos_respuesta(response: Dict) -> Dict:
+    return {campo: response[campo] for campo in CAMPOS_RESPUESTA if campo in response}
+
+
+async def _codificar(pregunta: str) -> Tuple[Optional[int], Optional[np.ndarray]]:
+    """
+    Busca la coincidencia exacta y, si no la hay, codifica la pregunta en el pool.
+    Devuelve (id exacto o None, vector o None); el id se pasa al pipeline para no repetir la búsqueda.
+    """
+    exacto = await sync_to_async(buscar_coincidencia_exacta)(pregunta)
+    if exacto is not None or not _model_manager.is_available():
+        return exacto, None
+    vector = await asyncio.get_running_loop().run_in_executor(_pool_codificacion, codificar_pregunta, pregunta)
+    return exacto, vector
+
+
+async def _finalizar(pregunta: str, response: Dict, user_id, session_id: str, cache_key: Optional[str],
+                     registrar_en_segundo_plano: bool = True) -> None:
+    """Registra la conversación (agendada o esperada) y guarda la respuesta en caché."""
+    if user_id:
+        registro = _registrar_conversacion(
+            session_id=session_id,
+            user_id=user_id,
+            question_text=pregunta,
+            answer_text=response['answer'],
+            matched_knowledge_id=response['knowledge_id'],
+            search_method=response.get('search_method', ''),
+            score=float(response['score'])
+        )
+        if registrar_en_segundo_plano:
+            _en_segundo_plano(registro)
+        else:
+            await registro
+    if cache_key and response['answer'] and 'error' not in response:
+        await cache.aset(cache_key, response, CACHE_TIMEOUT)
+
+
+async def _registrar_conversacion(matched_knowledge_id: Optional[int], **campos) -> None:
+    # Se mide sin `medir`: la tarea comparte la pila de etapas de la petición que ya respondió
+    inicio = time.perf_counter()
+    try:
+        await ChatConversation.objects.acreate(matched_knowledge_id=matched_knowledge_id, **campos)
+        registrar_duracion('conversation_log', time.perf_counter() - inicio)
+    except Exception as e:
+        logger.error(f"Error registrando conversación: {e}")
+
+
+def _en_segundo_plano(corrutina) -> None:
+    tarea = asyncio.get_running_loop().create_task(corrutina)
+    _registros_pendientes.add(tarea)
+    tarea.add_done_callback(_registros_pendientes.discard)
+
+
+async def esperar_registros_pendientes() -> None:
+    """Espera a que terminen los registros agendados en este event loop (apagado ordenado, tests)."""
+    loop = asyncio.get_running_loop()
+    tareas = [tarea for tarea in _registros_pendientes if tarea.get_loop() is loop]
+    if tareas:
+        await asyncio.gather(*tareas, return_exceptions=True)
@@ -0,0 +1,238 @@
+"""
+Consultas del chatbot en lote (POST api/chatbot/query/batch/).
+
+Resuelve N preguntas con una sola llamada al modelo y un producto matriz-matriz contra el
+índice vectorial. Las lecturas y escrituras se agrupan: entradas ganadoras, recomendaciones,
+contadores de vistas y conversaciones (`bulk_create`) cuestan una consulta cada uno, no N.
+Cada respuesta es la misma que daría el endpoint de una pregunta.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Prefetch
+from django.utils import timezone
+
+from ..models import ChatbotKnowledgeBase, ChatConversation
+from .service_ai import (
+    CACHE_TIMEOUT, SIMILARITY_THRESHOLD, InvalidQuestionError, ModelNotAvailableError, NoKnowledgeBaseError,
+    _generate_cache_key, _model_manager, buscar_en_niveles_lexicos, construir_respuesta
+)
+from .service_alias import buscar_coincidencia_exacta
+from .service_index import normalizar, obtener_indice
+from .service_leaderboard import obtener_preguntas_frecuentes, registrar_vistas_en_ranking
+from .service_metrics import incrementar, medir
+from .service_rate_limit import COSTO_CACHE, COSTO_INFERENCIA, RATE_LIMIT_CAPACITY, consumir, costo_acotado, identidades
+from .service_statistics import registrar_conversacion_en_estadisticas, registrar_vista_en_estadisticas
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_QUESTIONS = getattr(settings, 'CHATBOT_BATCH_MAX_QUESTIONS', 50)
+MAX_RECOMENDADAS = 3
+
+# Con los valores por defecto un lote grande cuesta más que una cubeta: se cobra la cubeta completa
+if BATCH_MAX_QUESTIONS * (COSTO_CACHE + COSTO_INFERENCIA) > min(RATE_LIMIT_CAPACITY.values()):
+    logger.info(
+        f"Un lote de {BATCH_MAX_QUESTIONS} preguntas sin caché cuesta más que la menor cubeta "
+        f"({min(RATE_LIMIT_CAPACITY.values())} tokens); su cobro se acota a la capacidad"
+    )
+
+Coincidencia = Tuple[Optional[ChatbotKnowledgeBase], float, str]
+
+
+def procesar_consultas_en_lote(preguntas: List[str], user_id=None, session_id='anonymous',
+                               use_cache=True, ip=None) -> List[Dict]:
+    """
+    Procesa varias preguntas y devuelve sus respuestas en el mismo orden.
+
+    Cada pregunta paga la lectura de caché y cada una que no está en caché paga además la
+    inferencia: el lote agota la cubeta igual que las mismas consultas hechas de una en una.
+    Se cobra una sola vez, acotado a la capacidad de la cubeta para que un lote permitido
+    por CHATBOT_BATCH_MAX_QUESTIONS siempre pueda pasar con la cubeta llena.
+
+    Raises:
+        InvalidQuestionError: si el lote está vacío, supera CHATBOT_BATCH_MAX_QUESTIONS o
+            alguna pregunta es demasiado corta.
+        RateLimitError: si el usuario, la IP o la sesión agotaron su cupo.
+    """
+    if not preguntas or len(preguntas) > BATCH_MAX_QUESTIONS:
+        raise InvalidQuestionError(f"El lote debe tener entre 1 y {BATCH_MAX_QUESTIONS} preguntas")
+    if any(len(pregunta.strip()) < 3 for pregunta in preguntas):
+        raise InvalidQuestionError("La pregunta es demasiado corta")
+
+    incrementar('queries', delta=len(preguntas))
+    try:
+        with medir('batch'):
+            return _procesar_lote(preguntas, user_id, session_id, use_cache, identidades(user_id, session_id, ip))
+    except Exception as e:
+        incrementar('errors', type(e).__name__)
+        raise
+
+
+def _procesar_lote(preguntas: List[str], user_id, session_id: str, use_cache: bool, limites: List[str]) -> List[Dict]:
+    respuestas: List[Optional[Dict]] = [None] * len(preguntas)
+    claves = [_generate_cache_key(pregunta) for pregunta in preguntas]
+
+    if use_cache:
+        with medir('cache_lookup'):
+            en_cache = cache.get_many(set(claves))
+        for posicion, clave in enumerate(claves):
+            if clave in en_cache:
+                respuestas[posicion] = {**en_cache[clave], 'cached': True}
+        aciertos = len(preguntas) - respuestas.count(None)
+        if aciertos:
+            incrementar('cache_lookups', 'hit', delta=aciertos)
+        if respuestas.count(None):
+            incrementar('cache_lookups', 'miss', delta=respuestas.count(None))
+
+    pendientes = [posicion for posicion, respuesta in enumerate(respuestas) if respuesta is None]
+    consumir(limites, costo_acotado(limites, COSTO_CACHE * len(preguntas) + COSTO_INFERENCIA * len(pendientes)))
+    if not pendientes:
+        return respuestas
+
+    coincidencias = _buscar_coincidencias([preguntas[posicion] for posicion in pendientes])
+    nuevas = [construir_respuesta(*coincidencia) for coincidencia in coincidencias]
+    _completar_respuestas(nuevas)
+    for posicion, respuesta in zip(pendientes, nuevas):
+        respuestas[posicion] = respuesta
+
+    if user_id:
+        with medir('conversation_log'):
+            _registrar_conversaciones(
+                [preguntas[posicion] for posicion in pendientes], nuevas, coincidencias, user_id, session_id
+            )
+
+    if use_cache:
+        cache.set_many({claves[posicion]: respuestas[posicion] for posicion in pendientes}, CACHE_TIMEOUT)
+    return respuestas
+
+
+def buscar_candidatos_en_lote(preguntas: List[str]) -> List[Tuple[Optional[int], float]]:
+    """Mejor (knowledge_id, score) semántico de cada pregunta: un `encode` y un producto matricial."""
+    if not _model_manager.is_available():
+        raise ModelNotAvailableError("El modelo de IA no está disponible")
+
+    indice = obtener_indice()
+    if not len(indice):
+        raise NoKnowledgeBaseError("No hay elementos en la base de conocimiento con embeddings")
+
+    with medir('encode'):
+        consultas = normalizar(np.asarray(_model_manager.model.encode(preguntas), dtype=np.float32))
+    if consultas.shape[1] != indice.dimension:
+        raise NoKnowledgeBaseError(
+            f"Los embeddings guardados ({indice.dimension}) no corresponden al modelo actual ({consultas.shape[1]})"
+        )
+
+    return [
+        resultados[0] if resultados and resultados[0][1] > 0 else (None, 0.0)
+        for resultados in indice.buscar_lote(consultas, 1)
+    ]
+
+
+def _buscar_coincidencias(preguntas: List[str]) -> List[Coincidencia]:
+    """Los mismos niveles que `buscar_mejor_coincidencia`, resolviendo cada nivel para todo el lote."""
+    with medir('exact_lookup'):
+        exactas = {posicion: buscar_coincidencia_exacta(pregunta) for posicion, pregunta in enumerate(preguntas)}
+
+    semanticas: Dict[int, Tuple[Optional[int], float]] = {}
+    sin_exacta = [posicion for posicion, knowledge_id in exactas.items() if not knowledge_id]
+    if sin_exacta:
+        try:
+            with medir('search_embeddings'):
+                semanticas = dict(zip(sin_exacta, buscar_candidatos_en_lote([preguntas[p] for p in sin_exacta])))
+        except (ModelNotAvailableError, NoKnowledgeBaseError) as e:
+            logger.warning(f"Embeddings no disponibles: {e}")
+
+    ids = {knowledge_id for knowledge_id in exactas.values() if knowledge_id}
+    ids.update(knowledge_id for knowledge_id, _ in semanticas.values() if knowledge_id)
+    entradas = ChatbotKnowledgeBase.objects.filter(is_active=True).select_related('category').in_bulk(ids)
+
+    # Las entradas activas se leen una sola vez para los niveles de keywords y fuzzy
+    entradas_lexicas = None
+    coincidencias = []
+    for posicion, pregunta in enumerate(preguntas):
+        if exactas[posicion] in entradas:
+            coincidencias.append((entradas[exactas[posicion]], 1.0, "exact"))
+            continue
+        knowledge_id, similarity_score = semanticas.get(posicion, (None, 0.0))
+        best_match = entradas.get(knowledge_id)
+        if not best_match or similarity_score < SIMILARITY_THRESHOLD:
+            if entradas_lexicas is None:
+                entradas_lexicas = list(ChatbotKnowledgeBase.objects.filter(is_active=True).select_related('category'))
+        coincidencias.append(buscar_en_niveles_lexicos(
+            pregunta, best_match, similarity_score if best_match else 0.0, entradas=entradas_lexicas
+        ))
+    return coincidencias
+
+
+def _completar_respuestas(respuestas: List[Dict]) -> None:
+    """Equivalente en lote de `completar_respuesta`: vistas y recomendaciones agrupadas."""
+    vistas = Counter(respuesta['knowledge_id'] for respuesta in respuestas if respuesta['knowledge_id'])
+    recomendadas = {}
+    if vistas:
+        with medir('db_write'):
+            # Un UPDATE por cantidad distinta de vistas (normalmente uno solo)
+            por_cantidad = defaultdict(list)
+            for knowledge_id, cantidad in vistas.items():
+                por_cantidad[cantidad].append(knowledge_id)
+            for cantidad, ids in por_cantidad.items():
+                ChatbotKnowledgeBase.objects.filter(pk__in=ids).update(view_count=F('view_count') + cantidad)
+            registrar_vistas_en_ranking(vistas)
+            registrar_vista_en_estadisticas(sum(vistas.values()))
+
+        with medir('recommendations'):
+            recomendadas = {
+                item.id: [
+                    {'id': q.id, 'question': q.question, 'category': q.category.name if q.category else None}
+                    for q in item.activas[:MAX_RECOMENDADAS]
+                ]
+                for item in ChatbotKnowledgeBase.objects.filter(pk__in=vistas).prefetch_related(Prefetch(
+                    'recommended_questions',
+                    queryset=ChatbotKnowledgeBase.objects.filter(is_active=True).select_related('category'),
+                    to_attr='activas'
+                ))
+            }
+
+    frecuentes = None
+    for respuesta in respuestas:
+        if respuesta['knowledge_id']:
+            respuesta['recommended_questions'] = list(recomendadas.get(respuesta['knowledge_id'], []))
+        else:
+            if frecuentes is None:
+                with medir('recommendations'):
+                    frecuentes = [
+                        {'id': q['id'], 'question': q['question'], 'category': q['category']}
+                        for q in obtener_preguntas_frecuentes(limite=MAX_RECOMENDADAS)
+                    ]
+            respuesta['recommended_questions'] = list(frecuentes)
+        incrementar('search_method', respuesta['search_method'] if respuesta['knowledge_id'] else 'none')
+
+
+def _registrar_conversaciones(preguntas: List[str], respuestas: List[Dict], coincidencias: List[Coincidencia],
+                              user_id: int, session_id: str) -> None:
+    # bulk_create no dispara post_save: los contadores diarios se actualizan aquí una sola vez
+    try:
+        ChatConversation.objects.bulk_create([
+            ChatConversation(
+                session_id=session_id,
+                user_id=user_id,
+                question_text=pregunta,
+                answer_text=respuesta['answer'],
+                matched_knowledge_id=respuesta['knowledge_id'],
+                search_method=search_method,
+                score=float(similarity_score)
+            )
+            for pregunta, respuesta, (_, similarity_score, search_method) in zip(preguntas, respuestas, coincidencias)
+        ])
+    except Exception as e:
+        logger.error(f"Error registrando conversaciones: {e}")
+        return
+    registrar_conversacion_en_estadisticas(
+        timezone.localdate(),
+        total=len(respuestas),
+        matched=sum(1 for respuesta in respuestas if respuesta['knowledge_id'])
+    )
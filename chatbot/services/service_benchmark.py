@@ -0,0 +1,351 @@
+"""
+Servicio de benchmark del chatbot: base de conocimiento sintética y repetición de consultas.
+
+Cada corrida se ejecuta dentro de una transacción que se revierte al terminar y busca sobre
+un índice propio del proceso (no publica versiones), así que no deja datos ni obliga a los
+demás procesos a reconstruir el suyo. Aislar la base sintética desactiva las entradas reales
+(un UPDATE que las bloquea durante la corrida): si la base tiene entradas activas, eso exige
+`permitir_produccion`. Las métricas en memoria del proceso se reinician en cada corrida.
+"""
+
+import logging
+import math
+import random
+import time
+import zlib
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, List
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from ..models import ChatbotCategory, ChatbotKnowledgeBase
+from .service_ai import ChatbotModelManager, _generate_cache_key, _model_manager, procesar_consulta_con_ia
+from .service_cache import invalidate_stats_cache
+from .service_index import construir_indice, usar_indice
+from .service_leaderboard import invalidar_ranking
+from .service_metrics import etapa_actual, obtener_instantanea, reiniciar_metricas
+
+logger = logging.getLogger(__name__)
+
+TIPOS_CONSULTA = ('exact', 'paraphrased', 'typo', 'out_of_domain')
+CATEGORIA_PREFIJO = 'Benchmark'
+
+# Vocabulario de la base sintética: cada término con un sinónimo para las paráfrasis.
+_ACCIONES = [
+    ('solicitar', 'pedir'), ('consultar', 'revisar'), ('actualizar', 'modificar'),
+    ('cancelar', 'anular'), ('registrar', 'inscribir'), ('descargar', 'obtener'),
+    ('renovar', 'extender'), ('reportar', 'informar'),
+]
+_OBJETOS = [
+    ('mis vacaciones', 'mis días libres'), ('la boleta de pago', 'el recibo de sueldo'),
+    ('el horario del comedor', 'los horarios de almuerzo'), ('mi equipo de protección', 'mi EPP'),
+    ('el permiso por salud', 'la licencia médica'), ('la constancia de trabajo', 'el certificado laboral'),
+    ('mis datos personales', 'mi información personal'), ('el transporte de personal', 'la movilidad'),
+    ('el seguro médico', 'la póliza de salud'), ('la capacitación de seguridad', 'el curso de seguridad'),
+    ('el fotocheck', 'la credencial'), ('las horas extra', 'el sobretiempo'),
+]
+_AREAS = [
+    'Producción', 'Almacén', 'Mantenimiento', 'Calidad', 'Logística', 'Recursos Humanos',
+    'Seguridad', 'Finanzas', 'Ventas', 'Sistemas', 'Compras', 'Laboratorio',
+]
+_SEDES = [
+    'Arequipa', 'Lima', 'Cusco', 'Tacna', 'Moquegua', 'Puno', 'Ica', 'Piura', 'Trujillo', 'Chiclayo',
+    'Camaná', 'Mollendo', 'Majes', 'Chala', 'Ilo', 'Juliaca', 'Nazca', 'Pisco', 'Huancayo', 'Ayacucho',
+]
+_TURNOS = ['mañana', 'tarde', 'noche']
+_FUERA_DE_DOMINIO = [
+    '¿Cuál es la capital de Australia?', '¿Quién ganó el mundial de 1970?',
+    'Dame una receta de ceviche', '¿Cuántos planetas tiene el sistema solar?',
+    '¿Qué película me recomiendas para hoy?', 'Explícame la teoría de la relatividad',
+    '¿A qué temperatura hierve el agua en la montaña?', 'Traduce hola al japonés',
+    '¿Cuál es el río más largo del mundo?', 'Cuéntame un chiste de programadores',
+]
+
+_DIMENSIONES = (len(_ACCIONES), len(_OBJETOS), len(_AREAS), len(_SEDES), len(_TURNOS))
+MAXIMO_SIN_SUFIJO = math.prod(_DIMENSIONES)
+
+
+class EncoderSimulado:
+    """
+    Encoder determinista que sustituye al modelo de embeddings en los benchmarks.
+
+    Proyecta palabras y trigramas de caracteres en un vector de dimensión fija (hashing),
+    así que textos parecidos dan vectores parecidos sin cargar el modelo real.
+    """
+
+    def __init__(self, dimension: int = 256):
+        self.dimension = dimension
+
+    def _vector(self, texto: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        texto = texto.lower()
+        rasgos = texto.split()
+        relleno = f"  {texto}  "
+        rasgos += [relleno[i:i + 3] for i in range(len(relleno) - 2)]
+        for rasgo in rasgos:
+            h = zlib.crc32(rasgo.encode())
+            vector[h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def encode(self, textos, **kwargs) -> np.ndarray:
+        if isinstance(textos, str):
+            return self._vector(textos)
+        return np.vstack([self._vector(t) for t in textos]) if textos else np.zeros((0, self.dimension), dtype=np.float32)
+
+
+@contextmanager
+def usar_encoder(encoder):
+    """Reemplaza temporalmente el modelo del chatbot por otro encoder (p. ej. EncoderSimulado)."""
+    anterior = ChatbotModelManager._model
+    ChatbotModelManager._model = encoder
+    try:
+        yield
+    finally:
+        ChatbotModelManager._model = anterior
+
+
+def _componentes(indice: int) -> List[int]:
+    partes = []
+    for tamano in reversed(_DIMENSIONES):
+        indice, resto = divmod(indice, tamano)
+        partes.append(resto)
+    return list(reversed(partes))
+
+
+def _redactar(indice: int, sufijo: str = '') -> Dict:
+    a, o, ar, s, t = _componentes(indice % MAXIMO_SIN_SUFIJO)
+    accion, accion_sin = _ACCIONES[a]
+    objeto, objeto_sin = _OBJETOS[o]
+    area, sede, turno = _AREAS[ar], _SEDES[s], _TURNOS[t]
+    return {
+        'question': f"¿Cómo puedo {accion} {objeto} en {area} de la sede {sede}, turno {turno}{sufijo}?",
+        'paraphrase': f"quisiera saber como {accion_sin} {objeto_sin} para {area} en {sede} turno de {turno}{sufijo}",
+        'answer': (
+            f"Para {accion} {objeto} en {area} ({sede}, turno {turno}) ingresa a la intranet, "
+            f"abre la sección de {area} y sigue los pasos indicados. Si tienes dudas, consulta a tu supervisor."
+        ),
+        'keywords': f"{accion},{objeto},{area.lower()},{sede.lower()},{turno}",
+        'area': area,
+    }
+
+
+def _con_errores(texto: str, rng: random.Random) -> str:
+    """Introduce errores de tipeo: transposiciones, omisiones y duplicados de letras."""
+    letras = list(texto)
+    for _ in range(max(1, len(letras) // 25)):
+        posiciones = [i for i, c in enumerate(letras[:-1]) if c.isalpha() and letras[i + 1].isalpha()]
+        if not posiciones:
+            break
+        i = rng.choice(posiciones)
+        operacion = rng.randrange(3)
+        if operacion == 0:
+            letras[i], letras[i + 1] = letras[i + 1], letras[i]
+        elif operacion == 1:
+            del letras[i]
+        else:
+            letras.insert(i, letras[i])
+    return ''.join(letras)
+
+
+def generar_base_sintetica(tamano: int, encoder, seed: int = 42, batch_size: int = 1000) -> List[Dict]:
+    """
+    Crea `tamano` entradas activas con embeddings calculados por `encoder` (vía bulk_create,
+    sin signals). Devuelve los textos de cada entrada junto con su id.
+    """
+    rng = random.Random(seed)
+    indices = rng.sample(range(MAXIMO_SIN_SUFIJO), min(tamano, MAXIMO_SIN_SUFIJO))
+    indices += [MAXIMO_SIN_SUFIJO + i for i in range(tamano - len(indices))]
+    textos = [
+        _redactar(i, sufijo=f" (ref. {i // MAXIMO_SIN_SUFIJO})" if i >= MAXIMO_SIN_SUFIJO else '')
+        for i in indices
+    ]
+
+    categorias = {
+        area: ChatbotCategory.objects.get_or_create(name=f"{CATEGORIA_PREFIJO} {area}")[0]
+        for area in _AREAS
+    }
+
+    entradas = []
+    for inicio in range(0, len(textos), batch_size):
+        lote = textos[inicio:inicio + batch_size]
+        embeddings = encoder.encode([t['question'] for t in lote])
+        creadas = ChatbotKnowledgeBase.objects.bulk_create([
+            ChatbotKnowledgeBase(
+                category=categorias[t['area']],
+                question=t['question'],
+                answer=t['answer'],
+                keywords=t['keywords'],
+                question_embedding=np.asarray(embedding, dtype=np.float32).tolist(),
+            )
+            for t, embedding in zip(lote, embeddings)
+        ])
+        entradas.extend(dict(t, id=kb.id) for t, kb in zip(lote, creadas))
+
+    # bulk_create no devuelve ids en todos los motores (p. ej. MySQL): resolverlos por la pregunta
+    sin_id = [e for e in entradas if e['id'] is None]
+    if sin_id:
+        ids = dict(ChatbotKnowledgeBase.objects.filter(
+            question__in=[e['question'] for e in sin_id]
+        ).values_list('question', 'id'))
+        for entrada in sin_id:
+            entrada['id'] = ids.get(entrada['question'])
+    return entradas
+
+
+def generar_consultas(entradas: List[Dict], por_tipo: int, seed: int = 42,
+                      tipos: Iterable[str] = TIPOS_CONSULTA) -> List[Dict]:
+    """Arma el conjunto de consultas a repetir, con la entrada esperada (None si está fuera de dominio)."""
+    rng = random.Random(seed)
+    consultas = []
+    for tipo in tipos:
+        for n in range(por_tipo):
+            if tipo == 'out_of_domain':
+                consultas.append({'tipo': tipo, 'texto': _FUERA_DE_DOMINIO[n % len(_FUERA_DE_DOMINIO)], 'esperado': None})
+                continue
+            entrada = rng.choice(entradas)
+            texto = {
+                'exact': entrada['question'],
+                'paraphrased': entrada['paraphrase'],
+                'typo': _con_errores(entrada['question'], rng),
+            }[tipo]
+            consultas.append({'tipo': tipo, 'texto': texto, 'esperado': entrada['id']})
+    return consultas
+
+
+def resumir_latencias(valores: List[float]) -> Dict:
+    """Media, percentiles (nearest-rank) y máximo de una lista de latencias en ms."""
+    if not valores:
+        return {'avg_ms': None, 'p50_ms': None, 'p90_ms': None, 'p99_ms': None, 'max_ms': None}
+    ordenados = sorted(valores)
+
+    def _p(p):
+        return round(ordenados[min(len(ordenados) - 1, max(0, math.ceil(p / 100 * len(ordenados)) - 1))], 3)
+
+    return {
+        'avg_ms': round(sum(ordenados) / len(ordenados), 3),
+        'p50_ms': _p(50),
+        'p90_ms': _p(90),
+        'p99_ms': _p(99),
+        'max_ms': round(ordenados[-1], 3),
+    }
+
+
+def ejecutar_consultas(consultas: List[Dict], use_cache: bool = False) -> Dict:
+    """
+    Repite las consultas contra `procesar_consulta_con_ia` y mide latencia, acierto y
+    consultas SQL, estas últimas atribuidas a la etapa del pipeline en la que se ejecutan.
+    """
+    sql_por_etapa = Counter()
+
+    def _contar_sql(execute, sql, params, many, context):
+        sql_por_etapa[etapa_actual() or 'other'] += 1
+        return execute(sql, params, many, context)
+
+    latencias = defaultdict(list)
+    aciertos = Counter()
+    sql_por_tipo = Counter()
+    metodos = defaultdict(Counter)
+
+    reiniciar_metricas()
+    with connection.execute_wrapper(_contar_sql):
+        for consulta in consultas:
+            antes = sum(sql_por_etapa.values())
+            inicio = time.perf_counter()
+            respuesta = procesar_consulta_con_ia(consulta['texto'], use_cache=use_cache)
+            latencias[consulta['tipo']].append((time.perf_counter() - inicio) * 1000)
+            sql_por_tipo[consulta['tipo']] += sum(sql_por_etapa.values()) - antes
+
+            if respuesta.get('knowledge_id') == consulta['esperado']:
+                aciertos[consulta['tipo']] += 1
+            metodos[consulta['tipo']][respuesta.get('search_method') if respuesta.get('knowledge_id') else 'none'] += 1
+
+    por_tipo = {}
+    for tipo, valores in latencias.items():
+        por_tipo[tipo] = {
+            'queries': len(valores),
+            'accuracy': round(aciertos[tipo] / len(valores), 4),
+            'sql_per_query': round(sql_por_tipo[tipo] / len(valores), 2),
+            'search_methods': dict(metodos[tipo]),
+            **resumir_latencias(valores),
+        }
+
+    etapas = obtener_instantanea()['stages']
+    total_consultas = len(consultas) or 1
+    for etapa in set(etapas) | set(sql_por_etapa):
+        resumen = etapas.setdefault(etapa, {'count': 0})
+        resumen['sql_queries'] = sql_por_etapa.get(etapa, 0)
+        resumen['sql_per_query'] = round(sql_por_etapa.get(etapa, 0) / total_consultas, 2)
+
+    return {
+        'queries': len(consultas),
+        'latency': resumir_latencias([v for valores in latencias.values() for v in valores]),
+        'by_type': por_tipo,
+        'stages': etapas,
+    }
+
+
+def _limpiar_caches(consultas: List[Dict]) -> None:
+    """La caché no participa del rollback: descartar lo que la corrida dejó en ella."""
+    cache.delete_many([_generate_cache_key(c['texto']) for c in consultas])
+    invalidar_ranking()
+    invalidate_stats_cache()
+
+
+def ejecutar_benchmark(tamano: int, por_tipo: int = 25, seed: int = 42, encoder=None,
+                       use_cache: bool = False, aislar: bool = True, permitir_produccion: bool = False,
+                       tipos: Iterable[str] = TIPOS_CONSULTA) -> Dict:
+    """
+    Genera una base sintética de `tamano` entradas, repite las consultas y revierte todo.
+
+    Con `aislar` las entradas reales se desactivan durante la corrida para que solo
+    compitan las sintéticas; si hay entradas activas se exige `permitir_produccion`.
+    Con `encoder` (p. ej. EncoderSimulado) no se usa el modelo real.
+
+    Raises:
+        RuntimeError: Si no hay modelo ni encoder, o si aislar bloquearía entradas reales
+            sin `permitir_produccion`.
+    """
+    if aislar and not permitir_produccion:
+        activas = ChatbotKnowledgeBase.objects.filter(is_active=True).count()
+        if activas:
+            raise RuntimeError(
+                f"La base tiene {activas} entradas activas: aislar la corrida las bloquearía hasta el final. "
+                "Usa una base de datos de benchmark, --keep-existing o --allow-production."
+            )
+
+    consultas: List[Dict] = []
+    with usar_encoder(encoder) if encoder is not None else nullcontext():
+        encoder_activo = _model_manager.model
+        if encoder_activo is None:
+            raise RuntimeError("No hay modelo de embeddings disponible; usa un encoder simulado.")
+
+        try:
+            with transaction.atomic():
+                if aislar:
+                    ChatbotKnowledgeBase.objects.filter(is_active=True).update(is_active=False)
+                invalidar_ranking()
+
+                inicio = time.perf_counter()
+                entradas = generar_base_sintetica(tamano, encoder_activo, seed=seed)
+                segundos_carga = time.perf_counter() - inicio
+
+                # Índice con las entradas sin confirmar, solo para este proceso
+                with usar_indice(construir_indice()):
+                    consultas = generar_consultas(entradas, por_tipo, seed=seed, tipos=tipos)
+                    informe = ejecutar_consultas(consultas, use_cache=use_cache)
+                transaction.set_rollback(True)
+        finally:
+            _limpiar_caches(consultas)
+
+    informe.update({
+        'kb_size': tamano,
+        'seed': seed,
+        'encoder': 'stub' if isinstance(encoder_activo, EncoderSimulado) else 'model',
+        'seed_seconds': round(segundos_carga, 3),
+    })
+    logger.info(f"Benchmark con {tamano} entradas: p50 {informe['latency']['p50_ms']} ms, p99 {informe['latency']['p99_ms']} ms")
+    return informe
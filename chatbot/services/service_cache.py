@@ -6,6 +6,10 @@ from django.core.cache import cache
 
 CACHE_TIMEOUT = 3600
 CACHE_PREFIX = 'chatbot'
+STATS_PREFIX = f"{CACHE_PREFIX}:stats"
+STATS_TOTAL_CONVERSATIONS_KEY = f"{STATS_PREFIX}:total_conversations"
+STATS_TOTAL_VIEWS_KEY = f"{STATS_PREFIX}:total_views"
+STATS_CATALOG_KEY = f"{STATS_PREFIX}:catalog"
 
 
 def _generate_cache_key(question: str) -> str:
@@ -40,4 +44,4 @@ def invalidate_frequent_questions_cache() -> None:
 
 
 def invalidate_stats_cache() -> None:
-    cache.delete(f"{CACHE_PREFIX}:stats") 
\ No newline at end of file
+    cache.delete_many([STATS_TOTAL_CONVERSATIONS_KEY, STATS_TOTAL_VIEWS_KEY, STATS_CATALOG_KEY]) 
\ No newline at end of file
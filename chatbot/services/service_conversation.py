@@ -5,14 +5,14 @@ from typing import Optional
 from django.contrib.auth import get_user_model
 
 from ..models import ChatbotKnowledgeBase, ChatConversation
-from .service_cache import invalidate_stats_cache
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
 def registrar_conversacion(session_id: str, user_id: Optional[int], question_text: str, 
-                          answer_text: str, matched_knowledge: Optional[ChatbotKnowledgeBase]) -> None:
+                          answer_text: str, matched_knowledge: Optional[ChatbotKnowledgeBase],
+                          search_method: str = '', score: Optional[float] = None) -> None:
     try:
         user = None
         if user_id:
@@ -26,9 +26,10 @@ def registrar_conversacion(session_id: str, user_id: Optional[int], question_tex
             user=user,
             question_text=question_text,
             answer_text=answer_text,
-            matched_knowledge=matched_knowledge
+            matched_knowledge=matched_knowledge,
+            search_method=search_method,
+            score=score
         )
-        invalidate_stats_cache()
     except Exception as e:
         logger.error(f"Error registrando conversación: {e}")
 
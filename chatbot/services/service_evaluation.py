@@ -0,0 +1,203 @@
+"""
+Servicio de evaluación offline de la calidad de recuperación del chatbot.
+
+Compara configuraciones de búsqueda (backends, umbrales, índices) sobre un conjunto
+etiquetado de consultas y reporta accuracy@1/@3, MRR y latencia de cada una. Las
+configuraciones se registran con `registrar_configuracion`; cada una recibe la pregunta
+y `k` y devuelve [(knowledge_id, score)] ordenado de mejor a peor.
+"""
+
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.db import transaction
+
+from ..models import ChatbotKnowledgeBase
+from .service_ai import SIMILARITY_THRESHOLD, buscar_candidatos_embeddings, codificar_pregunta, procesar_consulta_con_ia
+from .service_benchmark import resumir_latencias
+from .service_cache import invalidate_stats_cache
+from .service_index import (
+    BACKEND_EXACT, BACKEND_IVF, IVF_NLIST, IVF_NPROBE, IndiceExacto, IndiceIVF, construir_indice, usar_indice
+)
+from .service_leaderboard import invalidar_ranking
+from .service_vectors import FUENTES
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+
+Ranking = List[Tuple[Optional[int], float]]
+CONFIGURACIONES: Dict[str, Callable[[str, int], Ranking]] = {}
+# Umbral a partir del cual cada configuración considera que "responde" (para fuera de dominio).
+UMBRALES: Dict[str, float] = {}
+
+
+def registrar_configuracion(nombre: str, umbral: float = 0.0):
+    """Decorador que registra una configuración de búsqueda a evaluar."""
+    def decorador(funcion):
+        CONFIGURACIONES[nombre] = funcion
+        UMBRALES[nombre] = umbral
+        return funcion
+    return decorador
+
+
+@registrar_configuracion('pipeline')
+def _pipeline(pregunta: str, k: int) -> Ranking:
+    """El pipeline completo de producción (multi-nivel); solo devuelve su respuesta final."""
+    respuesta = procesar_consulta_con_ia(pregunta, use_cache=False)
+    if respuesta.get('knowledge_id'):
+        return [(respuesta['knowledge_id'], float(respuesta['score']))]
+    return []
+
+
+@registrar_configuracion('embeddings', umbral=SIMILARITY_THRESHOLD)
+def _embeddings(pregunta: str, k: int) -> Ranking:
+    """Solo el nivel semántico, con el índice y backend configurados (CHATBOT_INDEX_BACKEND)."""
+    return [(item.id, score) for item, score in buscar_candidatos_embeddings(pregunta, k=k)]
+
+
+MULTI_VECTOR = 'multi_vector'
+
+# Índices construidos para la evaluación en curso, por configuración (se descartan en cada `evaluar`).
+_indices_evaluados: Dict[str, IndiceExacto] = {}
+
+
+def _indice_para(nombre: str) -> IndiceExacto:
+    if BACKEND_EXACT not in _indices_evaluados:
+        _indices_evaluados[BACKEND_EXACT] = construir_indice(BACKEND_EXACT, fuentes=[])
+    if nombre == MULTI_VECTOR and MULTI_VECTOR not in _indices_evaluados:
+        # Exacto con todos los vectores adicionales guardados (generate_embeddings --extra-sources)
+        _indices_evaluados[MULTI_VECTOR] = construir_indice(BACKEND_EXACT, fuentes=FUENTES)
+    if nombre == BACKEND_IVF and BACKEND_IVF not in _indices_evaluados:
+        # Se fuerza IVF aunque la base sea chica, para poder comparar su recall con el exacto
+        exacto = _indices_evaluados[BACKEND_EXACT]
+        _indices_evaluados[BACKEND_IVF] = IndiceIVF.construir(
+            np.asarray(exacto.ids), np.asarray(exacto.matriz), nlist=IVF_NLIST, nprobe=IVF_NPROBE
+        )
+    return _indices_evaluados[nombre]
+
+
+def _buscar_en(nombre: str):
+    def buscar(pregunta: str, k: int) -> Ranking:
+        return _indice_para(nombre).buscar(codificar_pregunta(pregunta), k)
+    return buscar
+
+
+registrar_configuracion(BACKEND_EXACT, umbral=SIMILARITY_THRESHOLD)(_buscar_en(BACKEND_EXACT))
+registrar_configuracion(BACKEND_IVF, umbral=SIMILARITY_THRESHOLD)(_buscar_en(BACKEND_IVF))
+registrar_configuracion(MULTI_VECTOR, umbral=SIMILARITY_THRESHOLD)(_buscar_en(MULTI_VECTOR))
+
+
+def cargar_casos(ruta: str) -> Tuple[List[Dict], List[str]]:
+    """
+    Lee un archivo de consultas etiquetadas. Acepta dos formatos de entrada, mezclables:
+
+    - Entradas estilo `kb_data.json` con `question` y `paraphrases`: cada paráfrasis (y, con
+      `"include_question": true`, la propia pregunta) debe recuperar esa entrada.
+    - Casos explícitos `{"query": "...", "knowledge_id": 12}`; `knowledge_id` null indica una
+      consulta fuera de dominio que no debería responderse.
+
+    Devuelve los casos [{'query', 'knowledge_id'}] y las preguntas que no se encontraron activas.
+    """
+    with open(ruta, 'r', encoding='utf-8') as archivo:
+        datos = json.load(archivo)
+
+    preguntas = [entrada['question'] for entrada in datos if 'question' in entrada]
+    ids = dict(ChatbotKnowledgeBase.objects.filter(
+        question__in=preguntas, is_active=True
+    ).values_list('question', 'id'))
+
+    casos, omitidas = [], []
+    for entrada in datos:
+        if 'query' in entrada:
+            casos.append({'query': entrada['query'], 'knowledge_id': entrada.get('knowledge_id')})
+            continue
+        knowledge_id = ids.get(entrada.get('question'))
+        if knowledge_id is None:
+            omitidas.append(entrada.get('question'))
+            continue
+        consultas = list(entrada.get('paraphrases', []))
+        if entrada.get('include_question'):
+            consultas.insert(0, entrada['question'])
+        casos.extend({'query': consulta, 'knowledge_id': knowledge_id} for consulta in consultas)
+    return casos, omitidas
+
+
+def evaluar_configuracion(nombre: str, casos: List[Dict], k: int = TOP_K) -> Dict:
+    funcion = CONFIGURACIONES[nombre]
+    umbral = UMBRALES.get(nombre, 0.0)
+    latencias = []
+    aciertos_1 = aciertos_3 = 0
+    rango_reciproco = 0.0
+    en_dominio = fuera_de_dominio = falsos_positivos = 0
+
+    for caso in casos:
+        inicio = time.perf_counter()
+        ranking = funcion(caso['query'], k)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+        if caso['knowledge_id'] is None:
+            fuera_de_dominio += 1
+            if ranking and ranking[0][1] >= umbral:
+                falsos_positivos += 1
+            continue
+
+        en_dominio += 1
+        ids = [knowledge_id for knowledge_id, _ in ranking[:k]]
+        if caso['knowledge_id'] in ids:
+            posicion = ids.index(caso['knowledge_id']) + 1
+            rango_reciproco += 1 / posicion
+            aciertos_1 += posicion == 1
+            aciertos_3 += posicion <= 3
+
+    return {
+        'queries': len(casos),
+        'in_domain': en_dominio,
+        'accuracy@1': round(aciertos_1 / en_dominio, 4) if en_dominio else None,
+        'accuracy@3': round(aciertos_3 / en_dominio, 4) if en_dominio else None,
+        'mrr': round(rango_reciproco / en_dominio, 4) if en_dominio else None,
+        'out_of_domain': fuera_de_dominio,
+        'false_positive_rate': round(falsos_positivos / fuera_de_dominio, 4) if fuera_de_dominio else None,
+        **resumir_latencias(latencias),
+    }
+
+
+def evaluar(casos: List[Dict], configuraciones: Iterable[str], k: int = TOP_K,
+            permitir_produccion: bool = False) -> Dict[str, Dict]:
+    """
+    Evalúa cada configuración sobre los mismos casos, con un índice propio del proceso (no
+    publica versiones). Los efectos secundarios del pipeline (contadores de vistas) se
+    revierten al terminar, pero sus UPDATE bloquean las entradas durante toda la evaluación:
+    con entradas activas, evaluar 'pipeline' exige `permitir_produccion`.
+
+    Raises:
+        ValueError: Si alguna configuración no está registrada.
+        RuntimeError: Si 'pipeline' tocaría entradas reales sin `permitir_produccion`.
+    """
+    configuraciones = list(configuraciones)
+    desconocidas = [nombre for nombre in configuraciones if nombre not in CONFIGURACIONES]
+    if desconocidas:
+        raise ValueError(f"Configuraciones desconocidas: {', '.join(desconocidas)}")
+    if 'pipeline' in configuraciones and not permitir_produccion:
+        activas = ChatbotKnowledgeBase.objects.filter(is_active=True).count()
+        if activas:
+            raise RuntimeError(
+                f"La base tiene {activas} entradas activas: 'pipeline' las bloquearía hasta el final. "
+                "Usa una base de datos de evaluación, omite 'pipeline' o usa --allow-production."
+            )
+
+    resultados = {}
+    _indices_evaluados.clear()
+    try:
+        with transaction.atomic(), usar_indice(construir_indice()):
+            for nombre in configuraciones:
+                resultados[nombre] = evaluar_configuracion(nombre, casos, k=k)
+                logger.info(f"Evaluación '{nombre}': acc@1 {resultados[nombre]['accuracy@1']}, MRR {resultados[nombre]['mrr']}")
+            transaction.set_rollback(True)
+    finally:
+        invalidar_ranking()
+        invalidate_stats_cache()
+    return resultados
@@ -0,0 +1,527 @@
+"""
+Índice vectorial de la base de conocimiento del chatbot.
+
+Backends (CHATBOT_INDEX_BACKEND):
+- 'exact': matriz normalizada (n x d); la búsqueda es un producto matriz-vector.
+- 'ivf': particiones por k-means (NumPy); solo se recorren las `nprobe` listas más cercanas
+  a la consulta. Por debajo de CHATBOT_INDEX_IVF_MIN_SIZE entradas se usa el exacto.
+
+El índice se persiste en disco como .npy versionados (`<CHATBOT_INDEX_DIR>/<version>/
+embeddings.npy` + `ids.npy`) con un puntero CURRENT que se cambia de forma atómica. Lo
+publican `generate_embeddings`, `build_chatbot_index` y, CHATBOT_INDEX_PUBLISH_DELAY segundos
+después de un cambio en la base (signals), el proceso que lo hizo. Cada proceso relee CURRENT
+a lo sumo cada CHATBOT_INDEX_VERSION_TTL segundos y carga la versión nueva con
+`np.load(mmap_mode='r')`: no convierte JSON y la caché de páginas del SO comparte una copia.
+El proceso que cambió la base reconstruye el suyo desde la base en la búsqueda siguiente.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+from ..models import ChatbotKnowledgeBase, ChatbotKnowledgeVector, ChatbotQuestionAlias
+from .service_metrics import fijar
+from .service_vectors import EXTRA_SOURCES
+
+logger = logging.getLogger(__name__)
+
+BACKEND_EXACT = 'exact'
+BACKEND_IVF = 'ivf'
+
+INDEX_BACKEND = getattr(settings, 'CHATBOT_INDEX_BACKEND', BACKEND_EXACT)
+INDEX_DIR = getattr(settings, 'CHATBOT_INDEX_DIR', os.path.join(settings.BASE_DIR, 'chatbot_index'))
+IVF_MIN_SIZE = getattr(settings, 'CHATBOT_INDEX_IVF_MIN_SIZE', 5000)
+IVF_NLIST = getattr(settings, 'CHATBOT_INDEX_IVF_NLIST', None)
+IVF_NPROBE = getattr(settings, 'CHATBOT_INDEX_IVF_NPROBE', 8)
+
+# Segundos entre lecturas de CURRENT, y espera antes de publicar los cambios de la base.
+INDEX_VERSION_TTL = getattr(settings, 'CHATBOT_INDEX_VERSION_TTL', 2.0)
+PUBLISH_DELAY = getattr(settings, 'CHATBOT_INDEX_PUBLISH_DELAY', 5.0)
+# Versiones que se conservan en disco (los procesos pueden seguir mapeando la anterior).
+INDEX_KEEP_VERSIONS = getattr(settings, 'CHATBOT_INDEX_KEEP_VERSIONS', 2)
+_ARCHIVO_META = 'meta.json'
+_ARCHIVO_ACTUAL = 'CURRENT'
+
+
+def normalizar(matriz: np.ndarray) -> np.ndarray:
+    """Normaliza filas (o un vector) a norma 1 en float32, para que el producto sea el coseno."""
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def _top_k(puntajes: np.ndarray, k: int) -> np.ndarray:
+    """Posiciones de los `k` mayores puntajes, de mayor a menor."""
+    k = min(k, len(puntajes))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidatos = np.argpartition(-puntajes, k - 1)[:k]
+    return candidatos[np.argsort(-puntajes[candidatos], kind='stable')]
+
+
+class IndiceExacto:
+    """Búsqueda exacta por producto matricial sobre la matriz de embeddings normalizada."""
+
+    backend = BACKEND_EXACT
+
+    def __init__(self, ids: np.ndarray, matriz: np.ndarray, huella: Optional[Dict] = None):
+        # `ids` es la entrada dueña de cada fila: con vectores adicionales una entrada tiene varias
+        self.ids = ids
+        self.matriz = matriz
+        self.huella = huella or {}
+        self.multivector = len(np.unique(ids)) < len(ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.matriz.shape[1] if self.matriz.ndim == 2 else 0
+
+    def buscar(self, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        return self._seleccionar(self.matriz @ vector, k)
+
+    def buscar_lote(self, consultas: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Búsqueda de varias consultas (q x d) con un solo producto matriz-matriz."""
+        return [self._seleccionar(puntajes, k) for puntajes in consultas @ self.matriz.T]
+
+    def _seleccionar(self, puntajes: np.ndarray, k: int, posiciones: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Las `k` mejores entradas. Con varias filas por entrada se queda con su mejor puntaje
+        (max-pooling), ampliando los candidatos hasta reunir `k` entradas distintas.
+        """
+        def _id(i):
+            return int(self.ids[posiciones[i] if posiciones is not None else i])
+
+        if not self.multivector:
+            return [(_id(i), float(puntajes[i])) for i in _top_k(puntajes, k)]
+
+        candidatos = k * 4
+        while True:
+            mejores: Dict[int, float] = {}
+            for i in _top_k(puntajes, candidatos):
+                mejores.setdefault(_id(i), float(puntajes[i]))
+                if len(mejores) == k:
+                    return list(mejores.items())
+            if candidatos >= len(puntajes):
+                return list(mejores.items())
+            candidatos *= 4
+
+    def _arreglos(self) -> Dict[str, np.ndarray]:
+        return {'ids': self.ids, 'embeddings': self.matriz}
+
+    def _meta(self) -> Dict:
+        return {}
+
+    def guardar(self, directorio: str, version: str) -> None:
+        """Escribe los arreglos como .npy y, al final, el meta.json que los valida."""
+        os.makedirs(directorio, exist_ok=True)
+        for nombre, arreglo in self._arreglos().items():
+            np.save(os.path.join(directorio, f'{nombre}.npy'), np.ascontiguousarray(arreglo))
+        meta = {
+            'backend': self.backend,
+            'version': version,
+            'size': len(self),
+            'dimension': self.dimension,
+            'huella': self.huella,
+            **self._meta(),
+        }
+        with open(os.path.join(directorio, _ARCHIVO_META), 'w', encoding='utf-8') as archivo:
+            json.dump(meta, archivo)
+
+    @classmethod
+    def _desde_disco(cls, directorio: str, meta: Dict) -> 'IndiceExacto':
+        return cls(
+            np.load(os.path.join(directorio, 'ids.npy'), mmap_mode='r'),
+            np.load(os.path.join(directorio, 'embeddings.npy'), mmap_mode='r'),
+            huella=meta.get('huella'),
+        )
+
+
+class IndiceIVF(IndiceExacto):
+    """
+    Índice de archivos invertidos (IVF): la matriz se guarda ordenada por partición, así
+    que cada lista es un tramo contiguo [offsets[c], offsets[c + 1]).
+    """
+
+    backend = BACKEND_IVF
+
+    def __init__(self, ids, matriz, centroides, offsets, nprobe: int = IVF_NPROBE, huella=None):
+        super().__init__(ids, matriz, huella=huella)
+        self.centroides = centroides
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def construir(cls, ids: np.ndarray, matriz: np.ndarray, nlist: Optional[int] = None,
+                  nprobe: int = IVF_NPROBE, centroides: Optional[np.ndarray] = None,
+                  huella=None, seed: int = 0) -> 'IndiceIVF':
+        """
+        Particiona la matriz con k-means esférico. Si se pasan `centroides` (de un índice
+        anterior con la misma dimensión) solo se reasignan las filas, sin reentrenar.
+        """
+        if centroides is None:
+            nlist = nlist or max(1, int(math.sqrt(len(ids))))
+            centroides = _kmeans(matriz, nlist, np.random.default_rng(seed))
+        asignacion = _asignar(matriz, centroides)
+        orden = np.argsort(asignacion, kind='stable')
+        offsets = np.searchsorted(asignacion[orden], np.arange(len(centroides) + 1))
+        return cls(ids[orden], matriz[orden], centroides, offsets, nprobe=nprobe, huella=huella)
+
+    def buscar(self, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        listas = _top_k(self.centroides @ vector, self.nprobe)
+        posiciones, puntajes = [], []
+        for lista in listas:
+            inicio, fin = int(self.offsets[lista]), int(self.offsets[lista + 1])
+            if fin > inicio:
+                posiciones.append(np.arange(inicio, fin))
+                puntajes.append(self.matriz[inicio:fin] @ vector)
+        if not posiciones:
+            return []
+        return self._seleccionar(np.concatenate(puntajes), k, posiciones=np.concatenate(posiciones))
+
+    def buscar_lote(self, consultas: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        # Cada consulta recorre listas distintas: no hay un producto común que aprovechar
+        return [self.buscar(vector, k) for vector in consultas]
+
+    def _arreglos(self):
+        return {**super()._arreglos(), 'centroides': self.centroides, 'offsets': self.offsets}
+
+    def _meta(self):
+        return {'nlist': len(self.centroides), 'nprobe': self.nprobe}
+
+    @classmethod
+    def _desde_disco(cls, directorio, meta):
+        base = IndiceExacto._desde_disco(directorio, meta)
+        return cls(
+            base.ids, base.matriz,
+            np.load(os.path.join(directorio, 'centroides.npy')),
+            np.load(os.path.join(directorio, 'offsets.npy')),
+            nprobe=IVF_NPROBE,
+            huella=base.huella,
+        )
+
+
+def _asignar(matriz: np.ndarray, centroides: np.ndarray, lote: int = 8192) -> np.ndarray:
+    asignacion = np.empty(len(matriz), dtype=np.int64)
+    for inicio in range(0, len(matriz), lote):
+        asignacion[inicio:inicio + lote] = np.argmax(matriz[inicio:inicio + lote] @ centroides.T, axis=1)
+    return asignacion
+
+
+def _kmeans(matriz: np.ndarray, nlist: int, rng, iteraciones: int = 10, muestras_por_lista: int = 64) -> np.ndarray:
+    """k-means esférico sobre una muestra de la matriz (las filas ya están normalizadas)."""
+    muestra = matriz[rng.choice(len(matriz), min(len(matriz), nlist * muestras_por_lista), replace=False)]
+    nlist = min(nlist, len(muestra))
+    centroides = muestra[rng.choice(len(muestra), nlist, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = _asignar(muestra, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, muestra)
+        vacias = ~np.bincount(asignacion, minlength=nlist).astype(bool)
+        # Las particiones vacías se reinician en puntos al azar de la muestra
+        sumas[vacias] = muestra[rng.choice(len(muestra), int(vacias.sum()))]
+        centroides = normalizar(sumas)
+    return centroides
+
+
+INDICES = {BACKEND_EXACT: IndiceExacto, BACKEND_IVF: IndiceIVF}
+
+
+def _huella(fuentes: Iterable[str]) -> Dict:
+    """Resumen barato del estado de la base para validar un índice leído de disco."""
+    datos = ChatbotKnowledgeBase.objects.filter(
+        is_active=True, question_embedding__isnull=False
+    ).aggregate(total=Count('id'), ultima=Max('updated_at'), max_id=Max('id'))
+    huella = {
+        'total': datos['total'],
+        'ultima': datos['ultima'].isoformat() if datos['ultima'] else None,
+        'max_id': datos['max_id'],
+    }
+    if fuentes:
+        vectores = ChatbotKnowledgeVector.objects.filter(source__in=fuentes).aggregate(
+            total=Count('id'), max_id=Max('id')
+        )
+        huella.update(fuentes=sorted(fuentes), vectores=vectores['total'], vectores_max_id=vectores['max_id'])
+    alias = _alias_indexables().aggregate(total=Count('id'), ultima=Max('updated_at'))
+    if alias['total']:
+        huella.update(alias=alias['total'], alias_ultima=alias['ultima'].isoformat())
+    return huella
+
+
+def _alias_indexables():
+    return ChatbotQuestionAlias.objects.filter(
+        status=ChatbotQuestionAlias.STATUS_APPROVED, knowledge__is_active=True, embedding__isnull=False
+    )
+
+
+def _filas_del_indice(fuentes: Iterable[str]) -> List[Tuple[int, list]]:
+    """
+    (id de la entrada, embedding) de cada pregunta activa, de sus alias aprobados y de
+    sus vectores adicionales.
+    """
+    filas = list(ChatbotKnowledgeBase.objects.filter(
+        is_active=True, question_embedding__isnull=False
+    ).order_by('id').values_list('id', 'question_embedding'))
+    filas += _alias_indexables().order_by('knowledge_id', 'id').values_list('knowledge_id', 'embedding')
+    if fuentes:
+        filas += ChatbotKnowledgeVector.objects.filter(
+            knowledge__is_active=True, source__in=fuentes
+        ).order_by('knowledge_id', 'id').values_list('knowledge_id', 'embedding')
+    return filas
+
+
+def construir_indice(backend: Optional[str] = None, anterior: Optional[IndiceExacto] = None,
+                     fuentes: Optional[Iterable[str]] = None) -> IndiceExacto:
+    """
+    Construye el índice desde la base de datos con las entradas activas que tienen embedding
+    y, si hay `fuentes` (por defecto CHATBOT_INDEX_EXTRA_SOURCES), sus vectores adicionales.
+    """
+    backend = backend or INDEX_BACKEND
+    if backend not in INDICES:
+        raise ValueError(f"Backend de índice desconocido: {backend}")
+    fuentes = list(EXTRA_SOURCES if fuentes is None else fuentes)
+
+    inicio = time.perf_counter()
+    huella = _huella(fuentes)
+    filas = _filas_del_indice(fuentes)
+
+    # Ignorar embeddings con otra dimensión (p. ej. generados con otro modelo)
+    dimension = Counter(len(e) for _, e in filas if e).most_common(1)
+    dimension = dimension[0][0] if dimension else 0
+    validas = [(i, e) for i, e in filas if e and len(e) == dimension]
+    if len(validas) < len(filas):
+        logger.warning(f"{len(filas) - len(validas)} embeddings con dimensión distinta de {dimension} fuera del índice")
+
+    ids = np.array([i for i, _ in validas], dtype=np.int64)
+    matriz = normalizar(np.array([e for _, e in validas], dtype=np.float32).reshape(len(validas), dimension))
+
+    if backend == BACKEND_IVF and len(ids) >= IVF_MIN_SIZE:
+        centroides = None
+        if isinstance(anterior, IndiceIVF) and anterior.dimension == dimension:
+            centroides = np.asarray(anterior.centroides)
+        indice = IndiceIVF.construir(ids, matriz, nlist=IVF_NLIST, centroides=centroides, huella=huella)
+    else:
+        indice = IndiceExacto(ids, matriz, huella=huella)
+
+    fijar('index_build_seconds', round(time.perf_counter() - inicio, 3))
+    fijar('index_size', len(indice))
+    logger.info(f"Índice '{indice.backend}' construido con {len(indice)} vectores")
+    return indice
+
+
+def _nueva_version() -> str:
+    # Ordenable por fecha, para podar las versiones antiguas
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def version_en_disco(directorio: str = INDEX_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(directorio, _ARCHIVO_ACTUAL), 'r', encoding='utf-8') as archivo:
+            return archivo.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def cargar_indice(directorio: str = INDEX_DIR, version: Optional[str] = None) -> Optional[Tuple[IndiceExacto, Dict]]:
+    """
+    Carga (memory-mapped) la versión apuntada por CURRENT. Si se indica `version` y no es la
+    publicada en disco, no lee nada. Devuelve None si no hay un índice válido.
+    """
+    actual = version_en_disco(directorio)
+    if actual is None or (version is not None and version != actual):
+        return None
+    carpeta = os.path.join(directorio, actual)
+    try:
+        with open(os.path.join(carpeta, _ARCHIVO_META), 'r', encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+        return INDICES[meta['backend']]._desde_disco(carpeta, meta), meta
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"No se pudo cargar el índice de {carpeta}: {e}")
+        return None
+
+
+def persistir_indice(indice: IndiceExacto, directorio: str = INDEX_DIR, version: Optional[str] = None) -> str:
+    """
+    Escribe el índice en una carpeta nueva `<directorio>/<version>` y cambia el puntero
+    CURRENT con os.replace (atómico): los lectores ven la versión anterior o la nueva, nunca
+    una a medio escribir. Conserva las últimas INDEX_KEEP_VERSIONS versiones.
+    """
+    version = version or _nueva_version()
+    os.makedirs(directorio, exist_ok=True)
+    temporal = os.path.join(directorio, f'.tmp-{version}')
+    indice.guardar(temporal, version)
+    os.rename(temporal, os.path.join(directorio, version))
+
+    puntero = os.path.join(directorio, f'.{_ARCHIVO_ACTUAL}.tmp')
+    with open(puntero, 'w', encoding='utf-8') as archivo:
+        archivo.write(version)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(puntero, os.path.join(directorio, _ARCHIVO_ACTUAL))
+
+    _podar_versiones(directorio, version)
+    return version
+
+
+def _podar_versiones(directorio: str, actual: str) -> None:
+    versiones = sorted(
+        nombre for nombre in os.listdir(directorio)
+        if not nombre.startswith('.') and os.path.isdir(os.path.join(directorio, nombre))
+    )
+    for nombre in versiones[:-INDEX_KEEP_VERSIONS] if INDEX_KEEP_VERSIONS > 0 else versiones:
+        if nombre != actual:
+            # En Linux los procesos que aún la tengan mapeada conservan el acceso a los datos
+            shutil.rmtree(os.path.join(directorio, nombre), ignore_errors=True)
+
+
+def invalidar_indice() -> None:
+    """
+    La base cambió: este proceso reconstruye su índice en la próxima búsqueda y, al confirmarse
+    la transacción, se programa la publicación en disco que siguen los demás procesos.
+    """
+    _indice_del_proceso.sucio = True
+    transaction.on_commit(_marcar_y_publicar)
+
+
+def _marcar_y_publicar() -> None:
+    _indice_del_proceso.sucio = True
+    _publicador.programar()
+
+
+def publicar_indice(backend: Optional[str] = None, directorio: Optional[str] = None) -> IndiceExacto:
+    """Construye el índice, lo persiste en disco y cambia CURRENT: los procesos lo cargan al notarlo."""
+    indice = construir_indice(backend)
+    persistir_indice(indice, directorio or INDEX_DIR)
+    _indice_del_proceso.vigente_hasta = 0.0
+    return indice
+
+
+class _PublicacionDiferida:
+    """
+    Publica el índice en disco CHATBOT_INDEX_PUBLISH_DELAY segundos después del primer cambio:
+    los cambios que llegan mientras tanto (una importación, varias ediciones) van en la misma.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._temporizador: Optional[threading.Timer] = None
+
+    def programar(self) -> None:
+        with self._lock:
+            if self._temporizador is not None:
+                return
+            # No es daemon: un comando que termina espera a publicar sus cambios
+            self._temporizador = threading.Timer(PUBLISH_DELAY, self._en_hilo)
+            self._temporizador.start()
+
+    def _en_hilo(self) -> None:
+        try:
+            self.publicar()
+        finally:
+            # El hilo abrió su propia conexión a la base
+            connection.close()
+
+    def publicar(self) -> None:
+        with self._lock:
+            # Lo que cambie desde aquí programa otra publicación
+            self._temporizador = None
+        try:
+            publicar_indice()
+        except Exception as e:
+            logger.error(f"No se pudo publicar el índice en {INDEX_DIR}: {e}")
+
+
+_publicador = _PublicacionDiferida()
+
+
+class _IndiceDelProceso:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.indice: Optional[IndiceExacto] = None
+        # Versión del índice en uso (la de disco, o una local si se construyó desde la base)
+        self.version: Optional[str] = None
+        # Última versión de CURRENT que vio el proceso
+        self.en_disco: Optional[str] = None
+        # Cambios hechos en este proceso que aún no están en el índice
+        self.sucio = False
+        # Índice fijado con `usar_indice`: no sigue a CURRENT
+        self.fijo = False
+        # Hasta cuándo (time.monotonic) no hace falta releer CURRENT
+        self.vigente_hasta = 0.0
+
+    def obtener(self) -> IndiceExacto:
+        if self.fijo or (self.indice is not None and not self.sucio and time.monotonic() < self.vigente_hasta):
+            return self.indice
+
+        with self._lock:
+            if self.fijo:
+                return self.indice
+            en_disco = version_en_disco(INDEX_DIR)
+            if self.indice is not None and not self.sucio and en_disco == self.en_disco:
+                self.vigente_hasta = time.monotonic() + INDEX_VERSION_TTL
+                return self.indice
+
+            indice = version = None
+            # Una versión nueva en disco (de otro proceso o de `generate_embeddings`) se carga con
+            # mmap; al arrancar, la de disco vale solo si coincide con el estado de la base.
+            if not self.sucio and en_disco is not None:
+                persistido = cargar_indice(INDEX_DIR, version=en_disco)
+                if persistido is not None:
+                    cargado, meta = persistido
+                    if self.indice is not None or meta.get('huella') == _huella(EXTRA_SOURCES):
+                        indice, version = cargado, meta['version']
+
+            if indice is None:
+                self.sucio = False
+                indice = construir_indice(anterior=self.indice)
+                version = f"local-{uuid.uuid4().hex[:8]}"
+
+            self.indice, self.version, self.en_disco = indice, version, en_disco
+            self.vigente_hasta = time.monotonic() + INDEX_VERSION_TTL
+            return indice
+
+
+_indice_del_proceso = _IndiceDelProceso()
+
+
+def obtener_indice() -> IndiceExacto:
+    return _indice_del_proceso.obtener()
+
+
+def version_del_indice() -> Optional[str]:
+    """Versión del índice que usa este proceso (cambia cada vez que se reemplaza)."""
+    _indice_del_proceso.obtener()
+    return _indice_del_proceso.version
+
+
+@contextmanager
+def usar_indice(indice: IndiceExacto):
+    """
+    Fija el índice de este proceso sin publicar una versión: los demás procesos siguen
+    con el suyo (p. ej. un benchmark sobre entradas sin confirmar). El mapa exacto de
+    alias se reconstruye al entrar y al salir, porque la versión local es otra.
+    """
+    proceso = _indice_del_proceso
+    with proceso._lock:
+        anterior = (proceso.indice, proceso.version, proceso.fijo)
+        proceso.indice, proceso.version, proceso.fijo = indice, f"local-{uuid.uuid4().hex[:8]}", True
+    try:
+        yield indice
+    finally:
+        with proceso._lock:
+            proceso.indice, proceso.version, proceso.fijo = anterior
@@ -0,0 +1,94 @@
+"""Servicio de ranking de preguntas frecuentes para el chatbot."""
+
+import logging
+from typing import Dict, Iterable, List
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import ChatbotKnowledgeBase
+from .service_cache import CACHE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = getattr(settings, 'CHATBOT_LEADERBOARD_SIZE', 50)
+LEADERBOARD_TIMEOUT = getattr(settings, 'CHATBOT_LEADERBOARD_TIMEOUT', 900)
+LEADERBOARD_CACHE_KEY = f"{CACHE_PREFIX}:frequent_questions:top"
+
+
+def _calcular_ranking(limite: int) -> List[Dict]:
+    """Consulta de respaldo: usa el índice (is_active, view_count)."""
+    preguntas = ChatbotKnowledgeBase.objects.filter(
+        is_active=True
+    ).select_related('category').only(
+        'id', 'question', 'view_count', 'category__name'
+    ).order_by('-view_count', 'id')[:limite]
+
+    return [
+        {
+            'id': p.id,
+            'question': p.question,
+            'view_count': p.view_count,
+            'category': p.category.name if p.category else None
+        }
+        for p in preguntas
+    ]
+
+
+def refrescar_ranking() -> List[Dict]:
+    """Recalcula el top-N y lo deja en caché. Pensado para ejecutarse de forma programada."""
+    ranking = _calcular_ranking(LEADERBOARD_SIZE)
+    cache.set(LEADERBOARD_CACHE_KEY, ranking, LEADERBOARD_TIMEOUT)
+    return ranking
+
+
+def obtener_ranking() -> List[Dict]:
+    ranking = cache.get(LEADERBOARD_CACHE_KEY)
+    if ranking is None:
+        ranking = refrescar_ranking()
+    return ranking
+
+
+def obtener_preguntas_frecuentes(limite: int = 10) -> List[Dict]:
+    """Obtiene preguntas frecuentes leyendo el ranking precalculado."""
+    try:
+        if limite > LEADERBOARD_SIZE:
+            return _calcular_ranking(limite)
+        return [dict(entrada) for entrada in obtener_ranking()[:limite]]
+    except Exception as e:
+        logger.error(f"Error obteniendo preguntas frecuentes: {e}")
+        return []
+
+
+def registrar_vistas_en_ranking(knowledge_ids: Iterable[int]) -> None:
+    """
+    Revisa el ranking en caché tras incrementar (con F()) las vistas de estas entradas.
+
+    Lee los contadores ya actualizados de la base y solo si alguna entrada entra al
+    top-N o supera a la anterior invalida el ranking, que se recalcula en la próxima
+    lectura. No reescribe la lista en cada consulta: los conteos publicados se ponen
+    al día al recalcularse (TTL o `refresh_frequent_questions`).
+    """
+    try:
+        ranking = cache.get(LEADERBOARD_CACHE_KEY)
+        if ranking is None:
+            return
+        vistas = ChatbotKnowledgeBase.objects.filter(pk__in=list(knowledge_ids)).values_list('id', 'view_count')
+        if any(_cambia_el_ranking(ranking, knowledge_id, view_count) for knowledge_id, view_count in vistas):
+            invalidar_ranking()
+    except Exception as e:
+        logger.warning(f"Error actualizando ranking de preguntas frecuentes: {e}")
+
+
+def _cambia_el_ranking(ranking: List[Dict], knowledge_id: int, view_count: int) -> bool:
+    # Los conteos en caché solo pueden estar atrasados: si no se supera al anterior
+    # con su conteo en caché, tampoco con el real.
+    clave = (-view_count, knowledge_id)
+    for posicion, entrada in enumerate(ranking):
+        if entrada['id'] == knowledge_id:
+            anterior = ranking[posicion - 1] if posicion else None
+            return anterior is not None and clave < (-anterior['view_count'], anterior['id'])
+    return len(ranking) < LEADERBOARD_SIZE or clave < (-ranking[-1]['view_count'], ranking[-1]['id'])
+
+
+def invalidar_ranking() -> None:
+    cache.delete(LEADERBOARD_CACHE_KEY)
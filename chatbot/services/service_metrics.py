@@ -0,0 +1,204 @@
+"""
+Servicio de métricas de rendimiento del chatbot.
+
+Las métricas se agregan en memoria por proceso (cada worker expone las suyas) y no
+tocan la base de datos ni la caché, para que medir no añada latencia.
+"""
+
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from asgiref.local import Local
+
+# Límites superiores (en milisegundos) de los buckets de los histogramas.
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Muestras recientes que se conservan por etapa para calcular percentiles.
+MUESTRAS_POR_ETAPA = 2048
+
+# Etapas instrumentadas: total, cache_lookup, exact_lookup, encode, search_embeddings
+# (incluye encode), search_keywords, search_fuzzy, recommendations, db_write (contador de
+# vistas), conversation_log (registro de la conversación), first_event (tiempo hasta la
+# respuesta en el endpoint SSE) y batch (lote completo del endpoint de consultas en lote).
+
+
+class _Histograma:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.muestras = deque(maxlen=MUESTRAS_POR_ETAPA)
+
+    def observar(self, ms: float) -> None:
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.muestras.append(ms)
+
+    def percentil(self, p: float) -> Optional[float]:
+        if not self.muestras:
+            return None
+        ordenadas = sorted(self.muestras)
+        indice = min(len(ordenadas) - 1, max(0, math.ceil(p / 100 * len(ordenadas)) - 1))
+        return round(ordenadas[indice], 3)
+
+    def resumen(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'p50_ms': self.percentil(50),
+            'p90_ms': self.percentil(90),
+            'p99_ms': self.percentil(99),
+        }
+
+
+class _RegistroMetricas:
+    """Registro en memoria, seguro para hilos, de histogramas, contadores y valores puntuales."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self.histogramas: Dict[str, _Histograma] = {}
+            self.contadores: Dict[str, Dict[str, int]] = {}
+            self.valores: Dict[str, float] = {}
+            self.inicio = time.time()
+
+    def observar(self, etapa: str, ms: float) -> None:
+        with self._lock:
+            self.histogramas.setdefault(etapa, _Histograma()).observar(ms)
+
+    def incrementar(self, nombre: str, etiqueta: str = '', delta: int = 1) -> None:
+        with self._lock:
+            serie = self.contadores.setdefault(nombre, {})
+            serie[etiqueta] = serie.get(etiqueta, 0) + delta
+
+    def fijar(self, nombre: str, valor: float) -> None:
+        with self._lock:
+            self.valores[nombre] = valor
+
+
+_registro = _RegistroMetricas()
+# Pila de etapas en curso por hilo o corrutina, para atribuir trabajo (p. ej. consultas SQL) a la
+# etapa activa. `Local` de asgiref aísla las peticiones concurrentes del endpoint asíncrono y
+# acompaña a la corrutina a través de `sync_to_async`.
+_local = Local()
+
+
+@contextmanager
+def medir(etapa: str):
+    """Mide la duración del bloque y la registra en el histograma de la etapa."""
+    pila = getattr(_local, 'etapas', None)
+    if pila is None:
+        pila = _local.etapas = []
+    pila.append(etapa)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _registro.observar(etapa, (time.perf_counter() - inicio) * 1000)
+        pila.pop()
+
+
+def etapa_actual() -> Optional[str]:
+    """Etapa más interna en curso en el hilo actual, o None fuera del pipeline."""
+    pila = getattr(_local, 'etapas', None)
+    return pila[-1] if pila else None
+
+
+def registrar_duracion(etapa: str, segundos: float) -> None:
+    _registro.observar(etapa, segundos * 1000)
+
+
+def incrementar(nombre: str, etiqueta: str = '', delta: int = 1) -> None:
+    _registro.incrementar(nombre, etiqueta, delta)
+
+
+def fijar(nombre: str, valor: float) -> None:
+    _registro.fijar(nombre, valor)
+
+
+def reiniciar_metricas() -> None:
+    _registro.reiniciar()
+
+
+def obtener_instantanea() -> Dict:
+    """Copia consistente de las métricas del proceso actual."""
+    with _registro._lock:
+        etapas = {etapa: h.resumen() for etapa, h in _registro.histogramas.items()}
+        contadores = {nombre: dict(serie) for nombre, serie in _registro.contadores.items()}
+        valores = dict(_registro.valores)
+        inicio = _registro.inicio
+
+    cache_stats = contadores.get('cache_lookups', {})
+    aciertos, fallos = cache_stats.get('hit', 0), cache_stats.get('miss', 0)
+    metodos = contadores.get('search_method', {})
+    total_metodos = sum(metodos.values())
+
+    return {
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.time() - inicio, 1),
+        'model_loaded': bool(valores.get('model_loaded', 0)),
+        'model_load_seconds': valores.get('model_load_seconds'),
+        'queries': contadores.get('queries', {}).get('', 0),
+        'errors': contadores.get('errors', {}),
+        'rate_limited': contadores.get('rate_limited', {}),
+        'cache_hit_rate': round(aciertos / (aciertos + fallos), 4) if (aciertos + fallos) else None,
+        'search_method_distribution': {
+            metodo: round(cantidad / total_metodos, 4) for metodo, cantidad in metodos.items()
+        } if total_metodos else {},
+        'search_method_counts': metodos,
+        'stages': etapas,
+    }
+
+
+def _linea(nombre: str, valor, etiquetas: Dict[str, str]) -> str:
+    texto = ','.join(f'{k}="{v}"' for k, v in etiquetas.items())
+    return f"{nombre}{{{texto}}} {valor}"
+
+
+def exportar_prometheus() -> str:
+    """Representa las métricas del proceso en el formato de texto de Prometheus (0.0.4)."""
+    pid = str(os.getpid())
+    lineas: List[str] = []
+
+    with _registro._lock:
+        histogramas = {etapa: (list(h.buckets), h.count, h.total_ms) for etapa, h in _registro.histogramas.items()}
+        contadores = {nombre: dict(serie) for nombre, serie in _registro.contadores.items()}
+        valores = dict(_registro.valores)
+
+    lineas.append('# HELP chatbot_stage_duration_seconds Duración de cada etapa del pipeline del chatbot.')
+    lineas.append('# TYPE chatbot_stage_duration_seconds histogram')
+    for etapa, (buckets, count, total_ms) in sorted(histogramas.items()):
+        acumulado = 0
+        for limite, cantidad in zip(BUCKETS_MS, buckets):
+            acumulado += cantidad
+            lineas.append(_linea('chatbot_stage_duration_seconds_bucket', acumulado, {'pid': pid, 'stage': etapa, 'le': f'{limite / 1000:g}'}))
+        lineas.append(_linea('chatbot_stage_duration_seconds_bucket', count, {'pid': pid, 'stage': etapa, 'le': '+Inf'}))
+        lineas.append(_linea('chatbot_stage_duration_seconds_sum', f'{total_ms / 1000:.6f}', {'pid': pid, 'stage': etapa}))
+        lineas.append(_linea('chatbot_stage_duration_seconds_count', count, {'pid': pid, 'stage': etapa}))
+
+    etiquetas_contador = {
+        'cache_lookups': 'result', 'search_method': 'method', 'errors': 'type', 'rate_limited': 'identity', 'queries': None
+    }
+    for nombre, etiqueta in etiquetas_contador.items():
+        metrica = f'chatbot_{nombre}_total'
+        lineas.append(f'# TYPE {metrica} counter')
+        for valor_etiqueta, cantidad in sorted(contadores.get(nombre, {}).items()):
+            etiquetas = {'pid': pid}
+            if etiqueta:
+                etiquetas[etiqueta] = valor_etiqueta
+            lineas.append(_linea(metrica, cantidad, etiquetas))
+
+    for nombre, valor in sorted(valores.items()):
+        lineas.append(f'# TYPE chatbot_{nombre} gauge')
+        lineas.append(_linea(f'chatbot_{nombre}', valor, {'pid': pid}))
+
+    return '\n'.join(lineas) + '\n'
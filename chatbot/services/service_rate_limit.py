@@ -0,0 +1,136 @@
+"""
+Limitador de consultas del chatbot: cubetas de tokens en la caché de Django.
+
+La caché debe ser compartida entre workers (CACHE_URL en settings); con la LocMem por
+defecto cada proceso lleva sus propias cubetas y el límite se multiplica por los workers.
+
+Cada identidad (el usuario autenticado; o la IP y la sesión del anónimo) tiene una cubeta
+de `capacidad` tokens que se rellena de forma continua en CHATBOT_RATE_LIMIT_PERIOD segundos.
+Para usar solo operaciones atómicas de la caché (`add` + `incr`), el consumo se cuenta por
+ventanas del periodo y la ventana anterior se descuenta en proporción al tiempo transcurrido.
+
+Una respuesta en caché cuesta CHATBOT_RATE_LIMIT_CACHE_COST tokens; al fallar la caché se
+cobra además CHATBOT_RATE_LIMIT_INFERENCE_COST, que protege el camino caro (el modelo).
+Un cobro mayor que la cubeta (un lote grande) se acota a su capacidad con `costo_acotado`,
+de modo que siempre puede pasar con la cubeta llena.
+"""
+
+import logging
+import math
+import time
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .exceptions import RateLimitError
+from .service_cache import CACHE_PREFIX
+from .service_metrics import incrementar
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = getattr(settings, 'CHATBOT_RATE_LIMIT_ENABLED', True)
+RATE_LIMIT_PERIOD = getattr(settings, 'CHATBOT_RATE_LIMIT_PERIOD', 60)
+# Tokens por periodo según el tipo de identidad; la IP es más holgada (redes con NAT).
+RATE_LIMIT_CAPACITY = {
+    'user': getattr(settings, 'CHATBOT_RATE_LIMIT_USER_CAPACITY', 60),
+    'session': getattr(settings, 'CHATBOT_RATE_LIMIT_SESSION_CAPACITY', 30),
+    'ip': getattr(settings, 'CHATBOT_RATE_LIMIT_IP_CAPACITY', 300),
+}
+COSTO_CACHE = getattr(settings, 'CHATBOT_RATE_LIMIT_CACHE_COST', 1)
+COSTO_INFERENCIA = getattr(settings, 'CHATBOT_RATE_LIMIT_INFERENCE_COST', 5)
+RATE_LIMIT_PREFIX = f"{CACHE_PREFIX}:ratelimit"
+# La IP de los anónimos se toma de X-Forwarded-For solo detrás de un proxy de confianza.
+RATE_LIMIT_TRUST_FORWARDED = getattr(settings, 'CHATBOT_RATE_LIMIT_TRUST_FORWARDED', False)
+
+
+def identidades(user_id=None, session_id: Optional[str] = None, ip: Optional[str] = None) -> List[str]:
+    """Cubetas que paga una consulta: la del usuario si está autenticado; si no, su IP y su sesión."""
+    if user_id:
+        return [f'user:{user_id}']
+    claves = []
+    if ip:
+        claves.append(f'ip:{ip}')
+    if session_id and session_id != 'anonymous':
+        claves.append(f'session:{session_id}')
+    return claves
+
+
+def capacidad(claves: Sequence[str]) -> Optional[int]:
+    """Capacidad de la menor de las cubetas (None sin cubetas)."""
+    return min((RATE_LIMIT_CAPACITY[clave.split(':', 1)[0]] for clave in claves), default=None)
+
+
+def costo_acotado(claves: Sequence[str], costo: int) -> int:
+    """`costo` limitado a la capacidad de las cubetas: un cobro mayor no pasaría nunca."""
+    tope = capacidad(claves)
+    return costo if tope is None else min(costo, tope)
+
+
+def consumir(claves: Sequence[str], costo: int) -> None:
+    """
+    Descuenta `costo` tokens de cada cubeta. Si alguna no alcanza, devuelve lo ya descontado
+    (las consultas rechazadas no gastan cupo) y lanza RateLimitError con `retry_after`: los
+    segundos hasta que esa cubeta admita el mismo cobro si no se consume más.
+    """
+    if not RATE_LIMIT_ENABLED or not claves or costo <= 0:
+        return
+
+    ahora = time.time()
+    ventana = int(ahora // RATE_LIMIT_PERIOD)
+    transcurrido = ahora - ventana * RATE_LIMIT_PERIOD
+    peso_anterior = 1 - transcurrido / RATE_LIMIT_PERIOD
+    anteriores = cache.get_many([f"{RATE_LIMIT_PREFIX}:{clave}:{ventana - 1}" for clave in claves])
+
+    cobradas = []
+    for clave in claves:
+        cache_key = f"{RATE_LIMIT_PREFIX}:{clave}:{ventana}"
+        consumido = _incrementar(cache_key, costo)
+        cobradas.append(cache_key)
+        tipo = clave.split(':', 1)[0]
+        arrastre = anteriores.get(f"{RATE_LIMIT_PREFIX}:{clave}:{ventana - 1}", 0) * peso_anterior
+        if consumido + arrastre > RATE_LIMIT_CAPACITY[tipo]:
+            for cobrada in cobradas:
+                _incrementar(cobrada, -costo)
+            incrementar('rate_limited', tipo)
+            logger.info(f"Límite de consultas excedido para {clave}")
+            raise RateLimitError(
+                "Límite de consultas excedido",
+                retry_after=_segundos_hasta_cupo(
+                    consumido - costo, anteriores.get(f"{RATE_LIMIT_PREFIX}:{clave}:{ventana - 1}", 0),
+                    costo, RATE_LIMIT_CAPACITY[tipo], transcurrido
+                )
+            )
+
+
+def devolver(claves: Sequence[str], costo: int) -> None:
+    """Reintegra `costo` tokens cobrados en la ventana actual (p. ej. si el cobro siguiente se rechazó)."""
+    if not RATE_LIMIT_ENABLED or not claves or costo <= 0:
+        return
+    ventana = int(time.time() // RATE_LIMIT_PERIOD)
+    for clave in claves:
+        _incrementar(f"{RATE_LIMIT_PREFIX}:{clave}:{ventana}", -costo)
+
+
+def _segundos_hasta_cupo(consumido: int, anterior: int, costo: int, capacidad_cubeta: int, transcurrido: float) -> int:
+    # En esta ventana: basta con que decaiga el arrastre de la anterior
+    libre = capacidad_cubeta - consumido - costo
+    if libre >= 0 and anterior > 0:
+        return max(1, math.ceil(RATE_LIMIT_PERIOD * (1 - libre / anterior) - transcurrido))
+    # En la siguiente: lo consumido ahora pasa a ser el arrastre
+    resto = RATE_LIMIT_PERIOD - transcurrido
+    libre = capacidad_cubeta - costo
+    if libre >= 0 and consumido > 0:
+        return max(1, math.ceil(resto + max(0.0, RATE_LIMIT_PERIOD * (1 - libre / consumido))))
+    return max(1, math.ceil(resto + RATE_LIMIT_PERIOD))
+
+
+def _incrementar(cache_key: str, delta: int) -> int:
+    # La ventana vive dos periodos: durante el siguiente se lee como ventana anterior
+    cache.add(cache_key, 0, RATE_LIMIT_PERIOD * 2)
+    try:
+        return cache.incr(cache_key, delta)
+    except ValueError:
+        # La clave expiró entre `add` e `incr`
+        cache.set(cache_key, max(delta, 0), RATE_LIMIT_PERIOD * 2)
+        return max(delta, 0)
@@ -0,0 +1,123 @@
+"""Servicio de retención y archivado de conversaciones del chatbot."""
+
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import ChatConversation, ChatConversationRollup
+from .service_rollup import consolidar_conversaciones, inicio_de_dia, inicio_de_hora
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = getattr(settings, 'CHATBOT_CONVERSATION_RETENTION_DAYS', 180)
+ARCHIVE_DIR = getattr(settings, 'CHATBOT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive', 'chatbot'))
+HOURLY_ROLLUP_RETENTION_DAYS = getattr(settings, 'CHATBOT_HOURLY_ROLLUP_RETENTION_DAYS', None)
+BATCH_SIZE = 1000
+
+CAMPOS_ARCHIVO = [
+    'id', 'session_id', 'user_id', 'question_text', 'answer_text', 'matched_knowledge_id',
+    'search_method', 'score', 'created_at', 'created_by_id', 'updated_at', 'updated_by_id',
+]
+
+
+def _ruta_particion(directorio: str, created_at: datetime) -> str:
+    """Un archivo por mes: conversations-YYYY-MM.jsonl.gz"""
+    return os.path.join(directorio, f"conversations-{timezone.localtime(created_at):%Y-%m}.jsonl.gz")
+
+
+def _exportar_lote(filas, directorio: str) -> None:
+    """
+    Añade el lote a los archivos de su partición mensual.
+
+    Cada escritura agrega un miembro gzip nuevo al final del archivo, lo que sigue
+    siendo un gzip válido que se lee de corrido con `gzip.open`.
+    """
+    por_particion = {}
+    for fila in filas:
+        por_particion.setdefault(_ruta_particion(directorio, fila['created_at']), []).append(fila)
+
+    for ruta, lote in por_particion.items():
+        with gzip.open(ruta, 'at', encoding='utf-8') as archivo:
+            for fila in lote:
+                archivo.write(json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False))
+                archivo.write('\n')
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+
+def _limite_retencion(dias: int) -> datetime:
+    # Alineado a la hora: ninguna hora queda con conversaciones archivadas y vivas a la vez.
+    return inicio_de_hora(timezone.now() - timedelta(days=dias))
+
+
+def podar_rollups_horarios(dias: Optional[int] = HOURLY_ROLLUP_RETENTION_DAYS,
+                           dias_conversaciones: int = RETENTION_DAYS) -> int:
+    """
+    Elimina agregados horarios antiguos; los diarios se conservan como resumen.
+
+    Nunca poda el día que aún contiene conversaciones vivas, porque su agregado diario
+    se reconstruye a partir de los horarios.
+    """
+    if dias is None:
+        return 0
+    dia_limite = timezone.localtime(_limite_retencion(dias_conversaciones)).date()
+    limite = min(timezone.now() - timedelta(days=dias), inicio_de_dia(dia_limite))
+    eliminados, _ = ChatConversationRollup.objects.filter(
+        granularity=ChatConversationRollup.GRANULARITY_HOUR,
+        bucket_start__lt=limite
+    ).delete()
+    return eliminados
+
+
+def archivar_conversaciones(dias: int = RETENTION_DAYS, directorio: str = ARCHIVE_DIR,
+                            batch_size: int = BATCH_SIZE, pausa: float = 0.0,
+                            consolidar: bool = True, dry_run: bool = False) -> Dict:
+    """
+    Exporta y elimina en lotes pequeños las conversaciones más antiguas que `dias`.
+
+    Cada lote se escribe (y sincroniza a disco) antes de borrarse, y el borrado es una
+    transacción corta por clave primaria para no mantener bloqueos largos sobre la tabla.
+    Si `consolidar` es True, primero se aseguran los agregados del rango a eliminar.
+    """
+    limite = _limite_retencion(dias)
+    pendientes = ChatConversation.objects.filter(created_at__lt=limite)
+    resumen = {'limite': limite, 'archivadas': 0, 'lotes': 0, 'directorio': directorio}
+
+    if dry_run:
+        resumen['archivadas'] = pendientes.count()
+        return resumen
+
+    primera = pendientes.order_by('created_at').values_list('created_at', flat=True).first()
+    if primera is None:
+        return resumen
+
+    if consolidar:
+        consolidar_conversaciones(primera, limite)
+
+    os.makedirs(directorio, exist_ok=True)
+    while True:
+        filas = list(
+            pendientes.order_by('created_at', 'id').values(*CAMPOS_ARCHIVO)[:batch_size]
+        )
+        if not filas:
+            break
+
+        _exportar_lote(filas, directorio)
+        with transaction.atomic():
+            ChatConversation.objects.filter(id__in=[fila['id'] for fila in filas]).delete()
+
+        resumen['archivadas'] += len(filas)
+        resumen['lotes'] += 1
+        logger.info(f"Archivadas {resumen['archivadas']} conversaciones (lote {resumen['lotes']}).")
+        if pausa:
+            time.sleep(pausa)
+
+    return resumen
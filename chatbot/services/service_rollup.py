@@ -0,0 +1,176 @@
+"""Servicio de agregados (rollups) de conversaciones del chatbot."""
+
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from ..models import ChatConversation, ChatConversationRollup
+
+logger = logging.getLogger(__name__)
+
+HOUR = ChatConversationRollup.GRANULARITY_HOUR
+DAY = ChatConversationRollup.GRANULARITY_DAY
+
+# Dimensiones por las que se puede desglosar la analítica: campo de agrupación y campos descriptivos.
+DIMENSIONES = {
+    'category': ['category_id', 'category__name'],
+    'knowledge': ['knowledge_id', 'knowledge__question'],
+    'search_method': ['search_method'],
+    'matched': ['matched'],
+}
+
+_CAMPOS_ROLLUP = ['category_id', 'knowledge_id', 'matched', 'search_method']
+
+
+def inicio_de_hora(momento: datetime) -> datetime:
+    return timezone.localtime(momento).replace(minute=0, second=0, microsecond=0)
+
+
+def inicio_de_dia(fecha: date) -> datetime:
+    return timezone.make_aware(datetime.combine(fecha, time.min))
+
+
+def _agregar_hora(inicio: datetime) -> List[ChatConversationRollup]:
+    """Agrupa las conversaciones de una hora usando el índice de `created_at`."""
+    filas = ChatConversation.objects.filter(
+        created_at__gte=inicio,
+        created_at__lt=inicio + timedelta(hours=1)
+    ).order_by().values(
+        'matched_knowledge_id', 'matched_knowledge__category_id', 'search_method'
+    ).annotate(total=Count('id'), suma_score=Sum('score'))
+
+    return [
+        ChatConversationRollup(
+            granularity=HOUR,
+            bucket_start=inicio,
+            knowledge_id=fila['matched_knowledge_id'],
+            category_id=fila['matched_knowledge__category_id'],
+            matched=fila['matched_knowledge_id'] is not None,
+            search_method=fila['search_method'],
+            conversations=fila['total'],
+            score_sum=fila['suma_score'] or 0,
+        )
+        for fila in filas
+    ]
+
+
+def _consolidar_dia(fecha: date) -> None:
+    """Construye los agregados diarios a partir de los horarios (no vuelve a leer conversaciones)."""
+    inicio = inicio_de_dia(fecha)
+    filas = ChatConversationRollup.objects.filter(
+        granularity=HOUR,
+        bucket_start__gte=inicio,
+        bucket_start__lt=inicio_de_dia(fecha + timedelta(days=1))
+    ).order_by().values(*_CAMPOS_ROLLUP).annotate(total=Sum('conversations'), suma_score=Sum('score_sum'))
+
+    with transaction.atomic():
+        ChatConversationRollup.objects.filter(granularity=DAY, bucket_start=inicio).delete()
+        ChatConversationRollup.objects.bulk_create([
+            ChatConversationRollup(
+                granularity=DAY,
+                bucket_start=inicio,
+                conversations=fila['total'],
+                score_sum=fila['suma_score'] or 0,
+                **{campo: fila[campo] for campo in _CAMPOS_ROLLUP}
+            )
+            for fila in filas
+        ])
+
+
+def consolidar_conversaciones(inicio: datetime, fin: datetime) -> int:
+    """
+    Recalcula los agregados horarios del rango [inicio, fin) y los diarios de los días afectados.
+
+    Es idempotente: cada intervalo se reemplaza completo y los tramos sin conversaciones se
+    resuelven con una sola consulta. Nunca recalcula horas anteriores a la conversación más
+    antigua, para no pisar los agregados de conversaciones ya archivadas.
+    Devuelve los intervalos procesados.
+    """
+    primera = ChatConversation.objects.aggregate(primera=Min('created_at'))['primera']
+    if primera is None:
+        return 0
+    hora = inicio_de_hora(max(inicio, primera))
+    dias = set()
+    horas = 0
+    while hora < fin:
+        siguiente = hora + timedelta(hours=1)
+        agregados = _agregar_hora(hora)
+        if not agregados:
+            # Saltar de una vez el tramo sin conversaciones hasta la próxima hora con actividad
+            proxima = ChatConversation.objects.filter(
+                created_at__gte=siguiente, created_at__lt=fin
+            ).aggregate(proxima=Min('created_at'))['proxima']
+            siguiente = inicio_de_hora(proxima) if proxima else inicio_de_hora(fin) + timedelta(hours=1)
+
+        with transaction.atomic():
+            obsoletos = ChatConversationRollup.objects.filter(
+                granularity=HOUR, bucket_start__gte=hora, bucket_start__lt=siguiente
+            )
+            dias.update(timezone.localtime(b).date() for b in obsoletos.values_list('bucket_start', flat=True))
+            obsoletos.delete()
+            ChatConversationRollup.objects.bulk_create(agregados)
+        if agregados:
+            dias.add(hora.date())
+        horas += 1
+        hora = siguiente
+
+    for fecha in sorted(dias):
+        _consolidar_dia(fecha)
+    return horas
+
+
+def consolidar_pendientes() -> int:
+    """Continúa desde el último intervalo horario registrado (que se recalcula) hasta ahora."""
+    ultimo = ChatConversationRollup.objects.filter(granularity=HOUR).aggregate(ultimo=Max('bucket_start'))['ultimo']
+    if ultimo is None:
+        ultimo = ChatConversation.objects.aggregate(primera=Min('created_at'))['primera']
+        if ultimo is None:
+            return 0
+    return consolidar_conversaciones(ultimo, timezone.now())
+
+
+def _filtrar_rango(granularity: str, desde: date, hasta: date):
+    return ChatConversationRollup.objects.filter(
+        granularity=granularity,
+        bucket_start__gte=inicio_de_dia(desde),
+        bucket_start__lt=inicio_de_dia(hasta + timedelta(days=1))
+    ).order_by()
+
+
+def consultar_serie(granularity: str, desde: date, hasta: date, dimension: Optional[str] = None) -> List[Dict]:
+    """Serie temporal de conversaciones (y opcionalmente su desglose) entre dos fechas inclusive."""
+    campos = ['bucket_start'] + DIMENSIONES.get(dimension, [])
+    filas = _filtrar_rango(granularity, desde, hasta).values(*campos).annotate(
+        conversations=Sum('conversations'),
+        score_sum=Sum('score_sum')
+    ).order_by('bucket_start')
+    return list(filas)
+
+
+def consultar_resumen(desde: date, hasta: date, limite: int = 10) -> Dict:
+    """Totales del rango: conversaciones, tasa sin coincidencia y desgloses principales."""
+    filas = _filtrar_rango(DAY, desde, hasta)
+    totales = filas.aggregate(total=Sum('conversations'), suma_score=Sum('score_sum'))
+    total = totales['total'] or 0
+    con_coincidencia = filas.filter(matched=True).aggregate(total=Sum('conversations'))['total'] or 0
+
+    def _desglose(dimension, top=None, base=filas):
+        consulta = base.values(*DIMENSIONES[dimension]).annotate(
+            conversations=Sum('conversations')
+        ).order_by('-conversations')
+        return list(consulta[:top] if top else consulta)
+
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'total_conversations': total,
+        'matched_conversations': con_coincidencia,
+        'unmatched_rate': round((total - con_coincidencia) / total, 4) if total else 0.0,
+        'average_score': round((totales['suma_score'] or 0) / total, 4) if total else 0.0,
+        'by_category': _desglose('category'),
+        'by_search_method': _desglose('search_method'),
+        'top_knowledge': _desglose('knowledge', top=limite, base=filas.filter(matched=True)),
+    }
@@ -1,33 +1,94 @@
 """Servicio de estadísticas para el chatbot."""
 
 import logging
-from typing import Dict
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Optional, Tuple
 from django.core.cache import cache
-from django.db.models import Count, Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Q, Sum
 from django.utils import timezone
 
-from ..models import ChatbotKnowledgeBase, ChatConversation
+from ..models import ChatbotDailyStats, ChatbotKnowledgeBase, ChatConversation, ChatConversationRollup
+from .service_cache import (
+    STATS_CATALOG_KEY,
+    STATS_TOTAL_CONVERSATIONS_KEY,
+    STATS_TOTAL_VIEWS_KEY,
+    invalidate_stats_cache,
+)
+from .service_metrics import obtener_instantanea
+from .service_rollup import HOUR, inicio_de_hora
 
 logger = logging.getLogger(__name__)
 
+CATALOG_TIMEOUT = 3600
 
-def obtener_estadisticas_chatbot() -> Dict:
-    cache_key = "chatbot:stats"
-    cached_stats = cache.get(cache_key)
-    
-    if cached_stats:
-        return cached_stats
-    
+
+def _rango_del_dia(fecha: date) -> Tuple[datetime, datetime]:
+    """Límites [inicio, fin) del día en la zona horaria local, aptos para usar el índice de created_at."""
+    inicio = timezone.make_aware(datetime.combine(fecha, time.min))
+    return inicio, inicio + timedelta(days=1)
+
+
+def _obtener_contador(cache_key: str, calcular: Callable[[], int]) -> int:
+    """Lee un contador acumulado; si no está en caché lo siembra desde la base de datos."""
+    valor = cache.get(cache_key)
+    if valor is None:
+        valor = calcular()
+        cache.add(cache_key, valor, None)
+    return valor
+
+
+def _incrementar_contador(cache_key: str, delta: int = 1) -> None:
+    """Incremento atómico; si el contador aún no se sembró, la próxima lectura lo calculará."""
+    try:
+        cache.incr(cache_key, delta)
+    except ValueError:
+        pass
+
+
+def registrar_conversacion_en_estadisticas(fecha: date, total: int = 1, matched: int = 0) -> None:
+    """Actualiza la fila diaria y el contador total tras registrar conversaciones."""
     try:
-        stats = {
-            'total_conversations': ChatConversation.objects.count(),
+        actualizadas = ChatbotDailyStats.objects.filter(fecha=fecha).update(
+            total_conversations=F('total_conversations') + total,
+            matched_conversations=F('matched_conversations') + matched
+        )
+        if not actualizadas:
+            try:
+                with transaction.atomic():
+                    ChatbotDailyStats.objects.create(
+                        fecha=fecha, total_conversations=total, matched_conversations=matched
+                    )
+            except IntegrityError:
+                # Otro proceso creó la fila del día entre el UPDATE y el INSERT
+                ChatbotDailyStats.objects.filter(fecha=fecha).update(
+                    total_conversations=F('total_conversations') + total,
+                    matched_conversations=F('matched_conversations') + matched
+                )
+        _incrementar_contador(STATS_TOTAL_CONVERSATIONS_KEY, total)
+    except Exception as e:
+        logger.error(f"Error actualizando estadísticas de conversaciones: {e}")
+
+
+def registrar_vista_en_estadisticas(delta: int = 1) -> None:
+    _incrementar_contador(STATS_TOTAL_VIEWS_KEY, delta)
+
+
+def invalidar_catalogo() -> None:
+    """Invalida las cifras que dependen de la base de conocimiento (entradas activas, categorías)."""
+    cache.delete(STATS_CATALOG_KEY)
+
+
+def invalidar_total_vistas() -> None:
+    """Descarta el contador de vistas: al eliminar una entrada sus vistas dejan de sumar."""
+    cache.delete(STATS_TOTAL_VIEWS_KEY)
+
+
+def _obtener_catalogo() -> Dict:
+    catalogo = cache.get(STATS_CATALOG_KEY)
+    if catalogo is None:
+        catalogo = {
             'total_knowledge_base': ChatbotKnowledgeBase.objects.filter(is_active=True).count(),
-            'total_views': ChatbotKnowledgeBase.objects.aggregate(
-                total=Sum('view_count')
-            )['total'] or 0,
-            'conversations_today': ChatConversation.objects.filter(
-                created_at__date=timezone.now().date()
-            ).count(),
             'top_categories': list(
                 ChatbotKnowledgeBase.objects.filter(is_active=True)
                 .values('category__name')
@@ -35,21 +96,84 @@ def obtener_estadisticas_chatbot() -> Dict:
                 .order_by('-count')[:5]
             )
         }
-        
-        cache.set(cache_key, stats, 900)
-        return stats
+        cache.set(STATS_CATALOG_KEY, catalogo, CATALOG_TIMEOUT)
+    return catalogo
+
+
+def obtener_estadisticas_chatbot() -> Dict:
+    try:
+        hoy = ChatbotDailyStats.objects.filter(fecha=timezone.localdate()).first()
+        catalogo = _obtener_catalogo()
+        return {
+            'total_conversations': _obtener_contador(
+                STATS_TOTAL_CONVERSATIONS_KEY,
+                lambda: ChatbotDailyStats.objects.aggregate(total=Sum('total_conversations'))['total'] or 0
+            ),
+            'total_knowledge_base': catalogo['total_knowledge_base'],
+            'total_views': _obtener_contador(
+                STATS_TOTAL_VIEWS_KEY,
+                lambda: ChatbotKnowledgeBase.objects.aggregate(total=Sum('view_count'))['total'] or 0
+            ),
+            'conversations_today': hoy.total_conversations if hoy else 0,
+            'matched_conversations_today': hoy.matched_conversations if hoy else 0,
+            'top_categories': catalogo['top_categories'],
+        }
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas: {e}")
         return {}
 
 
+def reconstruir_estadisticas_diarias(desde: Optional[date] = None, hasta: Optional[date] = None) -> int:
+    """
+    Recalcula las filas diarias a partir de `ChatConversation` usando rangos de `created_at`.
+
+    Pensado para el backfill inicial o para corregir desvíos; devuelve el número de días procesados.
+    Igual que los agregados, nunca recalcula días anteriores a la conversación más antigua: sus
+    conversaciones ya se archivaron y la fila diaria es lo único que queda de ellas.
+    """
+    primera = ChatConversation.objects.aggregate(primera=Min('created_at'))['primera']
+    if primera is None:
+        return 0
+    primer_dia = timezone.localtime(primera).date()
+    desde = max(desde or primer_dia, primer_dia)
+    hasta = hasta or timezone.localdate()
+
+    dias = 0
+    fecha = desde
+    while fecha <= hasta:
+        inicio, fin = _rango_del_dia(fecha)
+        conversaciones = ChatConversation.objects.filter(created_at__gte=inicio, created_at__lt=fin)
+        total = conversaciones.count()
+        matched = conversaciones.filter(matched_knowledge__isnull=False).count() if total else 0
+        if fecha == primer_dia:
+            # El archivado corta por hora: las horas ya archivadas del día se toman de sus agregados
+            archivadas = ChatConversationRollup.objects.filter(
+                granularity=HOUR, bucket_start__gte=inicio, bucket_start__lt=inicio_de_hora(primera)
+            ).aggregate(total=Sum('conversations'), matched=Sum('conversations', filter=Q(matched=True)))
+            total += archivadas['total'] or 0
+            matched += archivadas['matched'] or 0
+        if total:
+            ChatbotDailyStats.objects.update_or_create(
+                fecha=fecha,
+                defaults={'total_conversations': total, 'matched_conversations': matched}
+            )
+        else:
+            ChatbotDailyStats.objects.filter(fecha=fecha).delete()
+        dias += 1
+        fecha += timedelta(days=1)
+
+    invalidate_stats_cache()
+    return dias
+
+
 def obtener_metricas_rendimiento() -> Dict:
+    """Métricas reales del pipeline medidas en este proceso (ver `service_metrics`)."""
     try:
-        return {
-            'cache_enabled': True,
-            'model_loaded': True,
-            'avg_response_time': 0.5,
-        }
+        metricas = obtener_instantanea()
+        total = metricas['stages'].get('total', {})
+        metricas['cache_enabled'] = True
+        metricas['avg_response_time'] = round(total['avg_ms'] / 1000, 4) if total.get('avg_ms') is not None else None
+        return metricas
     except Exception as e:
         logger.error(f"Error obteniendo métricas: {e}")
-        return {} 
\ No newline at end of file
+        return {}
@@ -0,0 +1,105 @@
+"""Servicio de vectores adicionales por entrada (keywords y resumen de la respuesta)."""
+
+import logging
+import re
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from ..models import ChatbotKnowledgeBase, ChatbotKnowledgeVector
+
+logger = logging.getLogger(__name__)
+
+FUENTES = (ChatbotKnowledgeVector.SOURCE_KEYWORD, ChatbotKnowledgeVector.SOURCE_ANSWER)
+# Fuentes que se indexan además de la pregunta; vacío = solo la pregunta.
+EXTRA_SOURCES = [f for f in getattr(settings, 'CHATBOT_INDEX_EXTRA_SOURCES', []) if f in FUENTES]
+
+LARGO_MINIMO_KEYWORD = 3
+LARGO_MAXIMO_TEXTO = 300
+
+
+def _primera_oracion(texto: str) -> str:
+    oracion = re.split(r'(?<=[.!?])\s+', texto.strip(), maxsplit=1)[0]
+    return oracion[:LARGO_MAXIMO_TEXTO]
+
+
+def textos_adicionales(knowledge: ChatbotKnowledgeBase, fuentes: Iterable[str]) -> List[Tuple[str, str]]:
+    """Pares (fuente, texto) a embeber para una entrada, sin duplicar la pregunta."""
+    vistos = {knowledge.question.strip().lower()}
+    textos = []
+
+    def _agregar(fuente, texto):
+        texto = texto.strip()
+        if len(texto) >= LARGO_MINIMO_KEYWORD and texto.lower() not in vistos:
+            vistos.add(texto.lower())
+            textos.append((fuente, texto[:LARGO_MAXIMO_TEXTO]))
+
+    if ChatbotKnowledgeVector.SOURCE_KEYWORD in fuentes and knowledge.keywords:
+        for frase in knowledge.keywords.split(','):
+            _agregar(ChatbotKnowledgeVector.SOURCE_KEYWORD, frase)
+    if ChatbotKnowledgeVector.SOURCE_ANSWER in fuentes and knowledge.answer:
+        _agregar(ChatbotKnowledgeVector.SOURCE_ANSWER, _primera_oracion(knowledge.answer))
+    return textos
+
+
+def regenerar_vectores(entradas: Iterable[ChatbotKnowledgeBase], encoder,
+                       fuentes: Optional[Iterable[str]] = None, batch_size: int = 500) -> int:
+    """
+    Reemplaza los vectores de las `fuentes` indicadas (por defecto CHATBOT_INDEX_EXTRA_SOURCES)
+    para las entradas dadas, codificando todos los textos en lotes con `encoder`.
+    Devuelve la cantidad de vectores creados.
+    """
+    fuentes = list(EXTRA_SOURCES if fuentes is None else fuentes)
+    entradas = list(entradas)
+    if not fuentes or not entradas or encoder is None:
+        return 0
+
+    pendientes = [(kb, fuente, texto) for kb in entradas for fuente, texto in textos_adicionales(kb, fuentes)]
+    vectores = []
+    for inicio in range(0, len(pendientes), batch_size):
+        lote = pendientes[inicio:inicio + batch_size]
+        embeddings = encoder.encode([texto for _, _, texto in lote])
+        vectores.extend(
+            ChatbotKnowledgeVector(
+                knowledge=kb, source=fuente, text=texto,
+                embedding=np.asarray(embedding, dtype=np.float32).tolist()
+            )
+            for (kb, fuente, texto), embedding in zip(lote, embeddings)
+        )
+
+    with transaction.atomic():
+        ChatbotKnowledgeVector.objects.filter(knowledge__in=entradas, source__in=fuentes).delete()
+        ChatbotKnowledgeVector.objects.bulk_create(vectores, batch_size=batch_size)
+    return len(vectores)
+
+
+def programar_regeneracion(knowledge_id: int) -> None:
+    """
+    Regenera los vectores adicionales de una entrada en un hilo aparte una vez confirmada la
+    transacción: codificar los textos con el modelo no debe demorar la petición que guardó.
+    """
+    if not EXTRA_SOURCES:
+        return
+    transaction.on_commit(
+        # No es daemon: un comando que termina espera a que se escriban los vectores
+        lambda: threading.Thread(target=_regenerar_en_hilo, args=(knowledge_id,)).start()
+    )
+
+
+def _regenerar_en_hilo(knowledge_id: int) -> None:
+    # Imports diferidos: service_ai carga el modelo e importa el índice, que importa este módulo
+    from .service_ai import _model_manager
+    from .service_index import invalidar_indice
+    try:
+        entrada = ChatbotKnowledgeBase.objects.filter(pk=knowledge_id).first()
+        if entrada is not None:
+            regenerar_vectores([entrada], _model_manager.model)
+            invalidar_indice()
+    except Exception as e:
+        logger.error(f"No se pudieron regenerar los vectores de la entrada {knowledge_id}: {e}")
+    finally:
+        # El hilo abrió su propia conexión a la base
+        connection.close()
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import ChatbotKnowledgeBase, ChatbotQuestionAlias, ChatConversation
+
+# Campos cuya modificación no altera el ranking ni las estadísticas del catálogo.
+CAMPOS_SIN_IMPACTO_EN_RANKING = {'question_embedding'}
+
+# Los imports de servicios son diferidos: el paquete de servicios carga el modelo de IA al importarse.
+
+
+@receiver(post_save, sender=ChatbotKnowledgeBase)
+def invalidar_caches_al_guardar(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalida el índice vectorial en cualquier cambio de una entrada. Si cambia su texto,
+    categoría o estado activo, además invalida el ranking de preguntas frecuentes y las
+    estadísticas del catálogo.
+    """
+    from .services.service_index import invalidar_indice
+    invalidar_indice()
+    if update_fields is not None and set(update_fields) <= CAMPOS_SIN_IMPACTO_EN_RANKING:
+        return
+    from .services.service_leaderboard import invalidar_ranking
+    from .services.service_statistics import invalidar_catalogo
+    invalidar_ranking()
+    invalidar_catalogo()
+
+
+@receiver(post_save, sender=ChatbotKnowledgeBase)
+def regenerar_vectores_al_guardar(sender, instance, created, update_fields, **kwargs):
+    """Programa, fuera de la petición, la regeneración de los vectores adicionales de la entrada."""
+    if update_fields is not None and set(update_fields) <= CAMPOS_SIN_IMPACTO_EN_RANKING:
+        return
+    from .services.service_vectors import programar_regeneracion
+    programar_regeneracion(instance.pk)
+
+
+@receiver(post_delete, sender=ChatbotKnowledgeBase)
+def invalidar_ranking_al_eliminar(sender, instance, **kwargs):
+    from .services.service_index import invalidar_indice
+    from .services.service_leaderboard import invalidar_ranking
+    from .services.service_statistics import invalidar_catalogo, invalidar_total_vistas
+    invalidar_indice()
+    invalidar_ranking()
+    invalidar_catalogo()
+    invalidar_total_vistas()
+
+
+@receiver(post_save, sender=ChatbotQuestionAlias)
+@receiver(post_delete, sender=ChatbotQuestionAlias)
+def invalidar_indice_por_alias(sender, instance, **kwargs):
+    """Los alias aprobados forman parte del mapa exacto y del índice vectorial."""
+    from .services.service_index import invalidar_indice
+    invalidar_indice()
+
+
+@receiver(post_save, sender=ChatConversation)
+def actualizar_estadisticas_conversacion(sender, instance, created, **kwargs):
+    """Mantiene los contadores de conversaciones al día en cada inserción."""
+    if not created:
+        return
+    from .services.service_statistics import registrar_conversacion_en_estadisticas
+    registrar_conversacion_en_estadisticas(
+        timezone.localtime(instance.created_at).date(),
+        total=1,
+        matched=1 if instance.matched_knowledge_id else 0
+    )
@@ -2,12 +2,18 @@
 Tests del módulo chatbot.
 """
 
-from django.test import TestCase
+import json
+from django.test import TestCase, tag
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from unittest.mock import patch, Mock
+from io import StringIO
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from .models import ChatbotCategory, ChatbotKnowledgeBase, ChatConversation
 from .serializers import (
@@ -421,4 +427,1072 @@ class ChatbotIntegrationTestCase(TestCase):
         
         # Verificar estadísticas
         stats = obtener_estadisticas_chatbot()
-        self.assertGreaterEqual(stats['total_conversations'], 3) 
\ No newline at end of file
+        self.assertGreaterEqual(stats['total_conversations'], 3)
+
+
+class ChatbotLeaderboardTestCase(TestCase):
+    """Tests para el ranking precalculado de preguntas frecuentes."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='leaderboard_user',
+            email='leaderboard@example.com',
+            password='testpass123'
+        )
+        self.category = ChatbotCategory.objects.create(name='Ranking', created_by=self.user, updated_by=self.user)
+        self.items = [
+            ChatbotKnowledgeBase.objects.create(
+                category=self.category,
+                question=f'¿Pregunta de ranking {i}?',
+                answer='Respuesta de ranking de prueba.',
+                view_count=i * 10,
+                created_by=self.user,
+                updated_by=self.user
+            )
+            for i in range(3)
+        ]
+
+    def test_ranking_ordenado_por_vistas(self):
+        """El ranking devuelve las entradas ordenadas por vistas descendentes."""
+        preguntas = obtener_preguntas_frecuentes(limite=3)
+        self.assertEqual([p['id'] for p in preguntas], [i.id for i in reversed(self.items)])
+        self.assertEqual(preguntas[0]['category'], 'Ranking')
+
+    def test_ranking_se_lee_de_cache(self):
+        """Tras la primera lectura, el ranking no vuelve a consultar la base de datos."""
+        obtener_preguntas_frecuentes(limite=3)
+        with self.assertNumQueries(0):
+            obtener_preguntas_frecuentes(limite=3)
+
+    def test_registrar_vista_actualiza_ranking(self):
+        """Una entrada que supera a la anterior invalida el ranking; si no, no se escribe la caché."""
+        from .services.service_leaderboard import LEADERBOARD_CACHE_KEY, registrar_vistas_en_ranking
+        obtener_preguntas_frecuentes(limite=3)
+        with patch('chatbot.services.service_leaderboard.cache.set') as cache_set:
+            ChatbotKnowledgeBase.objects.filter(pk=self.items[0].pk).update(view_count=5)
+            registrar_vistas_en_ranking([self.items[0].pk])
+        cache_set.assert_not_called()
+        self.assertIsNotNone(cache.get(LEADERBOARD_CACHE_KEY))
+
+        # El conteo se lee de la base, no de la instancia en memoria (atrasada)
+        ChatbotKnowledgeBase.objects.filter(pk=self.items[0].pk).update(view_count=100)
+        registrar_vistas_en_ranking([self.items[0].pk])
+        preguntas = obtener_preguntas_frecuentes(limite=3)
+        self.assertEqual(preguntas[0]['id'], self.items[0].id)
+        self.assertEqual(preguntas[0]['view_count'], 100)
+
+    def test_consulta_con_coincidencia_sigue_al_contador_real(self):
+        """Las vistas registradas por otros procesos cuentan al reordenar el ranking."""
+        obtener_preguntas_frecuentes(limite=3)
+        ChatbotKnowledgeBase.objects.filter(pk=self.items[0].pk).update(view_count=20)
+        procesar_consulta_chatbot(self.items[0].question)
+        preguntas = obtener_preguntas_frecuentes(limite=3)
+        self.assertEqual(preguntas[0]['id'], self.items[0].id)
+        self.assertEqual(preguntas[0]['view_count'], 21)
+
+    def test_editar_entrada_invalida_ranking(self):
+        """Desactivar una entrada la saca del ranking."""
+        obtener_preguntas_frecuentes(limite=3)
+        self.items[2].is_active = False
+        self.items[2].save()
+        ids = [p['id'] for p in obtener_preguntas_frecuentes(limite=3)]
+        self.assertNotIn(self.items[2].id, ids)
+
+
+class ChatbotStatisticsTestCase(TestCase):
+    """Tests para las estadísticas incrementales del chatbot."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='stats_user',
+            email='stats@example.com',
+            password='testpass123'
+        )
+        self.knowledge = ChatbotKnowledgeBase.objects.create(
+            question='¿Pregunta de estadísticas?',
+            answer='Respuesta de estadísticas de prueba.',
+            created_by=self.user,
+            updated_by=self.user
+        )
+
+    def _crear_conversacion(self, matched=False):
+        return ChatConversation.objects.create(
+            user=self.user,
+            question_text='¿Pregunta?',
+            answer_text='Respuesta.',
+            matched_knowledge=self.knowledge if matched else None
+        )
+
+    def test_conversacion_actualiza_fila_diaria(self):
+        """Cada conversación incrementa la fila del día sin recorrer la tabla."""
+        from .models import ChatbotDailyStats
+        self._crear_conversacion(matched=True)
+        self._crear_conversacion()
+        fila = ChatbotDailyStats.objects.get()
+        self.assertEqual(fila.total_conversations, 2)
+        self.assertEqual(fila.matched_conversations, 1)
+
+    def test_estadisticas_leen_contadores(self):
+        """Las estadísticas reflejan escrituras posteriores sin invalidar la caché."""
+        stats = obtener_estadisticas_chatbot()
+        self.assertEqual(stats['total_conversations'], 0)
+        self._crear_conversacion(matched=True)
+        stats = obtener_estadisticas_chatbot()
+        self.assertEqual(stats['total_conversations'], 1)
+        self.assertEqual(stats['conversations_today'], 1)
+        self.assertEqual(stats['matched_conversations_today'], 1)
+        with self.assertNumQueries(1):
+            obtener_estadisticas_chatbot()
+
+    def test_eliminar_entrada_descuenta_sus_vistas(self):
+        """Borrar una entrada invalida el contador de vistas sembrado en caché."""
+        otra = ChatbotKnowledgeBase.objects.create(question='¿Otra?', answer='Otra respuesta.')
+        ChatbotKnowledgeBase.objects.filter(pk=otra.pk).update(view_count=7)
+        self.assertEqual(obtener_estadisticas_chatbot()['total_views'], 7)
+        otra.delete()
+        self.assertEqual(obtener_estadisticas_chatbot()['total_views'], 0)
+
+    def test_reconstruir_estadisticas_diarias(self):
+        """El recálculo reproduce los contadores a partir del historial."""
+        from .models import ChatbotDailyStats
+        from .services.service_statistics import reconstruir_estadisticas_diarias
+        self._crear_conversacion(matched=True)
+        ChatbotDailyStats.objects.all().delete()
+        reconstruir_estadisticas_diarias()
+        fila = ChatbotDailyStats.objects.get()
+        self.assertEqual(fila.total_conversations, 1)
+        self.assertEqual(fila.matched_conversations, 1)
+
+
+class ChatbotRollupTestCase(APITestCase):
+    """Tests para los agregados de conversaciones y sus endpoints de analítica."""
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        cache.clear()
+        self.user = User.objects.create_user(username='rollup_admin', password='testpass123')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.category = ChatbotCategory.objects.create(name='Analítica', created_by=self.user, updated_by=self.user)
+        self.knowledge = ChatbotKnowledgeBase.objects.create(
+            category=self.category,
+            question='¿Pregunta de analítica?',
+            answer='Respuesta de analítica de prueba.',
+            created_by=self.user,
+            updated_by=self.user
+        )
+        for _ in range(3):
+            ChatConversation.objects.create(
+                user=self.user, question_text='¿Pregunta?', answer_text='Respuesta.',
+                matched_knowledge=self.knowledge, search_method='ai_embeddings', score=0.8
+            )
+        ChatConversation.objects.create(
+            user=self.user, question_text='¿Otra?', answer_text='Lo siento.', search_method='none', score=0.1
+        )
+
+    def test_consolidar_agrega_por_dimensiones(self):
+        """Los agregados horarios y diarios agrupan por entrada, coincidencia y método."""
+        from .models import ChatConversationRollup
+        from .services.service_rollup import consolidar_pendientes
+        consolidar_pendientes()
+        diarios = ChatConversationRollup.objects.filter(granularity='day')
+        coincidentes = diarios.get(matched=True)
+        self.assertEqual(coincidentes.conversations, 3)
+        self.assertEqual(coincidentes.knowledge_id, self.knowledge.id)
+        self.assertEqual(coincidentes.category_id, self.category.id)
+        self.assertEqual(diarios.get(matched=False).search_method, 'none')
+
+        # Repetir la consolidación no duplica filas
+        consolidar_pendientes()
+        self.assertEqual(ChatConversationRollup.objects.filter(granularity='day').count(), 2)
+
+    def test_endpoint_resumen(self):
+        """El resumen calcula la tasa sin coincidencia a partir de los agregados."""
+        from .services.service_rollup import consolidar_pendientes
+        consolidar_pendientes()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/chatbot/analytics/summary/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()['data']
+        self.assertEqual(data['total_conversations'], 4)
+        self.assertEqual(data['unmatched_rate'], 0.25)
+        self.assertEqual(data['top_knowledge'][0]['knowledge_id'], self.knowledge.id)
+
+    def test_endpoint_serie_valida_parametros(self):
+        """La serie temporal rechaza agrupaciones desconocidas."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/chatbot/analytics/timeseries/', {'group_by': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/chatbot/analytics/timeseries/', {'granularity': 'hour', 'group_by': 'category'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_endpoints_de_analitica_para_admin_y_qa(self):
+        """Como las estadísticas del chatbot, la analítica es para Admin y QA."""
+        from django.contrib.auth.models import Group
+        qa = User.objects.create_user(username='rollup_qa', password='testpass123')
+        qa.groups.add(Group.objects.get_or_create(name='QA')[0])
+        trabajador = User.objects.create_user(username='rollup_trabajador', password='testpass123')
+        for usuario, esperado in ((qa, status.HTTP_200_OK), (trabajador, status.HTTP_403_FORBIDDEN)):
+            self.client.force_authenticate(user=usuario)
+            for url in ('/api/chatbot/analytics/summary/', '/api/chatbot/analytics/timeseries/'):
+                self.assertEqual(self.client.get(url).status_code, esperado)
+
+
+class ChatbotRetentionTestCase(TestCase):
+    """Tests para el archivado y poda de conversaciones antiguas."""
+
+    def setUp(self):
+        import tempfile
+        from datetime import timedelta
+        from django.utils import timezone
+        self.directorio = tempfile.mkdtemp()
+        self.user = User.objects.create_user(username='retention_user', password='testpass123')
+        antiguas = [
+            ChatConversation.objects.create(user=self.user, question_text=f'¿Antigua {i}?', answer_text='Respuesta.')
+            for i in range(5)
+        ]
+        ChatConversation.objects.filter(id__in=[c.id for c in antiguas]).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+        self.reciente = ChatConversation.objects.create(user=self.user, question_text='¿Reciente?', answer_text='Respuesta.')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_reconstruir_estadisticas_no_borra_dias_archivados(self):
+        """Recalcular las filas diarias después de archivar conserva las de los días archivados."""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import ChatbotDailyStats
+        from .services.service_retention import archivar_conversaciones
+        from .services.service_statistics import reconstruir_estadisticas_diarias
+
+        reconstruir_estadisticas_diarias()
+        antes = dict(ChatbotDailyStats.objects.values_list('fecha', 'total_conversations'))
+        archivar_conversaciones(dias=180, directorio=self.directorio)
+
+        reconstruir_estadisticas_diarias(desde=timezone.localdate() - timedelta(days=500))
+        self.assertEqual(dict(ChatbotDailyStats.objects.values_list('fecha', 'total_conversations')), antes)
+        self.assertIn(5, antes.values())
+
+    def test_archivar_exporta_y_elimina_por_lotes(self):
+        """Las conversaciones antiguas se exportan a JSONL comprimido y se eliminan en lotes."""
+        import glob
+        import gzip
+        import json
+        from .models import ChatConversationRollup
+        from .services.service_retention import archivar_conversaciones
+
+        resumen = archivar_conversaciones(dias=180, directorio=self.directorio, batch_size=2)
+
+        self.assertEqual(resumen['archivadas'], 5)
+        self.assertEqual(resumen['lotes'], 3)
+        self.assertEqual(list(ChatConversation.objects.values_list('id', flat=True)), [self.reciente.id])
+
+        archivos = glob.glob(f'{self.directorio}/conversations-*.jsonl.gz')
+        self.assertEqual(len(archivos), 1)
+        with gzip.open(archivos[0], 'rt', encoding='utf-8') as archivo:
+            filas = [json.loads(linea) for linea in archivo]
+        self.assertEqual(len(filas), 5)
+        self.assertTrue(all(fila['question_text'].startswith('¿Antigua') for fila in filas))
+
+        # El resumen de lo archivado queda en los agregados diarios
+        total = sum(ChatConversationRollup.objects.filter(granularity='day').values_list('conversations', flat=True))
+        self.assertEqual(total, 5)
+
+    def test_dry_run_no_elimina(self):
+        from .services.service_retention import archivar_conversaciones
+        resumen = archivar_conversaciones(dias=180, directorio=self.directorio, dry_run=True)
+        self.assertEqual(resumen['archivadas'], 5)
+        self.assertEqual(ChatConversation.objects.count(), 6)
+
+
+class ChatbotMetricsTestCase(APITestCase):
+    """Tests para la instrumentación del pipeline del chatbot."""
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        from .services.service_metrics import reiniciar_metricas
+        cache.clear()
+        reiniciar_metricas()
+        self.admin = User.objects.create_user(username='metrics_admin', password='testpass123')
+        self.admin.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?',
+            answer='Atendemos de lunes a viernes de 8 a 17 horas.',
+            keywords='horario, atención',
+            created_by=self.admin,
+            updated_by=self.admin
+        )
+
+    def test_consultas_registran_etapas_y_cache(self):
+        """Cada consulta registra su tiempo total, las etapas recorridas y los aciertos de caché."""
+        from .services.service_metrics import obtener_instantanea
+        procesar_consulta_chatbot('horario de atención')
+        procesar_consulta_chatbot('horario de atención')
+
+        metricas = obtener_instantanea()
+        self.assertEqual(metricas['queries'], 2)
+        self.assertEqual(metricas['stages']['total']['count'], 2)
+        self.assertEqual(metricas['stages']['cache_lookup']['count'], 2)
+        self.assertEqual(metricas['cache_hit_rate'], 0.5)
+        self.assertIn('search_keywords', metricas['stages'])
+        self.assertIsNotNone(metricas['stages']['total']['p99_ms'])
+
+    def test_endpoint_prometheus_solo_admin(self):
+        """El formato Prometheus exige rol Admin y expone histogramas por etapa."""
+        procesar_consulta_chatbot('¿Cuál es el horario de atención?')
+        response = self.client.get('/api/chatbot/metrics/')
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/chatbot/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        texto = response.content.decode()
+        self.assertIn('chatbot_stage_duration_seconds_bucket', texto)
+        self.assertIn('stage="total"', texto)
+
+        response = self.client.get('/api/chatbot-knowledge/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['data']['queries'], 1)
+
+    def test_prometheus_exporta_consultas_limitadas(self):
+        """Los rechazos del limitador se exportan por tipo de identidad."""
+        import os
+        from .services.service_metrics import exportar_prometheus, incrementar, obtener_instantanea
+        incrementar('rate_limited', 'ip')
+        incrementar('rate_limited', 'ip')
+        self.assertIn(f'chatbot_rate_limited_total{{pid="{os.getpid()}",identity="ip"}} 2', exportar_prometheus())
+        self.assertEqual(obtener_instantanea()['rate_limited'], {'ip': 2})
+
+    def test_endpoint_metricas_json_solo_admin(self):
+        """Las métricas en JSON exigen el mismo rol Admin que el formato Prometheus."""
+        lector = User.objects.create_user(username='metrics_lector', password='testpass123')
+        self.client.force_authenticate(user=lector)
+        response = self.client.get('/api/chatbot-knowledge/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+
+@tag('benchmark')
+class ChatbotBenchmarkTestCase(TestCase):
+    """Tests del arnés de benchmark (excluir con --exclude-tag benchmark)."""
+
+    def setUp(self):
+        cache.clear()
+        self.real = ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?',
+            answer='Atendemos de lunes a viernes de 8 a 17 horas.',
+            keywords='horario, atención'
+        )
+
+    def test_benchmark_con_encoder_simulado(self):
+        """Repite las consultas, reporta percentiles y SQL por etapa, y revierte la base sintética."""
+        from .services.service_benchmark import EncoderSimulado, ejecutar_benchmark
+        informe = ejecutar_benchmark(60, por_tipo=4, encoder=EncoderSimulado(64), permitir_produccion=True)
+
+        self.assertEqual(informe['queries'], 16)
+        self.assertEqual(informe['encoder'], 'stub')
+        self.assertEqual(informe['by_type']['exact']['accuracy'], 1.0)
+        self.assertIsNotNone(informe['latency']['p99_ms'])
+        self.assertGreater(informe['stages']['search_embeddings']['sql_queries'], 0)
+        # Las consultas exactas se resuelven en el nivel 0 sin codificar
+        self.assertEqual(informe['by_type']['exact']['search_methods'], {'exact': 4})
+        self.assertEqual(informe['stages']['encode']['count'], 12)
+
+        # Nada de la corrida queda en la base
+        self.assertEqual(ChatbotKnowledgeBase.objects.count(), 1)
+        self.real.refresh_from_db()
+        self.assertTrue(self.real.is_active)
+
+    def test_benchmark_no_bloquea_entradas_reales_sin_permiso(self):
+        from .services.service_benchmark import EncoderSimulado, ejecutar_benchmark
+        with self.assertRaises(RuntimeError):
+            ejecutar_benchmark(20, por_tipo=2, encoder=EncoderSimulado(64))
+
+        # Sin aislar no se tocan las entradas reales
+        informe = ejecutar_benchmark(20, por_tipo=2, encoder=EncoderSimulado(64), aislar=False)
+        self.assertEqual(informe['queries'], 8)
+
+    def test_benchmark_no_publica_version_del_indice(self):
+        """La corrida busca sobre un índice local: no publica nada para los demás procesos."""
+        import shutil
+        import tempfile
+        from .services import service_index
+        from .services.service_benchmark import EncoderSimulado, ejecutar_benchmark
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        indice = service_index.obtener_indice()
+
+        with patch.object(service_index, 'INDEX_DIR', directorio), self.captureOnCommitCallbacks() as publicaciones:
+            ejecutar_benchmark(20, por_tipo=2, encoder=EncoderSimulado(64), permitir_produccion=True)
+
+        self.assertEqual(publicaciones, [])
+        self.assertIsNone(service_index.version_en_disco(directorio))
+        self.assertIs(service_index.obtener_indice(), indice)
+
+    def test_errores_de_tipeo_son_deterministas(self):
+        from .services.service_benchmark import EncoderSimulado, generar_consultas
+        entradas = [{'id': 1, 'question': '¿Cómo puedo pedir mis vacaciones?', 'paraphrase': 'quisiera pedir vacaciones'}]
+        primeras = generar_consultas(entradas, 3, seed=7, tipos=['typo'])
+        self.assertEqual(primeras, generar_consultas(entradas, 3, seed=7, tipos=['typo']))
+        self.assertTrue(all(c['texto'] != entradas[0]['question'] for c in primeras))
+
+        encoder = EncoderSimulado(64)
+        vectores = encoder.encode([entradas[0]['question'], primeras[0]['texto']])
+        self.assertGreater(float(vectores[0] @ vectores[1]), 0.5)
+
+
+class ChatbotEvaluationTestCase(TestCase):
+    """Tests de la evaluación offline de recuperación."""
+
+    def setUp(self):
+        import json
+        import tempfile
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.horario = ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?',
+            answer='Atendemos de lunes a viernes de 8 a 17 horas.',
+            keywords='horario, atención'
+        )
+        self.soporte = ChatbotKnowledgeBase.objects.create(
+            question='¿Cómo puedo contactar a soporte?',
+            answer='Escribe a soporte@aquanq.com.',
+            keywords='soporte, ayuda'
+        )
+        for kb in (self.horario, self.soporte):
+            ChatbotKnowledgeBase.objects.filter(pk=kb.pk).update(
+                question_embedding=self.encoder.encode([kb.question])[0].tolist()
+            )
+
+        self.directorio = tempfile.mkdtemp()
+        self.archivo = f"{self.directorio}/casos.json"
+        with open(self.archivo, 'w', encoding='utf-8') as f:
+            json.dump([
+                {'question': '¿Cuál es el horario de atención?', 'paraphrases': ['cual es el horario de atencion'], 'include_question': True},
+                {'question': '¿Pregunta inexistente?', 'paraphrases': ['algo']},
+                {'query': '¿Cómo puedo contactar a soporte técnico?', 'knowledge_id': self.soporte.id},
+                {'query': 'receta de ceviche', 'knowledge_id': None},
+            ], f)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_cargar_casos_resuelve_preguntas(self):
+        from .services.service_evaluation import cargar_casos
+        casos, omitidas = cargar_casos(self.archivo)
+        self.assertEqual(len(casos), 4)
+        self.assertEqual(casos[0], {'query': '¿Cuál es el horario de atención?', 'knowledge_id': self.horario.id})
+        self.assertEqual(omitidas, ['¿Pregunta inexistente?'])
+
+    def test_evaluar_compara_configuraciones_sin_efectos(self):
+        from .services.service_benchmark import usar_encoder
+        from .services.service_evaluation import cargar_casos, evaluar
+        casos, _ = cargar_casos(self.archivo)
+        with usar_encoder(self.encoder):
+            resultados = evaluar(casos, ['pipeline', 'embeddings'], permitir_produccion=True)
+
+        embeddings = resultados['embeddings']
+        self.assertEqual(embeddings['in_domain'], 3)
+        self.assertEqual(embeddings['out_of_domain'], 1)
+        self.assertEqual(embeddings['accuracy@1'], 1.0)
+        self.assertEqual(embeddings['mrr'], 1.0)
+        self.assertIsNotNone(resultados['pipeline']['p99_ms'])
+
+        # Los contadores de vistas que incrementa el pipeline se revierten
+        self.horario.refresh_from_db()
+        self.assertEqual(self.horario.view_count, 0)
+
+    def test_configuracion_desconocida(self):
+        from .services.service_evaluation import evaluar
+        with self.assertRaises(ValueError):
+            evaluar([], ['hnsw-inexistente'])
+
+    def test_pipeline_no_bloquea_entradas_reales_sin_permiso(self):
+        from .services import service_index
+        from .services.service_benchmark import usar_encoder
+        from .services.service_evaluation import cargar_casos, evaluar
+        casos, _ = cargar_casos(self.archivo)
+        with self.assertRaises(RuntimeError):
+            evaluar(casos, ['pipeline'])
+
+        # Las demás configuraciones solo leen, y la evaluación no publica ni invalida el índice
+        indice = service_index.obtener_indice()
+        with usar_encoder(self.encoder), self.captureOnCommitCallbacks() as publicaciones:
+            evaluar(casos, ['embeddings'])
+        self.assertEqual(publicaciones, [])
+        self.assertIs(service_index.obtener_indice(), indice)
+
+
+class ChatbotIndexTestCase(TestCase):
+    """Tests del índice vectorial (backends exacto e IVF)."""
+
+    def setUp(self):
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.entradas = []
+        for pregunta in ['¿Cuál es el horario de atención?', '¿Cómo puedo contactar a soporte?', '¿Dónde están ubicados?']:
+            kb = ChatbotKnowledgeBase.objects.create(question=pregunta, answer='Respuesta.')
+            ChatbotKnowledgeBase.objects.filter(pk=kb.pk).update(
+                question_embedding=self.encoder.encode([pregunta])[0].tolist()
+            )
+            self.entradas.append(kb)
+
+    def test_ivf_recupera_lo_mismo_que_el_exacto(self):
+        import numpy as np
+        from .services.service_index import IndiceExacto, IndiceIVF, normalizar
+        rng = np.random.default_rng(0)
+        centros = rng.normal(size=(20, 32))
+        matriz = normalizar(centros[rng.integers(20, size=2000)] + rng.normal(scale=0.3, size=(2000, 32)))
+        ids = np.arange(2000, dtype=np.int64)
+        exacto = IndiceExacto(ids, matriz)
+        ivf = IndiceIVF.construir(ids, matriz, nlist=20, nprobe=3)
+
+        self.assertEqual(sorted(ivf.ids.tolist()), ids.tolist())
+        consultas = normalizar(matriz[:100] + rng.normal(scale=0.05, size=(100, 32)))
+        coincidencias = sum(ivf.buscar(q, 1)[0][0] == exacto.buscar(q, 1)[0][0] for q in consultas)
+        self.assertGreaterEqual(coincidencias, 95)
+
+    def test_indice_persistido_se_carga_con_mmap(self):
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+        from .services.service_index import cargar_indice, construir_indice, persistir_indice, version_en_disco
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+
+        indice = construir_indice('exact')
+        versiones = [persistir_indice(indice, directorio, version=f'v{i}') for i in range(3)]
+        self.assertEqual(version_en_disco(directorio), 'v2')
+        # Solo se conservan las últimas versiones
+        self.assertEqual(sorted(os.listdir(directorio)), ['CURRENT', 'v1', 'v2'])
+
+        cargado, meta = cargar_indice(directorio)
+        self.assertEqual(meta['version'], versiones[-1])
+        self.assertIsInstance(cargado.matriz, np.memmap)
+        vector = self.encoder.encode('¿Cuál es el horario de atención?')
+        self.assertEqual(cargado.buscar(vector, 2), indice.buscar(vector, 2))
+        self.assertIsNone(cargar_indice(directorio, version='v1'))
+
+    def test_generate_embeddings_publica_el_indice(self):
+        import shutil
+        import tempfile
+        from django.core.management import call_command
+        from .services.service_benchmark import usar_encoder
+        from .services.service_index import cargar_indice
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        ChatbotKnowledgeBase.objects.update(question_embedding=None)
+
+        with usar_encoder(self.encoder):
+            call_command('generate_embeddings', index_dir=directorio, stdout=StringIO())
+
+        self.assertFalse(ChatbotKnowledgeBase.objects.filter(question_embedding__isnull=True).exists())
+        self.assertEqual(len(cargar_indice(directorio)[0]), 3)
+
+    def test_busqueda_usa_el_indice_y_se_invalida(self):
+        from .services.service_ai import buscar_candidatos_embeddings
+        from .services.service_benchmark import usar_encoder
+        with usar_encoder(self.encoder):
+            candidatos = buscar_candidatos_embeddings('¿Cuál es el horario de atención?', k=2)
+            self.assertEqual(candidatos[0][0], self.entradas[0])
+            self.assertAlmostEqual(candidatos[0][1], 1.0, places=4)
+
+            # Desactivar la entrada renueva la versión y el proceso reconstruye su índice
+            self.entradas[0].is_active = False
+            self.entradas[0].save()
+            candidatos = buscar_candidatos_embeddings('¿Cuál es el horario de atención?', k=2)
+            self.assertNotIn(self.entradas[0], [item for item, _ in candidatos])
+
+    def _directorio_del_indice(self):
+        import shutil
+        import tempfile
+        from .services import service_index
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        parche = patch.object(service_index, 'INDEX_DIR', directorio)
+        parche.start()
+        self.addCleanup(parche.stop)
+        service_index.invalidar_indice()
+        return directorio
+
+    def test_version_en_disco_se_relee_al_vencer_el_ttl(self):
+        import time
+        import numpy as np
+        from .services import service_index
+        directorio = self._directorio_del_indice()
+        indice = service_index.obtener_indice()
+        with patch.object(service_index, 'version_en_disco', wraps=service_index.version_en_disco) as lecturas:
+            for _ in range(5):
+                self.assertIs(service_index.obtener_indice(), indice)
+        self.assertEqual(lecturas.call_count, 0)
+
+        # Una versión publicada por otro proceso (otro worker, generate_embeddings) se carga con
+        # mmap al vencer el TTL
+        version = service_index.persistir_indice(service_index.construir_indice(), directorio)
+        self.assertIs(service_index.obtener_indice(), indice)
+        vencido = time.monotonic() + service_index.INDEX_VERSION_TTL + 1
+        with patch('chatbot.services.service_index.time.monotonic', return_value=vencido):
+            cargado = service_index.obtener_indice()
+        self.assertIsInstance(cargado.matriz, np.memmap)
+        self.assertEqual(service_index.version_del_indice(), version)
+
+    def test_cambios_de_la_base_se_publican_en_disco_agrupados(self):
+        from .services import service_index
+        directorio = self._directorio_del_indice()
+        with patch('chatbot.services.service_index.threading.Timer') as temporizador, \
+                self.captureOnCommitCallbacks(execute=True):
+            for entrada in self.entradas[:2]:
+                entrada.is_active = False
+                entrada.save()
+        # Dos cambios, una sola publicación programada
+        temporizador.assert_called_once()
+        self.assertIsNone(service_index.version_en_disco(directorio))
+
+        service_index._publicador.publicar()
+        cargado, _ = service_index.cargar_indice(directorio)
+        self.assertEqual(cargado.ids.tolist(), [self.entradas[2].id])
+
+
+class ChatbotMultiVectorTestCase(TestCase):
+    """Tests de los vectores adicionales por entrada (keywords y resumen de la respuesta)."""
+
+    def setUp(self):
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.kb = ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?',
+            answer='Atendemos de lunes a viernes de 8 a 17 horas. Los feriados no hay atención.',
+            keywords='horario, cuándo abren, x'
+        )
+        self.otra = ChatbotKnowledgeBase.objects.create(question='¿Dónde están ubicados?', answer='En Arequipa.')
+        for kb in (self.kb, self.otra):
+            ChatbotKnowledgeBase.objects.filter(pk=kb.pk).update(
+                question_embedding=self.encoder.encode([kb.question])[0].tolist()
+            )
+
+    def test_textos_adicionales(self):
+        from .services.service_vectors import FUENTES, textos_adicionales
+        self.assertEqual(textos_adicionales(self.kb, FUENTES), [
+            ('keyword', 'horario'),
+            ('keyword', 'cuándo abren'),
+            ('answer', 'Atendemos de lunes a viernes de 8 a 17 horas.'),
+        ])
+
+    def test_indice_multivector_agrupa_por_entrada(self):
+        from .services.service_index import construir_indice
+        from .services.service_vectors import FUENTES, regenerar_vectores
+        self.assertEqual(regenerar_vectores([self.kb], self.encoder, fuentes=FUENTES), 3)
+        # Regenerar reemplaza, no duplica
+        self.assertEqual(regenerar_vectores([self.kb], self.encoder, fuentes=FUENTES), 3)
+
+        indice = construir_indice('exact', fuentes=FUENTES)
+        self.assertEqual(len(indice), 5)
+        self.assertTrue(indice.multivector)
+
+        resultados = indice.buscar(self.encoder.encode('cuándo abren'), 5)
+        self.assertEqual([knowledge_id for knowledge_id, _ in resultados], [self.kb.id, self.otra.id])
+        self.assertAlmostEqual(resultados[0][1], 1.0, places=4)
+        # Sin vectores adicionales la frase de keywords no se parece tanto a la pregunta
+        sin_extras = construir_indice('exact', fuentes=[]).buscar(self.encoder.encode('cuándo abren'), 1)
+        self.assertLess(sin_extras[0][1], resultados[0][1])
+
+
+    def test_guardar_entrada_regenera_vectores_fuera_de_la_peticion(self):
+        from .models import ChatbotKnowledgeVector
+        from .services import service_vectors
+        with patch.object(service_vectors, 'EXTRA_SOURCES', list(service_vectors.FUENTES)), \
+                patch('chatbot.services.service_index._publicador'), \
+                patch('chatbot.services.service_vectors.threading.Thread') as hilo:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.kb.keywords = 'horario, cuándo abren'
+                self.kb.save()
+                # Antes del commit ni siquiera se programó el hilo
+                hilo.assert_not_called()
+            self.assertFalse(ChatbotKnowledgeVector.objects.exists())
+            hilo.assert_called_once_with(target=service_vectors._regenerar_en_hilo, args=(self.kb.pk,))
+            hilo.return_value.start.assert_called_once_with()
+
+            with patch('chatbot.services.service_ai._model_manager') as manager, \
+                    patch('chatbot.services.service_vectors.connection') as conexion:
+                manager.model = self.encoder
+                service_vectors._regenerar_en_hilo(self.kb.pk)
+            conexion.close.assert_called_once_with()
+        self.assertEqual(ChatbotKnowledgeVector.objects.filter(knowledge=self.kb).count(), 3)
+
+
+class ChatbotAliasTestCase(TestCase):
+    """Tests de los alias aprendidos y la búsqueda exacta."""
+
+    def setUp(self):
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.kb = ChatbotKnowledgeBase.objects.create(question='¿Cuál es el horario de atención?', answer='De 8 a 17.')
+        self.otra = ChatbotKnowledgeBase.objects.create(question='¿Dónde están ubicados?', answer='En Arequipa.')
+        for kb in (self.kb, self.otra):
+            ChatbotKnowledgeBase.objects.filter(pk=kb.pk).update(
+                question_embedding=self.encoder.encode([kb.question])[0].tolist()
+            )
+
+    def _conversaciones(self, texto, knowledge, veces, score=0.9):
+        ChatConversation.objects.bulk_create([
+            ChatConversation(question_text=texto, answer_text='-', matched_knowledge=knowledge,
+                             search_method='ai_embeddings', score=score)
+            for _ in range(veces)
+        ])
+
+    def test_minar_y_aprobar_alias(self):
+        from .models import ChatbotQuestionAlias
+        from .services.service_alias import aprobar_alias, buscar_coincidencia_exacta, minar_alias
+        self._conversaciones('a qué hora abren', self.kb, 3)
+        self._conversaciones('a que hora abren?', self.kb, 1)
+        self._conversaciones('poco frecuente', self.kb, 2)
+        self._conversaciones('puntaje bajo', self.kb, 5, score=0.5)
+        self._conversaciones('ambigua', self.kb, 3)
+        self._conversaciones('ambigua', self.otra, 3)
+
+        self.assertEqual(minar_alias(), {'propuestos': 1, 'actualizados': 0, 'ambiguos': 1})
+        alias = ChatbotQuestionAlias.objects.get()
+        self.assertEqual((alias.normalized_alias, alias.occurrences, alias.status), ('a que hora abren', 4, 'pending'))
+        # Los pendientes no se resuelven
+        self.assertIsNone(buscar_coincidencia_exacta('¿A qué hora abren?'))
+
+        aprobar_alias([alias], encoder=self.encoder)
+        self.assertEqual(buscar_coincidencia_exacta('¿A qué hora abren?'), self.kb.id)
+        self.assertEqual(buscar_coincidencia_exacta('cual es el HORARIO de atencion'), self.kb.id)
+
+        respuesta = procesar_consulta_chatbot('A qué hora abren', use_cache=False)
+        self.assertEqual((respuesta['knowledge_id'], respuesta['search_method']), (self.kb.id, 'exact'))
+
+        # Volver a minar respeta la decisión y solo actualiza conteos
+        self.assertEqual(minar_alias(), {'propuestos': 0, 'actualizados': 1, 'ambiguos': 1})
+        self.assertEqual(ChatbotQuestionAlias.objects.get().status, 'approved')
+
+    def test_alias_aprobados_entran_al_indice(self):
+        from .models import ChatbotQuestionAlias
+        from .services.service_alias import aprobar_alias
+        from .services.service_index import construir_indice
+        alias = ChatbotQuestionAlias.objects.create(knowledge=self.kb, alias='a qué hora abren', normalized_alias='a que hora abren')
+        self.assertEqual(len(construir_indice('exact', fuentes=[])), 2)
+        aprobar_alias([alias], encoder=self.encoder)
+        indice = construir_indice('exact', fuentes=[])
+        self.assertEqual(len(indice), 3)
+        resultados = indice.buscar(self.encoder.encode('a qué hora abren'), 2)
+        self.assertEqual(resultados[0][0], self.kb.id)
+        self.assertAlmostEqual(resultados[0][1], 1.0, places=4)
+
+    def test_comando_mine_question_aliases(self):
+        from django.core.management import call_command
+        self._conversaciones('a qué hora abren', self.kb, 2)
+        salida = StringIO()
+        call_command('mine_question_aliases', '--min-occurrences', '2', stdout=salida)
+        self.assertIn('1 alias propuestos', salida.getvalue())
+
+
+class ChatbotAsyncQueryTestCase(TestCase):
+    """Tests del endpoint asíncrono de consultas."""
+
+    def setUp(self):
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.user = User.objects.create_user(username='async_user', password='testpass123')
+        self.kb = ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?',
+            answer='Atendemos de lunes a viernes de 8 a 17 horas.',
+            keywords='horario, atención'
+        )
+        ChatbotKnowledgeBase.objects.filter(pk=self.kb.pk).update(
+            question_embedding=self.encoder.encode([self.kb.question])[0].tolist()
+        )
+
+    async def _consultar(self, datos, **extra):
+        return await self.async_client.post('/api/chatbot/query/async/', datos, content_type='application/json', **extra)
+
+    async def test_consulta_asincrona_con_cache_y_registro(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .services.service_async import esperar_registros_pendientes
+        from .services.service_benchmark import usar_encoder
+        token = str(AccessToken.for_user(self.user))
+
+        with usar_encoder(self.encoder):
+            response = await self._consultar({'question': 'cuál es el horario de atención hoy'}, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual((data['knowledge_id'], data['search_method']), (self.kb.id, 'ai_embeddings'))
+
+        await esperar_registros_pendientes()
+        conversacion = await ChatConversation.objects.aget(user=self.user)
+        self.assertEqual((conversacion.matched_knowledge_id, conversacion.search_method), (self.kb.id, 'ai_embeddings'))
+
+        # La segunda consulta sale de la caché sin tocar el modelo
+        response = await self._consultar({'question': 'cuál es el horario de atención hoy'})
+        self.assertTrue(response.json()['data']['cached'])
+
+    def test_con_wsgi_el_registro_se_espera_antes_de_responder(self):
+        """Servida por WSGI la vista corre en un loop que se cierra al responder: nada queda agendado."""
+        from rest_framework_simplejwt.tokens import AccessToken
+        response = self.client.post(
+            '/api/chatbot/query/async/', {'question': '¿Cuál es el horario de atención?'},
+            content_type='application/json', headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        conversacion = ChatConversation.objects.get(user=self.user)
+        self.assertEqual(conversacion.matched_knowledge_id, self.kb.id)
+
+    async def test_errores_de_validacion_y_token(self):
+        response = await self._consultar({'question': 'ab'})
+        self.assertEqual(response.status_code, 400)
+        response = await self._consultar({})
+        self.assertEqual(response.status_code, 400)
+        response = await self._consultar({'question': 'horario'}, headers={'Authorization': 'Bearer invalido'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_misma_respuesta_que_el_endpoint_sincrono(self):
+        response = await self._consultar({'question': '¿Cuál es el horario de atención?', 'use_cache': False})
+        sincrono = await sync_to_async(procesar_consulta_chatbot)('¿Cuál es el horario de atención?', use_cache=False)
+        data = response.json()['data']
+        for campo in ('answer', 'knowledge_id', 'search_method', 'score'):
+            self.assertEqual(data[campo], sincrono[campo])
+
+    async def test_coincidencia_exacta_se_busca_una_sola_vez(self):
+        from unittest.mock import patch
+        from .services.service_alias import buscar_coincidencia_exacta
+        with patch('chatbot.services.service_async.buscar_coincidencia_exacta', wraps=buscar_coincidencia_exacta) as asincrona, \
+                patch('chatbot.services.service_ai.buscar_coincidencia_exacta', wraps=buscar_coincidencia_exacta) as sincrona:
+            response = await self._consultar({'question': '¿Cuál es el horario de atención?', 'use_cache': False})
+        self.assertEqual(response.json()['data']['search_method'], 'exact')
+        self.assertEqual(asincrona.call_count + sincrona.call_count, 1)
+
+    async def _leer_eventos(self, response):
+        contenido = b''.join([parte async for parte in response.streaming_content]).decode()
+        eventos = []
+        for bloque in contenido.strip().split('\n\n'):
+            evento, datos = bloque.split('\n')
+            eventos.append((evento.removeprefix('event: '), json.loads(datos.removeprefix('data: '))))
+        return eventos
+
+    async def test_stream_envia_respuesta_y_luego_recomendaciones(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .services.service_async import esperar_registros_pendientes
+        otra = await ChatbotKnowledgeBase.objects.acreate(question='¿Dónde están ubicados?', answer='En Arequipa.')
+        await sync_to_async(self.kb.recommended_questions.add)(otra)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+        response = await self.async_client.post(
+            '/api/chatbot/query/stream/', {'question': '¿Cuál es el horario de atención?'},
+            content_type='application/json', headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        eventos = await self._leer_eventos(response)
+        self.assertEqual([evento for evento, _ in eventos], ['answer', 'recommendations', 'done'])
+        self.assertEqual((eventos[0][1]['knowledge_id'], eventos[0][1]['search_method']), (self.kb.id, 'exact'))
+        self.assertNotIn('recommended_questions', eventos[0][1])
+        self.assertEqual([q['id'] for q in eventos[1][1]['recommended_questions']], [otra.id])
+        self.assertIn('timestamp', eventos[2][1])
+
+        await esperar_registros_pendientes()
+        self.assertEqual(await ChatConversation.objects.filter(user=self.user).acount(), 1)
+        await self.kb.arefresh_from_db()
+        self.assertEqual(self.kb.view_count, 1)
+
+        # Desde la caché: mismos eventos, sin volver a registrar
+        response = await self.async_client.post(
+            '/api/chatbot/query/stream/', {'question': '¿Cuál es el horario de atención?'},
+            content_type='application/json', headers=headers
+        )
+        eventos = await self._leer_eventos(response)
+        self.assertTrue(eventos[0][1]['cached'])
+        self.assertEqual([q['id'] for q in eventos[1][1]['recommended_questions']], [otra.id])
+
+    async def test_stream_errores_antes_de_responder(self):
+        response = await self.async_client.post('/api/chatbot/query/stream/', {'question': '  ab  '}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ChatbotBatchQueryTestCase(APITestCase):
+    """Tests del endpoint de consultas en lote."""
+
+    def setUp(self):
+        from .services.service_benchmark import EncoderSimulado
+        cache.clear()
+        self.encoder = EncoderSimulado(64)
+        self.user = User.objects.create_user(username='batch_user', password='testpass123')
+        self.entradas = [
+            ChatbotKnowledgeBase.objects.create(question=pregunta, answer=respuesta, keywords=keywords)
+            for pregunta, respuesta, keywords in [
+                ('¿Cuál es el horario de atención?', 'De 8 a 17.', 'horario, atención'),
+                ('¿Dónde están ubicados?', 'En Arequipa.', 'ubicación, dirección'),
+                ('¿Cómo solicito vacaciones?', 'Desde el portal de RR.HH.', 'vacaciones, permiso'),
+            ]
+        ]
+        self.entradas[0].recommended_questions.add(self.entradas[1])
+        for kb in self.entradas:
+            ChatbotKnowledgeBase.objects.filter(pk=kb.pk).update(
+                question_embedding=self.encoder.encode([kb.question])[0].tolist()
+            )
+        self.preguntas = [
+            '¿Cuál es el horario de atención?',
+            'dónde están ubicados ustedes',
+            'quiero solicitar mis vacaciones',
+            'receta de torta de chocolate',
+        ]
+
+    def test_lote_responde_igual_que_consultas_individuales(self):
+        from .services.service_batch import procesar_consultas_en_lote
+        from .services.service_benchmark import usar_encoder
+        with usar_encoder(self.encoder):
+            lote = procesar_consultas_en_lote(self.preguntas, use_cache=False)
+            ChatbotKnowledgeBase.objects.update(view_count=0)
+            individuales = [procesar_consulta_chatbot(pregunta, use_cache=False) for pregunta in self.preguntas]
+        for en_lote, individual in zip(lote, individuales):
+            for campo in ('answer', 'knowledge_id', 'search_method', 'score', 'recommended_questions'):
+                self.assertEqual(en_lote[campo], individual[campo])
+        self.assertEqual(lote[0]['search_method'], 'exact')
+        self.assertEqual(lote[1]['search_method'], 'ai_embeddings')
+
+    def test_consultas_sql_no_crecen_con_el_lote(self):
+        from .services.service_batch import procesar_consultas_en_lote
+        from .services.service_benchmark import usar_encoder
+        from .services.service_index import obtener_indice
+        # El lote de 10 preguntas sin caché agotaría la cubeta del usuario
+        with usar_encoder(self.encoder), patch('chatbot.services.service_rate_limit.RATE_LIMIT_ENABLED', False):
+            obtener_indice()
+            # Calienta el índice, el mapa exacto y la fila diaria de estadísticas
+            procesar_consultas_en_lote(self.preguntas[1:3], user_id=self.user.id, use_cache=False)
+            with CaptureQueriesContext(connection) as pocas:
+                procesar_consultas_en_lote(self.preguntas[1:3], user_id=self.user.id, use_cache=False)
+            with CaptureQueriesContext(connection) as muchas:
+                procesar_consultas_en_lote(self.preguntas[1:3] * 5, user_id=self.user.id, use_cache=False)
+        self.assertEqual(len(pocas), len(muchas))
+
+    def test_endpoint_registra_conversaciones_y_usa_cache(self):
+        from .models import ChatbotDailyStats
+        from .services.service_benchmark import usar_encoder
+        self.client.force_authenticate(user=self.user)
+        with usar_encoder(self.encoder):
+            response = self.client.post('/api/chatbot/query/batch/', {'questions': self.preguntas}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        resultados = response.json()['data']['results']
+        self.assertEqual([r['question'] for r in resultados], self.preguntas)
+        self.assertEqual([q['id'] for q in resultados[0]['recommended_questions']], [self.entradas[1].id])
+
+        self.assertEqual(ChatConversation.objects.filter(user=self.user).count(), 4)
+        estadisticas = ChatbotDailyStats.objects.get()
+        self.assertEqual((estadisticas.total_conversations, estadisticas.matched_conversations), (4, 2))
+
+        response = self.client.post('/api/chatbot/query/batch/', {'questions': self.preguntas[:2]}, format='json')
+        self.assertTrue(all(r['cached'] for r in response.json()['data']['results']))
+
+    def test_validacion_del_lote(self):
+        from .services.service_batch import BATCH_MAX_QUESTIONS
+        for datos in ({'questions': []}, {'questions': ['ok?', 'ab']}, {'questions': ['hola'] * (BATCH_MAX_QUESTIONS + 1)}):
+            response = self.client.post('/api/chatbot/query/batch/', datos, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChatbotRateLimitTestCase(APITestCase):
+    """Tests del limitador de consultas."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='limit_user', password='testpass123')
+        ChatbotKnowledgeBase.objects.create(
+            question='¿Cuál es el horario de atención?', answer='De 8 a 17.', keywords='horario, atención'
+        )
+
+    def test_consumir_devuelve_tokens_al_rechazar(self):
+        from .services.exceptions import RateLimitError
+        from .services.service_rate_limit import consumir
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'user': 10, 'ip': 4}):
+            consumir(['user:1', 'ip:10.0.0.1'], 3)
+            with self.assertRaises(RateLimitError) as contexto:
+                consumir(['user:1', 'ip:10.0.0.1'], 3)
+            self.assertGreater(contexto.exception.retry_after, 0)
+            # El intento rechazado no gastó cupo en ninguna de las cubetas
+            consumir(['user:1', 'ip:10.0.0.1'], 1)
+            consumir(['user:1'], 6)
+            with self.assertRaises(RateLimitError):
+                consumir(['user:1'], 1)
+
+    def test_respuestas_en_cache_cuestan_menos(self):
+        from .services.exceptions import RateLimitError
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'user': 9}):
+            procesar_consulta_chatbot('horario de atención', user_id=self.user.id)  # 1 + 5
+            for _ in range(3):
+                procesar_consulta_chatbot('horario de atención', user_id=self.user.id)  # 1 cada una
+            with self.assertRaises(RateLimitError):
+                procesar_consulta_chatbot('otra pregunta distinta', user_id=self.user.id)
+        # Sin identidad (comandos, evaluación) no se limita
+        procesar_consulta_chatbot('otra pregunta distinta')
+
+    def test_lote_agota_la_cubeta_como_consultas_individuales(self):
+        from .services.exceptions import RateLimitError
+        from .services.service_batch import procesar_consultas_en_lote
+        otro = User.objects.create_user(username='limit_user_2', password='testpass123')
+        preguntas = ['horario de atención', 'cuál es el horario', 'horario de la oficina']
+        # Tres consultas sin caché: 3 × (1 + 5) tokens, la cubeta queda vacía
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'user': 18}):
+            for pregunta in preguntas:
+                procesar_consulta_chatbot(pregunta, user_id=self.user.id)
+            with self.assertRaises(RateLimitError):
+                procesar_consulta_chatbot('horario de atención', user_id=self.user.id)
+
+            cache.clear()  # El lote tampoco encuentra las respuestas en caché
+            procesar_consultas_en_lote(preguntas, user_id=otro.id)
+            with self.assertRaises(RateLimitError):
+                procesar_consulta_chatbot('horario de atención', user_id=otro.id)
+
+    def test_consulta_rechazada_no_gasta_la_lectura_de_cache(self):
+        from .services.exceptions import RateLimitError
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'user': 8}):
+            procesar_consulta_chatbot('horario de atención', user_id=self.user.id)  # 1 + 5
+            with self.assertRaises(RateLimitError):
+                procesar_consulta_chatbot('otra pregunta distinta', user_id=self.user.id)
+            # Quedan los 2 tokens: dos respuestas en caché
+            for _ in range(2):
+                procesar_consulta_chatbot('horario de atención', user_id=self.user.id)
+            with self.assertRaises(RateLimitError):
+                procesar_consulta_chatbot('horario de atención', user_id=self.user.id)
+
+    def test_lote_mayor_que_la_cubeta_pasa_y_retry_after_alcanza(self):
+        import time
+        from .services.exceptions import RateLimitError
+        from .services.service_ai import _generate_cache_key
+        from .services.service_batch import procesar_consultas_en_lote
+        preguntas = [f'horario de la sede número {numero}' for numero in range(11)]
+        ahora = time.time()
+        reloj = Mock(time=Mock(return_value=ahora))
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'user': 60}), \
+                patch('chatbot.services.service_rate_limit.time', reloj):
+            # 11 × 6 = 66 tokens: se cobra la cubeta completa, no se rechaza para siempre
+            self.assertEqual(len(procesar_consultas_en_lote(preguntas, user_id=self.user.id)), 11)
+            cache.delete_many([_generate_cache_key(pregunta) for pregunta in preguntas])
+            with self.assertRaises(RateLimitError) as contexto:
+                procesar_consultas_en_lote(preguntas, user_id=self.user.id)
+
+            # Tras Retry-After el mismo lote pasa
+            reloj.time.return_value = ahora + contexto.exception.retry_after
+            cache.delete_many([_generate_cache_key(pregunta) for pregunta in preguntas])
+            procesar_consultas_en_lote(preguntas, user_id=self.user.id)
+
+    def test_endpoint_responde_429_por_ip(self):
+        with patch.dict('chatbot.services.service_rate_limit.RATE_LIMIT_CAPACITY', {'ip': 12, 'session': 100}):
+            for sesion in ('a', 'b'):
+                response = self.client.post('/api/chatbot/query/', {'question': f'horario {sesion}', 'session_id': sesion}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Cambiar de sesión no evade el límite de la IP
+            response = self.client.post('/api/chatbot/query/', {'question': 'horario c', 'session_id': 'c'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
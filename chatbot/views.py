@@ -2,18 +2,30 @@
 Vistas del módulo chatbot.
 """
 
+import json
 import logging
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
 
 from .models import ChatbotKnowledgeBase, ChatConversation, ChatbotCategory
 from .serializers import (
     ChatbotQuerySerializer,
+    ChatbotBatchQuerySerializer,
     ChatbotKnowledgeBaseSerializer,
     ChatConversationSerializer,
     ChatbotCategorySerializer
@@ -22,12 +34,18 @@ from .services import (
     procesar_consulta_chatbot,
     obtener_preguntas_frecuentes,
     obtener_estadisticas_chatbot,
+    obtener_metricas_rendimiento,
     ModelNotAvailableError,
     NoKnowledgeBaseError,
     InvalidQuestionError,
     ChatbotServiceError,
     RateLimitError
 )
+from .services.service_rollup import consultar_serie, consultar_resumen, DIMENSIONES, HOUR, DAY
+from .services.service_metrics import exportar_prometheus
+from .services.service_async import procesar_consulta_async, transmitir_consulta
+from .services.service_batch import procesar_consultas_en_lote
+from .services.service_rate_limit import RATE_LIMIT_TRUST_FORWARDED
 from core.permissions import IsInGroup
 from core.viewsets import AuditModelViewSet
 
@@ -43,8 +61,11 @@ class ChatbotKnowledgeBaseViewSet(AuditModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             permission_classes = [permissions.IsAuthenticated, IsInGroup('Admin', 'QA')]
         else:
-            # Temporalmente permitir acceso a cualquier usuario autenticado
-            permission_classes = [permissions.IsAuthenticated]
+            # Las acciones extra usan los permisos declarados en su @action: metrics/ exige Admin y
+            # statistics/, bulk_import/ y regenerate_embeddings/ exigen Admin o QA (antes bastaba
+            # con estar autenticado). El resto, temporalmente, cualquier usuario autenticado
+            accion = getattr(self, self.action or '', None)
+            permission_classes = getattr(accion, 'kwargs', {}).get('permission_classes', [permissions.IsAuthenticated])
         return [permission() if isinstance(permission, type) else permission for permission in permission_classes]
 
     def list(self, request, *args, **kwargs):
@@ -137,6 +158,18 @@ class ChatbotKnowledgeBaseViewSet(AuditModelViewSet):
             logger.error(f"Error al obtener estadísticas: {e}")
             return Response({"status": "error", "error": "Error al obtener estadísticas"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @extend_schema(
+        summary="Métricas de Rendimiento",
+        description="Tiempos por etapa (p50/p90/p99), tasa de aciertos de caché y distribución de métodos de búsqueda del proceso que atiende la petición"
+    )
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated, IsInGroup('Admin')])
+    def metrics(self, request):
+        try:
+            return Response({"status": "success", "data": obtener_metricas_rendimiento()})
+        except Exception as e:
+            logger.error(f"Error al obtener métricas: {e}")
+            return Response({"status": "error", "error": "Error al obtener métricas"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @extend_schema(
         summary="Importación Masiva de Conocimientos",
         description="Permite importar múltiples entradas de base de conocimiento desde un archivo JSON"
@@ -307,6 +340,22 @@ class ChatbotCategoryViewSet(viewsets.ModelViewSet):
             return Response({"status": "error", "error": "Error al eliminar la categoría"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def obtener_ip_cliente(request):
+    """
+    IP del cliente para el limitador de consultas. Detrás de un proxy de confianza
+    (CHATBOT_RATE_LIMIT_TRUST_FORWARDED) se usa la última IP que agregó a X-Forwarded-For.
+    """
+    if RATE_LIMIT_TRUST_FORWARDED:
+        reenviadas = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if reenviadas:
+            return reenviadas.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def _cabeceras_reintento(error):
+    return {'Retry-After': str(error.retry_after)} if error.retry_after else None
+
+
 @extend_schema(tags=['Chatbot Query'])
 class ChatbotQueryView(APIView):
     permission_classes = [AllowAny]
@@ -327,7 +376,8 @@ class ChatbotQueryView(APIView):
                 pregunta=pregunta,
                 user_id=user_id,
                 session_id=session_id,
-                use_cache=use_cache
+                use_cache=use_cache,
+                ip=obtener_ip_cliente(request)
             )
             
             resultado['cached'] = 'knowledge_id' in resultado and use_cache
@@ -344,7 +394,7 @@ class ChatbotQueryView(APIView):
         except NoKnowledgeBaseError as e:
             return Response({"status": "error", "error": "Base de conocimiento no disponible"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except RateLimitError as e:
-            return Response({"status": "error", "error": "Límite de consultas excedido"}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            return Response({"status": "error", "error": "Límite de consultas excedido"}, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=_cabeceras_reintento(e))
         except ChatbotServiceError as e:
             return Response({"status": "error", "error": "Error interno del chatbot"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as e:
@@ -352,6 +402,168 @@ class ChatbotQueryView(APIView):
             return Response({"status": "error", "error": "Error interno del servidor"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@extend_schema(tags=['Chatbot Query'])
+class ChatbotBatchQueryView(APIView):
+    """Varias preguntas en una petición (hasta CHATBOT_BATCH_MAX_QUESTIONS); respuestas en el mismo orden."""
+    permission_classes = [AllowAny]
+
+    @extend_schema(summary="Consultar Chatbot en lote", request=ChatbotBatchQuerySerializer)
+    def post(self, request):
+        try:
+            serializer = ChatbotBatchQuerySerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response({"status": "error", "error": "Datos inválidos", "details": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+            preguntas = serializer.validated_data['questions']
+            resultados = procesar_consultas_en_lote(
+                preguntas=preguntas,
+                user_id=request.user.id if request.user.is_authenticated else None,
+                session_id=serializer.validated_data.get('session_id', 'anonymous'),
+                use_cache=serializer.validated_data.get('use_cache', True),
+                ip=obtener_ip_cliente(request)
+            )
+
+            timestamp = timezone.now().isoformat()
+            for pregunta, resultado in zip(preguntas, resultados):
+                resultado['question'] = pregunta
+                resultado['timestamp'] = timestamp
+
+            logger.info(f"Lote procesado: {len(preguntas)} preguntas")
+            return Response({"status": "success", "data": {"results": resultados, "total": len(resultados)}})
+
+        except InvalidQuestionError as e:
+            return Response({"status": "error", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ModelNotAvailableError as e:
+            return Response({"status": "error", "error": "Servicio no disponible temporalmente"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except NoKnowledgeBaseError as e:
+            return Response({"status": "error", "error": "Base de conocimiento no disponible"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except RateLimitError as e:
+            return Response({"status": "error", "error": "Límite de consultas excedido"}, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=_cabeceras_reintento(e))
+        except ChatbotServiceError as e:
+            return Response({"status": "error", "error": "Error interno del chatbot"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            logger.error(f"Error inesperado en lote: {e}")
+            return Response({"status": "error", "error": "Error interno del servidor"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatbotAsyncQueryView(View):
+    """
+    Variante asíncrona de ChatbotQueryView (mismo contrato). Servida por ASGI, un worker
+    atiende muchas consultas en vuelo: espera la caché sin bloquear, codifica en un pool
+    acotado y registra la conversación en segundo plano. Servida por WSGI el registro se
+    espera antes de responder. Autentica solo por JWT.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request):
+        consulta = await _leer_consulta_async(request)
+        if isinstance(consulta, JsonResponse):
+            return consulta
+
+        try:
+            resultado = await procesar_consulta_async(**consulta)
+        except Exception as e:
+            return _respuesta_de_error(e)
+
+        resultado['cached'] = 'knowledge_id' in resultado and consulta['use_cache']
+        resultado['timestamp'] = timezone.now().isoformat()
+        logger.info(f"Consulta procesada (async): {consulta['pregunta'][:50]}... | Score: {resultado.get('score', 0)}")
+        return JsonResponse({"status": "success", "data": resultado})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatbotStreamQueryView(View):
+    """
+    Consulta del chatbot como Server-Sent Events: el evento `answer` sale apenas se resuelve
+    la coincidencia; luego llegan `recommendations` y `done` (con `timestamp`). Los errores
+    previos a la respuesta se devuelven como JSON con el mismo código que ChatbotQueryView.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request):
+        consulta = await _leer_consulta_async(request)
+        if isinstance(consulta, JsonResponse):
+            return consulta
+
+        eventos = transmitir_consulta(**consulta)
+        try:
+            # Se espera el primer evento antes de abrir el stream para poder responder con el código de error
+            primero = await eventos.__anext__()
+        except Exception as e:
+            return _respuesta_de_error(e)
+
+        response = StreamingHttpResponse(_formatear_sse(primero, eventos), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Evita que nginx acumule los eventos
+        return response
+
+
+async def _formatear_sse(primero, eventos):
+    evento, datos = primero
+    yield _evento_sse(evento, datos)
+    try:
+        async for evento, datos in eventos:
+            if evento == 'done':
+                datos['timestamp'] = timezone.now().isoformat()
+            yield _evento_sse(evento, datos)
+    except Exception as e:
+        logger.error(f"Error durante la transmisión: {e}")
+        yield _evento_sse('error', {"error": "Error interno del chatbot"})
+
+
+def _evento_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def _leer_consulta_async(request):
+    """Autentica (JWT) y valida el cuerpo; devuelve los argumentos de la consulta o un JsonResponse de error."""
+    try:
+        user_id = await _autenticar_jwt(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"status": "error", "error": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        datos = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"status": "error", "error": "JSON inválido"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = ChatbotQuerySerializer(data=datos)
+    if not serializer.is_valid():
+        return JsonResponse({"status": "error", "error": "Datos inválidos", "details": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    return {
+        'pregunta': serializer.validated_data['question'],
+        'user_id': user_id,
+        'session_id': serializer.validated_data.get('session_id', 'anonymous'),
+        'use_cache': serializer.validated_data.get('use_cache', True),
+        'ip': obtener_ip_cliente(request),
+        # Con WSGI el event loop de la petición se cierra al responder y perdería las tareas agendadas
+        'registrar_en_segundo_plano': isinstance(request, ASGIRequest),
+    }
+
+
+async def _autenticar_jwt(request):
+    """Id del usuario del token Bearer, None si no hay token; lanza AuthenticationFailed si es inválido."""
+    autenticado = await sync_to_async(JWTAuthentication().authenticate)(request)
+    return autenticado[0].id if autenticado else None
+
+
+def _respuesta_de_error(error):
+    """Mismos códigos de error que ChatbotQueryView."""
+    if isinstance(error, InvalidQuestionError):
+        return JsonResponse({"status": "error", "error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    if isinstance(error, ModelNotAvailableError):
+        return JsonResponse({"status": "error", "error": "Servicio no disponible temporalmente"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if isinstance(error, NoKnowledgeBaseError):
+        return JsonResponse({"status": "error", "error": "Base de conocimiento no disponible"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if isinstance(error, RateLimitError):
+        return JsonResponse({"status": "error", "error": "Límite de consultas excedido"}, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=_cabeceras_reintento(error))
+    if isinstance(error, ChatbotServiceError):
+        return JsonResponse({"status": "error", "error": "Error interno del chatbot"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    logger.error(f"Error inesperado: {error}")
+    return JsonResponse({"status": "error", "error": "Error interno del servidor"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @extend_schema(tags=['Chatbot Query'])
 class ChatbotRecommendedQuestionsView(APIView):
     permission_classes = [AllowAny]
@@ -368,4 +580,88 @@ class ChatbotRecommendedQuestionsView(APIView):
             return Response({"status": "success", "data": {"recommended_questions": preguntas, "total": len(preguntas)}})
         except Exception as e:
             logger.error(f"Error al obtener preguntas recomendadas: {e}")
-            return Response({"status": "error", "error": "Error al obtener preguntas recomendadas"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR) 
\ No newline at end of file
+            return Response({"status": "error", "error": "Error al obtener preguntas recomendadas"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@extend_schema(tags=['Chatbot Metrics'], summary="Métricas en formato Prometheus", responses={200: OpenApiTypes.STR})
+class ChatbotPrometheusMetricsView(APIView):
+    """Expone las métricas del proceso en el formato de texto de Prometheus (solo Admin)."""
+
+    def get_permissions(self):
+        permission_classes = [permissions.IsAuthenticated, IsInGroup('Admin')]
+        return [permission() if isinstance(permission, type) else permission for permission in permission_classes]
+
+    def get(self, request):
+        return HttpResponse(exportar_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _parsear_rango_fechas(query_params, dias_por_defecto=30):
+    """Lee `desde`/`hasta` (YYYY-MM-DD, inclusive). Devuelve (desde, hasta) o lanza ValueError."""
+    hasta = parse_date(query_params['hasta']) if query_params.get('hasta') else timezone.localdate()
+    desde = parse_date(query_params['desde']) if query_params.get('desde') else hasta - timedelta(days=dias_por_defecto - 1)
+    if not desde or not hasta or desde > hasta:
+        raise ValueError("Rango de fechas inválido")
+    return desde, hasta
+
+
+@extend_schema(tags=['Chatbot Analytics'])
+class ChatbotAnalyticsTimeseriesView(APIView):
+    """Serie temporal de conversaciones leída de los agregados por hora/día (Admin y QA, como las estadísticas)."""
+
+    def get_permissions(self):
+        permission_classes = [permissions.IsAuthenticated, IsInGroup('Admin', 'QA')]
+        return [permission() if isinstance(permission, type) else permission for permission in permission_classes]
+
+    @extend_schema(
+        summary="Serie Temporal de Conversaciones",
+        parameters=[
+            OpenApiParameter(name='granularity', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, description='hour o day (default: day)'),
+            OpenApiParameter(name='desde', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description='Fecha inicial inclusive (default: hace 30 días)'),
+            OpenApiParameter(name='hasta', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description='Fecha final inclusive (default: hoy)'),
+            OpenApiParameter(name='group_by', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, description='category, knowledge, search_method o matched'),
+        ]
+    )
+    def get(self, request):
+        try:
+            granularity = request.query_params.get('granularity', DAY)
+            group_by = request.query_params.get('group_by')
+            if granularity not in (HOUR, DAY) or (group_by and group_by not in DIMENSIONES):
+                return Response({"status": "error", "error": "Parámetros de agrupación inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                desde, hasta = _parsear_rango_fechas(request.query_params)
+            except ValueError as e:
+                return Response({"status": "error", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            serie = consultar_serie(granularity, desde, hasta, dimension=group_by)
+            return Response({"status": "success", "data": {"granularity": granularity, "desde": desde, "hasta": hasta, "series": serie}})
+        except Exception as e:
+            logger.error(f"Error al obtener serie de conversaciones: {e}")
+            return Response({"status": "error", "error": "Error al obtener la analítica"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@extend_schema(tags=['Chatbot Analytics'])
+class ChatbotAnalyticsSummaryView(APIView):
+    """Resumen de conversaciones: tasa sin coincidencia y desglose por categoría, entrada y método (Admin y QA)."""
+
+    def get_permissions(self):
+        permission_classes = [permissions.IsAuthenticated, IsInGroup('Admin', 'QA')]
+        return [permission() if isinstance(permission, type) else permission for permission in permission_classes]
+
+    @extend_schema(
+        summary="Resumen de Conversaciones",
+        parameters=[
+            OpenApiParameter(name='desde', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description='Fecha inicial inclusive (default: hace 30 días)'),
+            OpenApiParameter(name='hasta', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, description='Fecha final inclusive (default: hoy)'),
+        ]
+    )
+    def get(self, request):
+        try:
+            try:
+                desde, hasta = _parsear_rango_fechas(request.query_params)
+            except ValueError as e:
+                return Response({"status": "error", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"status": "success", "data": consultar_resumen(desde, hasta)})
+        except Exception as e:
+            logger.error(f"Error al obtener resumen de conversaciones: {e}")
+            return Response({"status": "error", "error": "Error al obtener la analítica"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
@@ -0,0 +1,100 @@
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def despues_de(posicion):
+    """
+    Filtro de keyset para el orden (-created_at, -id): las filas que van después
+    de `posicion` = (created_at, id). Lo resuelve un índice que termine en created_at.
+    """
+    if posicion is None:
+        return Q()
+    created_at, pk = posicion
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor sobre (created_at, id), del más reciente al más antiguo.
+
+    A diferencia de la paginación por número de página, cada página cuesta lo mismo
+    sin importar cuántas filas hay antes: el cursor (opaco, en `next`) guarda la
+    última fila entregada y la siguiente página se lee a partir de ella.
+
+    Si la vista define `obtener_pagina(posicion, limite)`, la página la arma la vista
+    (p. ej. con una UNION); si no, se filtra y ordena el queryset recibido.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limite = self.get_page_size(request)
+        posicion = self.decodificar_cursor(request)
+
+        if view is not None and hasattr(view, 'obtener_pagina'):
+            filas = list(view.obtener_pagina(posicion, limite + 1))
+        else:
+            filas = list(queryset.filter(despues_de(posicion)).order_by(*self.ordering)[:limite + 1])
+
+        self.hay_siguiente = len(filas) > limite
+        filas = filas[:limite]
+        self.siguiente = (filas[-1].created_at, filas[-1].pk) if self.hay_siguiente else None
+        return filas
+
+    def get_page_size(self, request):
+        try:
+            tamano = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(tamano, self.max_page_size))
+
+    def decodificar_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            texto = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            created_at, pk = texto.rsplit('|', 1)
+            posicion = (parse_datetime(created_at), int(pk))
+        except (ValueError, UnicodeError):
+            raise NotFound('Cursor inválido.')
+        if posicion[0] is None:
+            raise NotFound('Cursor inválido.')
+        return posicion
+
+    def codificar_cursor(self, posicion):
+        created_at, pk = posicion
+        return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.hay_siguiente:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.codificar_cursor(self.siguiente))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
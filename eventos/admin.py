@@ -8,6 +8,7 @@ class EventoAdmin(admin.ModelAdmin):
     list_filter = ('publicado', 'fecha', 'autor')
     search_fields = ('titulo', 'descripcion')
     readonly_fields = ('created_by', 'updated_by')
+    filter_horizontal = ('grupos_destino',)
 
 @admin.register(Categoria)
 class CategoriaAdmin(AuditModelAdmin):
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('eventos', '0010_alter_evento_autor_alter_evento_fecha_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evento',
+            name='grupos_destino',
+            field=models.ManyToManyField(blank=True, help_text='Solo los usuarios de estos grupos reciben la notificación push. Vacío = todos.', related_name='eventos_destino', to='auth.group', verbose_name='Grupos notificados'),
+        ),
+        migrations.AddField(
+            model_name='evento',
+            name='solo_suscriptores',
+            field=models.BooleanField(default=False, help_text='Notificar solo a los usuarios suscritos a la categoría del evento.', verbose_name='Solo suscriptores'),
+        ),
+    ]
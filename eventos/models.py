@@ -45,6 +45,18 @@ class Evento(BaseModelWithAudit):
         related_name='eventos'
     )
     imagen = models.ImageField(upload_to='eventos_imagenes/', null=True, blank=True)
+    grupos_destino = models.ManyToManyField(
+        'auth.Group',
+        blank=True,
+        related_name='eventos_destino',
+        verbose_name="Grupos notificados",
+        help_text="Solo los usuarios de estos grupos reciben la notificación push. Vacío = todos."
+    )
+    solo_suscriptores = models.BooleanField(
+        default=False,
+        verbose_name="Solo suscriptores",
+        help_text="Notificar solo a los usuarios suscritos a la categoría del evento."
+    )
 
     class Meta:
         verbose_name = "Evento"
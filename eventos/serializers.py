@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Evento, Categoria
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 
 User = get_user_model()
 
@@ -53,13 +54,17 @@ class EventoSerializer(serializers.ModelSerializer):
     categoria_id = serializers.PrimaryKeyRelatedField(
         queryset=Categoria.objects.all(), source='categoria', write_only=True, required=False, allow_null=True
     )
+    # Audiencia de la notificación push: nombres de grupo (vacío = todos).
+    grupos_destino = serializers.SlugRelatedField(
+        slug_field='name', queryset=Group.objects.all(), many=True, required=False
+    )
 
     class Meta:
         model = Evento
         fields = [
             'id', 'titulo', 'descripcion', 'fecha', 'publicado', 'is_pinned',
             'autor', 'imagen', 'categoria', 'created_at', 'updated_at',
-            'categoria_id', 'created_by', 'updated_by'
+            'categoria_id', 'grupos_destino', 'solo_suscriptores', 'created_by', 'updated_by'
         ]
         read_only_fields = ['autor', 'created_at', 'updated_at', 'created_by', 'updated_by']
     
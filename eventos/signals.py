@@ -1,8 +1,9 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from .models import Evento
 from notificaciones.models import Notificacion
-from notificaciones.services import send_push_notification
+from notificaciones.services import actualizar_audiencia_pendiente, audiencia_de_evento, encolar_notificacion
 
 @receiver(post_save, sender=Evento)
 def crear_y_enviar_notificacion_al_publicar(sender, instance, created, update_fields, **kwargs):
@@ -10,7 +11,7 @@ def crear_y_enviar_notificacion_al_publicar(sender, instance, created, update_fi
     Señal que se dispara al guardar un Evento.
 
     Si el evento se marca como 'publicado' (ya sea al crearse o al actualizarse),
-    crea un registro de Notificacion y desencadena el envío de notificaciones push.
+    crea un registro de Notificacion y encola su envío push.
     """
     # Determinar si el campo 'publicado' fue explícitamente parte de la actualización.
     # Si `update_fields` es None, se asume que cualquier campo pudo haber cambiado.
@@ -18,21 +19,45 @@ def crear_y_enviar_notificacion_al_publicar(sender, instance, created, update_fi
 
     # La condición se cumple si el evento está publicado Y es una creación nueva o se está actualizando el campo 'publicado'.
     if instance.publicado and (created or publicado_field_updated):
-        # Evitar enviar notificaciones duplicadas para el mismo evento.
-        if not Notificacion.objects.filter(evento=instance, leido=True).exists():
+        # Evitar notificaciones duplicadas: solo se crea otra si la anterior falló por completo.
+        if not Notificacion.objects.filter(evento=instance).exclude(estado=Notificacion.ESTADO_FALLIDA).exists():
             trigger_notification(instance)
+            return
+
+    # Un cambio de categoría o de `solo_suscriptores` alcanza al envío que sigue en cola
+    if instance.publicado and not created and (
+        update_fields is None or {'categoria', 'solo_suscriptores'} & set(update_fields)
+    ):
+        actualizar_audiencia_pendiente(instance)
+
+
+@receiver(m2m_changed, sender=Evento.grupos_destino.through)
+def actualizar_audiencia_al_cambiar_grupos(sender, instance, action, reverse, **kwargs):
+    """
+    Señal que se dispara al cambiar los grupos destino de un Evento.
+
+    El admin y la API guardan los grupos después del evento, es decir, después de
+    crear la notificación: su audiencia se recalcula mientras siga pendiente.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        actualizar_audiencia_pendiente(instance)
 
 def trigger_notification(evento):
-    """Crea el objeto Notificacion y llama al servicio de envío."""
+    """
+    Crea el objeto Notificacion y encola su envío.
+
+    La notificación y su trabajo se crean en la misma transacción que el evento;
+    el worker `process_notification_queue` los toma una vez confirmada, de modo
+    que publicar no espera a FCM. Quien guarda también los grupos destino (admin,
+    API) debe hacerlo en esa misma transacción.
+    """
     # El usuario que actualizó por última vez el evento es el responsable.
     audit_user = evento.updated_by
-    notificacion = Notificacion.objects.create(
-        evento=evento,
-        created_by=audit_user,
-        updated_by=audit_user
-    )
-    
-    # TODO: ¡Crítico en producción! Esta llamada debe ser asíncrona.
-    # Usar Celery u otro sistema de colas para no bloquear la petición HTTP.
-    # Ejemplo: send_push_notification.delay(notificacion.id)
-    send_push_notification(notificacion.id)
\ No newline at end of file
+    with transaction.atomic():
+        notificacion = Notificacion.objects.create(
+            evento=evento,
+            audiencia=audiencia_de_evento(evento),
+            created_by=audit_user,
+            updated_by=audit_user
+        )
+        encolar_notificacion(notificacion)
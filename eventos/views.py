@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.db import models
+from django.db import models, transaction
 from rest_framework import permissions, generics
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
@@ -45,6 +45,20 @@ class EventoViewSet(AuditModelViewSet):
             permission_classes = [permissions.IsAuthenticated]  # Solo requiere autenticación para lectura
         return [permission() if isinstance(permission, type) else permission for permission in permission_classes]
 
+    def perform_create(self, serializer):
+        """
+        Guarda el evento y sus grupos destino en una sola transacción: el trabajo de
+        envío que crea la señal al publicar no es visible para el worker antes que
+        los grupos que definen su audiencia.
+        """
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        """Como `perform_create`: el evento y sus grupos destino se confirman juntos."""
+        with transaction.atomic():
+            super().perform_update(serializer)
+
     @extend_schema(summary="Listar Eventos")
     def list(self, request, *args, **kwargs):
         """Obtiene una lista paginada y filtrable de eventos."""
@@ -1,18 +1,42 @@
 from django.contrib import admin
-from .models import DeviceToken, Notificacion
+from django.utils import timezone
+from .models import DeviceToken, Notificacion, NotificacionJob, SuscripcionCategoria
 from core.admin import AuditModelAdmin
 from core.viewsets import AuditModelViewSet
 
 @admin.register(DeviceToken)
 class DeviceTokenAdmin(AuditModelAdmin):
-    list_display = ('user', 'device_type', 'is_active', 'created_at')
-    list_filter = ('device_type', 'is_active')
+    list_display = ('user', 'device_type', 'is_active', 'failure_count', 'last_failure_reason', 'created_at')
+    list_filter = ('device_type', 'is_active', 'last_failure_reason')
     search_fields = ('user__username', 'token')
     autocomplete_fields = ['user']
 
 @admin.register(Notificacion)
 class NotificacionAdmin(AuditModelAdmin):
-    list_display = ('destinatario', 'titulo', 'leido', 'created_at')
-    list_filter = ('leido',)
+    list_display = ('destinatario', 'titulo', 'estado', 'created_at')
+    list_filter = ('estado',)
     search_fields = ('titulo', 'mensaje', 'destinatario__username')
     autocomplete_fields = ['destinatario', 'evento']
+
+@admin.register(SuscripcionCategoria)
+class SuscripcionCategoriaAdmin(AuditModelAdmin):
+    list_display = ('user', 'categoria', 'created_at')
+    list_filter = ('categoria',)
+    search_fields = ('user__username', 'categoria__nombre')
+    autocomplete_fields = ['user']
+    list_select_related = ('user', 'categoria')
+
+@admin.register(NotificacionJob)
+class NotificacionJobAdmin(admin.ModelAdmin):
+    list_display = ('notificacion', 'estado', 'intentos', 'disponible_en', 'updated_at')
+    list_filter = ('estado',)
+    readonly_fields = ('notificacion', 'intentos', 'bloqueado_en', 'error', 'created_at', 'updated_at')
+    list_select_related = ('notificacion',)
+    actions = ['reintentar']
+
+    @admin.action(description='Reintentar trabajos seleccionados')
+    def reintentar(self, request, queryset):
+        total = queryset.exclude(estado=NotificacionJob.ESTADO_PROCESANDO).update(
+            estado=NotificacionJob.ESTADO_PENDIENTE, disponible_en=timezone.now(), error=''
+        )
+        self.message_user(request, f'{total} trabajos reprogramados.')
@@ -16,6 +16,7 @@ class NotificacionesConfig(AppConfig):
         Este método es el lugar recomendado por Django para el código de inicialización,
         ya que se ejecuta una sola vez al arrancar el servidor.
         """
+        import notificaciones.signals  # Contadores de no leídas
         if not firebase_admin._apps:
             try:
                 cred_path = settings.FIREBASE_ADMIN_CREDENTIALS_PATH
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from notificaciones.services import QUEUE_BATCH_SIZE, procesar_cola
+
+
+class Command(BaseCommand):
+    help = 'Procesa la cola de notificaciones push (worker sin broker externo).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Procesa los trabajos disponibles y termina.')
+        parser.add_argument('--batch-size', type=int, default=QUEUE_BATCH_SIZE, help=f'Trabajos reclamados por vuelta (default: {QUEUE_BATCH_SIZE}).')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Segundos de espera cuando la cola está vacía (default: 2).')
+
+    def handle(self, *args, **options):
+        """
+        Pueden correr varios workers a la vez: cada uno reclama trabajos distintos
+        con SELECT ... FOR UPDATE SKIP LOCKED.
+        """
+        total = 0
+        try:
+            while True:
+                procesados = procesar_cola(options['batch_size'])
+                total += procesados
+                if not procesados:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"{total} trabajos de notificación procesados."))
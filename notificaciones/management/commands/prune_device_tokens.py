@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from notificaciones.services import TOKEN_MAX_FAILURES, TOKEN_PRUNE_DAYS, TOKEN_STALE_DAYS, podar_tokens
+
+
+class Command(BaseCommand):
+    help = 'Desactiva los tokens de dispositivo que fallan de forma reiterada o que la app ya no registra, y elimina los inactivos antiguos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-failures', type=int, default=TOKEN_MAX_FAILURES, help=f'Envíos fallidos para desactivar un token (default: {TOKEN_MAX_FAILURES}).')
+        parser.add_argument('--days', type=int, default=TOKEN_PRUNE_DAYS, help=f'Días desde el último fallo (o desde su desactivación por falta de uso) para eliminar un token inactivo (default: {TOKEN_PRUNE_DAYS}).')
+        parser.add_argument('--stale-days', type=int, default=TOKEN_STALE_DAYS, help=f'Días sin registro para desactivar un token (default: {TOKEN_STALE_DAYS}).')
+
+    def handle(self, *args, **options):
+        resultado = podar_tokens(options['max_failures'], options['days'], options['stale_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['desactivados']} tokens desactivados, {resultado['eliminados']} eliminados."
+        ))
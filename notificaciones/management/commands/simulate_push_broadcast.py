@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from notificaciones.services import SEND_WORKERS, simular_difusion
+from notificaciones.transports import ERRORES_SIMULADOS, TransporteFalso
+
+
+class Command(BaseCommand):
+    help = 'Simula una difusión push a N tokens sintéticos contra un FCM falso y mide el rendimiento.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=10000, help='Cantidad de tokens sintéticos (default: 10000).')
+        parser.add_argument('--workers', type=int, default=SEND_WORKERS, help=f'Hilos de envío (default: {SEND_WORKERS}).')
+        parser.add_argument('--latency', type=float, default=50, help='Latencia simulada por llamada a FCM, en ms (default: 50).')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Probabilidad de error transitorio por token (UNAVAILABLE).')
+        parser.add_argument('--invalid-rate', type=float, default=0.0, help='Probabilidad de token no registrado (UNREGISTERED).')
+        parser.add_argument('--batch-failure-rate', type=float, default=0.0, help='Probabilidad de que falle la llamada completa.')
+        parser.add_argument('--token-errors', type=str, default=None, help=f"JSON token → código ({', '.join(ERRORES_SIMULADOS)}).")
+        parser.add_argument('--seed', type=int, default=42, help='Semilla de los fallos simulados.')
+
+    def handle(self, *args, **options):
+        """
+        Ejemplo: python manage.py simulate_push_broadcast --tokens 50000 --workers 8 --latency 120
+        Los tokens sintéticos se llaman 'simulado-<n>'.
+        """
+        if options['tokens'] < 1 or options['workers'] < 1:
+            raise CommandError('--tokens y --workers deben ser mayores que cero.')
+        try:
+            errores = json.loads(options['token_errors']) if options['token_errors'] else None
+            transporte = TransporteFalso(
+                latencia=options['latency'] / 1000,
+                tasa_fallo=options['failure_rate'],
+                tasa_invalidos=options['invalid_rate'],
+                tasa_fallo_lote=options['batch_failure_rate'],
+                errores=errores,
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        informe = simular_difusion(options['tokens'], transporte=transporte, workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{informe['tokens']} tokens en {informe['segundos']}s con {informe['workers']} hilos: "
+            f"{informe['tokens_por_segundo']} tokens/s ({informe['estado']})"
+        ))
+        self.stdout.write(
+            f"  lotes {informe['lotes']} | llamadas a FCM {informe['llamadas']} | éxito {informe['success_count']} | "
+            f"fallo {informe['failure_count']} | desactivados {informe['desactivados']}"
+        )
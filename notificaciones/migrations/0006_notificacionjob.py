@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0005_alter_notificacion_destinatario_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificacionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completado', 'Completado'), ('fallido', 'Fallido')], default='pendiente', max_length=12)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('disponible_en', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Disponible desde')),
+                ('bloqueado_en', models.DateTimeField(blank=True, null=True, verbose_name='Tomado por un worker en')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Fecha de actualización')),
+                ('notificacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='notificaciones.notificacion')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Notificación',
+                'verbose_name_plural': 'Cola de Notificaciones',
+                'ordering': ['disponible_en', 'id'],
+                'indexes': [models.Index(fields=['estado', 'disponible_en'], name='notif_job_estado_disp_idx')],
+            },
+        ),
+    ]
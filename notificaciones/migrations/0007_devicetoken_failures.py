@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0006_notificacionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicetoken',
+            name='failure_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Envíos fallidos'),
+        ),
+        migrations.AddField(
+            model_name='devicetoken',
+            name='last_failure_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último fallo'),
+        ),
+        migrations.AddField(
+            model_name='devicetoken',
+            name='last_failure_reason',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='Motivo del último fallo'),
+        ),
+    ]
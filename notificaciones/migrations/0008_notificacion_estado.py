@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+def estado_desde_leido(apps, schema_editor):
+    """
+    Hasta ahora `leido` marcaba las notificaciones procesadas. Las que no lo están
+    nunca se reintentan (no tienen trabajo en cola): quedan como fallidas, de modo
+    que volver a publicar el evento genere una nueva.
+    """
+    Notificacion = apps.get_model('notificaciones', 'Notificacion')
+    Notificacion.objects.filter(leido=True).update(estado='enviada')
+    Notificacion.objects.filter(leido=False).exclude(
+        jobs__estado__in=['pendiente', 'procesando']
+    ).update(estado='fallida')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0007_devicetoken_failures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacion',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('enviando', 'Enviando'), ('enviada', 'Enviada'), ('parcial', 'Enviada parcialmente'), ('fallida', 'Fallida')], default='pendiente', max_length=10, verbose_name='Estado del envío'),
+        ),
+        migrations.RunPython(estado_desde_leido, migrations.RunPython.noop),
+    ]
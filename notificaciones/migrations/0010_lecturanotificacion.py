@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0009_audiencia'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='notificacion',
+            name='leido',
+        ),
+        migrations.CreateModel(
+            name='LecturaNotificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leida_en', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Leída en')),
+                ('notificacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas', to='notificaciones.notificacion')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas_notificaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lectura de Notificación',
+                'verbose_name_plural': 'Lecturas de Notificaciones',
+                'unique_together': {('user', 'notificacion')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventos', '0011_evento_audiencia'),
+        ('notificaciones', '0010_lecturanotificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['destinatario', 'created_at'], name='notif_dest_created_idx'),
+        ),
+    ]
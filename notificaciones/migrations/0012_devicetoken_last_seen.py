@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:02
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_updated_at(apps, schema_editor):
+    # Sin historial de registros, el último uso conocido es la última actualización del token
+    DeviceToken = apps.get_model('notificaciones', 'DeviceToken')
+    DeviceToken.objects.update(last_seen=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0011_notificacion_destinatario_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicetoken',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Último registro'),
+        ),
+        migrations.RunPython(copiar_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def crear_segmentos(apps, schema_editor):
+    Notificacion = apps.get_model('notificaciones', 'Notificacion')
+    SegmentoNotificacion = apps.get_model('notificaciones', 'SegmentoNotificacion')
+    segmentos = [
+        SegmentoNotificacion(notificacion_id=notificacion_id, tipo=tipo, valor=str(valor))
+        for notificacion_id, audiencia in Notificacion.objects.exclude(audiencia=None).values_list('id', 'audiencia')
+        for tipo, valores in (audiencia or {}).items()
+        for valor in set(valores or [])
+    ]
+    SegmentoNotificacion.objects.bulk_create(segmentos, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificaciones', '0012_devicetoken_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentoNotificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('grupos', 'Grupo'), ('categorias', 'Categoría'), ('device_types', 'Tipo de dispositivo')], max_length=12)),
+                ('valor', models.CharField(max_length=150)),
+                ('notificacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segmentos', to='notificaciones.notificacion')),
+            ],
+            options={
+                'verbose_name': 'Segmento de Audiencia',
+                'verbose_name_plural': 'Segmentos de Audiencia',
+                'unique_together': {('notificacion', 'tipo', 'valor')},
+            },
+        ),
+        migrations.RunPython(crear_segmentos, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from core.models import BaseModelWithAudit
 
 
@@ -8,6 +9,8 @@ class DeviceToken(BaseModelWithAudit):
     Almacena un token de un dispositivo móvil (FCM) para notificaciones push.
     
     Cada token está asociado a un usuario y un tipo de dispositivo (iOS/Android).
+    La app lo vuelve a registrar en cada arranque: `last_seen` guarda el último
+    registro y sirve para podar los tokens que dejaron de usarse.
     """
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -21,6 +24,10 @@ class DeviceToken(BaseModelWithAudit):
         default='android'
     )
     is_active = models.BooleanField(default=True)
+    failure_count = models.PositiveIntegerField(default=0, verbose_name="Envíos fallidos")
+    last_failure_at = models.DateTimeField(null=True, blank=True, verbose_name="Último fallo")
+    last_failure_reason = models.CharField(max_length=50, blank=True, default='', verbose_name="Motivo del último fallo")
+    last_seen = models.DateTimeField(default=timezone.now, verbose_name="Último registro")
 
     class Meta:
         verbose_name = "Token de Dispositivo"
@@ -38,7 +45,22 @@ class Notificacion(BaseModelWithAudit):
     
     Actúa como un historial de las comunicaciones push. Si `destinatario` es
     nulo, se considera una notificación de tipo 'broadcast' (para todos).
+    `estado` sigue el envío: pendiente → enviando → enviada, parcial (quedaron
+    lotes sin entregar y el trabajo se reintenta) o fallida (ningún lote llegó a FCM).
     """
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_ENVIANDO = 'enviando'
+    ESTADO_ENVIADA = 'enviada'
+    ESTADO_PARCIAL = 'parcial'
+    ESTADO_FALLIDA = 'fallida'
+    ESTADO_CHOICES = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_ENVIANDO, 'Enviando'),
+        (ESTADO_ENVIADA, 'Enviada'),
+        (ESTADO_PARCIAL, 'Enviada parcialmente'),
+        (ESTADO_FALLIDA, 'Fallida'),
+    ]
+
     destinatario = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -48,8 +70,11 @@ class Notificacion(BaseModelWithAudit):
     )
     titulo = models.CharField(max_length=255, default='') # Añadido default
     mensaje = models.TextField(default='') # Añadido default para la migración
-    leido = models.BooleanField(default=False)
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default=ESTADO_PENDIENTE, verbose_name="Estado del envío")
     datos = models.JSONField(null=True, blank=True)
+    # Segmentos que reciben el push: {'grupos': [...], 'categorias': [...], 'device_types': [...]};
+    # {} = todos. Si es None se toma del evento al enviar. Se replica en SegmentoNotificacion.
+    audiencia = models.JSONField(null=True, blank=True)
     evento = models.ForeignKey(
         'eventos.Evento',
         on_delete=models.CASCADE,
@@ -61,8 +86,128 @@ class Notificacion(BaseModelWithAudit):
         verbose_name = "Notificación"
         verbose_name_plural = "Notificaciones"
         ordering = ['-created_at']
+        # Historial del usuario: cada rama de la UNION (directas / broadcast) recorre este índice
+        indexes = [models.Index(fields=['destinatario', 'created_at'], name='notif_dest_created_idx')]
 
     def __str__(self):
         if self.destinatario:
             return f"Notificación para {self.destinatario.username}: {self.titulo}"
-        return f"Notificación broadcast: {self.titulo}"
\ No newline at end of file
+        return f"Notificación broadcast: {self.titulo}"
+
+class SegmentoNotificacion(models.Model):
+    """
+    Un valor de la audiencia de una notificación, en filas para filtrar el historial
+    con índices: ('grupos', nombre), ('categorias', id) o ('device_types', tipo).
+
+    Se reescribe a partir de `Notificacion.audiencia` cada vez que esta se guarda.
+    """
+    GRUPOS = 'grupos'
+    CATEGORIAS = 'categorias'
+    DEVICE_TYPES = 'device_types'
+    TIPO_CHOICES = [
+        (GRUPOS, 'Grupo'),
+        (CATEGORIAS, 'Categoría'),
+        (DEVICE_TYPES, 'Tipo de dispositivo'),
+    ]
+
+    notificacion = models.ForeignKey(Notificacion, on_delete=models.CASCADE, related_name='segmentos')
+    tipo = models.CharField(max_length=12, choices=TIPO_CHOICES)
+    valor = models.CharField(max_length=150)
+
+    class Meta:
+        verbose_name = "Segmento de Audiencia"
+        verbose_name_plural = "Segmentos de Audiencia"
+        unique_together = ('notificacion', 'tipo', 'valor')
+
+    def __str__(self):
+        return f"{self.tipo}={self.valor} en la notificación {self.notificacion_id}"
+
+
+class LecturaNotificacion(models.Model):
+    """
+    Marca de lectura de una notificación por un usuario.
+
+    Solo existe una fila cuando el usuario lee la notificación: los broadcasts
+    no generan una fila por usuario al enviarse.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='lecturas_notificaciones'
+    )
+    notificacion = models.ForeignKey(Notificacion, on_delete=models.CASCADE, related_name='lecturas')
+    leida_en = models.DateTimeField(default=timezone.now, verbose_name="Leída en")
+
+    class Meta:
+        verbose_name = "Lectura de Notificación"
+        verbose_name_plural = "Lecturas de Notificaciones"
+        unique_together = ('user', 'notificacion')
+
+    def __str__(self):
+        return f"{self.user_id} leyó la notificación {self.notificacion_id}"
+
+
+class SuscripcionCategoria(BaseModelWithAudit):
+    """
+    Suscripción de un usuario a una categoría de eventos.
+
+    Los eventos marcados como `solo_suscriptores` notifican únicamente a los
+    usuarios suscritos a su categoría.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='suscripciones'
+    )
+    categoria = models.ForeignKey(
+        'eventos.Categoria',
+        on_delete=models.CASCADE,
+        related_name='suscripciones'
+    )
+
+    class Meta:
+        verbose_name = "Suscripción a Categoría"
+        verbose_name_plural = "Suscripciones a Categorías"
+        unique_together = ('categoria', 'user')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user.username} sigue {self.categoria}"
+
+
+class NotificacionJob(models.Model):
+    """
+    Trabajo de envío push pendiente (cola persistente en la base de datos).
+
+    Se crea en la misma transacción que la Notificacion, así que el worker
+    (`python manage.py process_notification_queue`) solo lo ve cuando esa transacción
+    confirma. Los trabajos fallidos se reprograman con `disponible_en`.
+    """
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_PROCESANDO = 'procesando'
+    ESTADO_COMPLETADO = 'completado'
+    ESTADO_FALLIDO = 'fallido'
+    ESTADO_CHOICES = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_PROCESANDO, 'Procesando'),
+        (ESTADO_COMPLETADO, 'Completado'),
+        (ESTADO_FALLIDO, 'Fallido'),
+    ]
+
+    notificacion = models.ForeignKey(Notificacion, on_delete=models.CASCADE, related_name='jobs')
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default=ESTADO_PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    disponible_en = models.DateTimeField(default=timezone.now, verbose_name="Disponible desde")
+    bloqueado_en = models.DateTimeField(null=True, blank=True, verbose_name="Tomado por un worker en")
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Fecha de actualización")
+
+    class Meta:
+        verbose_name = "Trabajo de Notificación"
+        verbose_name_plural = "Cola de Notificaciones"
+        ordering = ['disponible_en', 'id']
+        indexes = [models.Index(fields=['estado', 'disponible_en'], name='notif_job_estado_disp_idx')]
+
+    def __str__(self):
+        return f"Envío de notificación {self.notificacion_id} ({self.estado})"
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Notificacion, DeviceToken
+from .models import Notificacion, DeviceToken, SuscripcionCategoria
 
 class DeviceTokenSerializer(serializers.ModelSerializer):
     """
@@ -7,8 +7,41 @@ class DeviceTokenSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = DeviceToken
-        fields = ['id', 'token', 'device_type']
-        read_only_fields = ['id']
+        fields = ['id', 'token', 'device_type', 'last_seen']
+        read_only_fields = ['id', 'last_seen']
+
+    def get_extra_kwargs(self):
+        """
+        El alta es un upsert que reasigna el token si ya existe (ver `registrar_token`): solo
+        ahí se omite la validación de token único, que rechazaba con 400 cada nuevo registro
+        del mismo dispositivo. Al editar se mantiene y no se puede tomar el token de otro.
+        """
+        extra_kwargs = super().get_extra_kwargs()
+        if self.instance is None:
+            extra_kwargs['token'] = {**extra_kwargs.get('token', {}), 'validators': []}
+        return extra_kwargs
+
+class SuscripcionCategoriaSerializer(serializers.ModelSerializer):
+    """
+    Serializador para las suscripciones del usuario a categorías de eventos.
+    """
+    categoria_nombre = serializers.CharField(source='categoria.nombre', read_only=True)
+
+    class Meta:
+        model = SuscripcionCategoria
+        fields = ['id', 'categoria', 'categoria_nombre', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+def _autor(usuario, request):
+    """Autor del evento con la URL absoluta de su foto de perfil."""
+    if usuario is None:
+        return None
+    foto = usuario.foto_perfil
+    return {
+        'id': usuario.id,
+        'full_name': f"{usuario.first_name} {usuario.last_name}".strip() or usuario.username,
+        'foto_perfil': request.build_absolute_uri(foto.url) if foto and request else None
+    }
 
 class EventoNotificacionSerializer(serializers.ModelSerializer):
     """
@@ -22,13 +55,7 @@ class EventoNotificacionSerializer(serializers.ModelSerializer):
         fields = ['id', 'titulo', 'autor']
     
     def get_autor(self, obj):
-        if hasattr(obj, 'created_by') and obj.created_by:
-            return {
-                'id': obj.created_by.id,
-                'full_name': f"{obj.created_by.first_name} {obj.created_by.last_name}".strip() or obj.created_by.username,
-                'foto_perfil': getattr(obj.created_by, 'foto_perfil', None)
-            }
-        return None
+        return _autor(obj.created_by, self.context.get('request'))
 
 class NotificacionSerializer(serializers.ModelSerializer):
     """
@@ -37,7 +64,7 @@ class NotificacionSerializer(serializers.ModelSerializer):
     """
     evento = EventoNotificacionSerializer(read_only=True)
     fecha_creacion = serializers.DateTimeField(source='created_at', read_only=True)
-    leida = serializers.BooleanField(default=False)
+    leida = serializers.SerializerMethodField()
     tipo = serializers.SerializerMethodField()
 
     class Meta:
@@ -45,6 +72,41 @@ class NotificacionSerializer(serializers.ModelSerializer):
         fields = ['id', 'titulo', 'mensaje', 'fecha_creacion', 'leida', 'tipo', 'evento']
         read_only_fields = ['id', 'titulo', 'mensaje', 'fecha_creacion', 'tipo', 'evento']
     
+    def get_leida(self, obj):
+        """Estado de lectura del usuario actual (anotado por la vista)."""
+        return getattr(obj, 'leida', False)
+
     def get_tipo(self, obj):
         """Determina el tipo de notificación basado en si tiene evento asociado."""
-        return 'evento' if obj.evento else 'general'
\ No newline at end of file
+        return 'evento' if obj.evento else 'general'
+
+class NotificacionFeedSerializer(serializers.BaseSerializer):
+    """
+    Serializador de lectura del historial: mismo formato que NotificacionSerializer,
+    armado directamente sin instanciar campos anidados por fila.
+
+    Espera el evento y su creador cargados con `select_related('evento__created_by')`.
+    """
+    _fecha = serializers.DateTimeField()
+
+    def to_representation(self, obj):
+        evento = obj.evento
+        return {
+            'id': obj.id,
+            'titulo': obj.titulo,
+            'mensaje': obj.mensaje,
+            'fecha_creacion': self._fecha.to_representation(obj.created_at),
+            'leida': getattr(obj, 'leida', False),
+            'tipo': 'evento' if evento else 'general',
+            'evento': {
+                'id': evento.id,
+                'titulo': evento.titulo,
+                'autor': _autor(evento.created_by, self.context.get('request')),
+            } if evento else None,
+        }
+
+class MarcarLeidasSerializer(serializers.Serializer):
+    """
+    Notificaciones a marcar como leídas. Sin `ids` se marcan todas las del usuario.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=500)
@@ -5,103 +5,746 @@ Este archivo contiene la lógica de negocio para el envío de notificaciones pus
 desacoplada de las vistas y modelos.
 """
 import logging
+import random
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
 import firebase_admin
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.contrib.auth.models import Group
+from django.db.models import CharField, Exists, F, OuterRef, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
 from firebase_admin import messaging
-from .models import DeviceToken, Notificacion
+from .models import (
+    DeviceToken, LecturaNotificacion, Notificacion, NotificacionJob, SegmentoNotificacion, SuscripcionCategoria
+)
+from .transports import TransporteFalso, obtener_transporte, usar_transporte
 
 logger = logging.getLogger(__name__)
 
-def send_push_notification(notificacion_id):
+QUEUE_BATCH_SIZE = getattr(settings, 'NOTIFICATIONS_QUEUE_BATCH_SIZE', 10)
+JOB_MAX_ATTEMPTS = getattr(settings, 'NOTIFICATIONS_JOB_MAX_ATTEMPTS', 5)
+JOB_RETRY_DELAY = getattr(settings, 'NOTIFICATIONS_JOB_RETRY_DELAY', 30)
+JOB_RETRY_MAX = getattr(settings, 'NOTIFICATIONS_JOB_RETRY_MAX', 3600)
+# Un trabajo 'procesando' más antiguo que esto se considera abandonado (worker caído) y se retoma.
+JOB_LOCK_TIMEOUT = getattr(settings, 'NOTIFICATIONS_JOB_LOCK_TIMEOUT', 600)
+
+# Límite de tokens por multicast de FCM.
+FCM_MAX_TOKENS = 500
+# Hilos que envían lotes a FCM en paralelo (las llamadas son I/O de red).
+SEND_WORKERS = getattr(settings, 'NOTIFICATIONS_SEND_WORKERS', 4)
+_pool_envio = ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix='fcm-send')
+
+# Motivos de fallo por los que FCM no volverá a aceptar el token.
+MOTIVOS_TOKEN_INVALIDO = ('UNREGISTERED', 'SENDER_ID_MISMATCH', 'INVALID_ARGUMENT')
+TOKEN_UPDATE_CHUNK = 500
+TOKEN_MAX_FAILURES = getattr(settings, 'NOTIFICATIONS_TOKEN_MAX_FAILURES', 10)
+TOKEN_PRUNE_DAYS = getattr(settings, 'NOTIFICATIONS_TOKEN_PRUNE_DAYS', 90)
+# FCM da por caducado un token que no se usa en 270 días; la app lo registra en cada arranque.
+TOKEN_STALE_DAYS = getattr(settings, 'NOTIFICATIONS_TOKEN_STALE_DAYS', 270)
+# Lo que sobrescribe un nuevo registro del token: puede venir de otro usuario (otra sesión
+# en el mismo dispositivo) y vuelve a quedar activo y sin fallos acumulados.
+CAMPOS_REGISTRO_TOKEN = (
+    'user', 'device_type', 'is_active', 'failure_count', 'last_failure_at', 'last_failure_reason',
+    'last_seen', 'updated_by', 'updated_at',
+)
+
+# Contador de no leídas por usuario. Un broadcast nuevo invalida todos los contadores
+# cambiando la versión de las claves; una notificación directa, solo el del destinatario.
+UNREAD_CACHE_TIMEOUT = getattr(settings, 'NOTIFICATIONS_UNREAD_CACHE_TIMEOUT', 60 * 60 * 24)
+# Con una caché propia de cada proceso (LocMem) las invalidaciones hechas en otro worker no
+# llegan: el contador solo se conserva unos segundos.
+UNREAD_LOCAL_CACHE_TIMEOUT = getattr(settings, 'NOTIFICATIONS_UNREAD_LOCAL_CACHE_TIMEOUT', 30)
+UNREAD_CACHE_PREFIX = 'notificaciones:no_leidas'
+UNREAD_VERSION_KEY = f'{UNREAD_CACHE_PREFIX}:version'
+MARK_READ_MAX_IDS = 500
+
+# Columnas que lee el historial (NotificacionFeedSerializer): evento y su creador en el mismo JOIN.
+CAMPOS_HISTORIAL = (
+    'id', 'titulo', 'mensaje', 'created_at', 'evento', 'evento__id', 'evento__titulo', 'evento__created_by',
+    'evento__created_by__id', 'evento__created_by__username', 'evento__created_by__first_name',
+    'evento__created_by__last_name', 'evento__created_by__foto_perfil',
+)
+
+# Motivos transitorios: el lote reintenta esos tokens hasta SEND_MAX_RETRIES veces.
+# 'UNKNOWN' cubre los errores de red que no vienen de FCM.
+MOTIVOS_REINTENTABLES = ('UNAVAILABLE', 'INTERNAL', 'QUOTA_EXCEEDED', 'RESOURCE_EXHAUSTED', 'DEADLINE_EXCEEDED', 'UNKNOWN')
+SEND_MAX_RETRIES = getattr(settings, 'NOTIFICATIONS_SEND_MAX_RETRIES', 3)
+SEND_RETRY_BASE = getattr(settings, 'NOTIFICATIONS_SEND_RETRY_BASE', 1.0)
+SEND_RETRY_MAX = getattr(settings, 'NOTIFICATIONS_SEND_RETRY_MAX', 30.0)
+
+
+def encolar_notificacion(notificacion):
+    """
+    Agrega la notificación a la cola de envío y retorna el trabajo creado.
+
+    Debe llamarse dentro de la transacción que crea la notificación: el worker
+    solo toma el trabajo cuando esa transacción confirma.
+    """
+    return NotificacionJob.objects.create(notificacion=notificacion)
+
+
+def reclamar_trabajos(limite=QUEUE_BATCH_SIZE):
+    """
+    Toma hasta `limite` trabajos disponibles y los marca como 'procesando'.
+
+    Usa `SELECT ... FOR UPDATE SKIP LOCKED`, de modo que varios workers pueden
+    consumir la cola en paralelo sin tomar el mismo trabajo.
+    """
+    ahora = timezone.now()
+    disponibles = (
+        Q(estado=NotificacionJob.ESTADO_PENDIENTE, disponible_en__lte=ahora)
+        | Q(estado=NotificacionJob.ESTADO_PROCESANDO, bloqueado_en__lt=ahora - timedelta(seconds=JOB_LOCK_TIMEOUT))
+    )
+    with transaction.atomic():
+        ids = list(
+            NotificacionJob.objects.select_for_update(skip_locked=True)
+            .filter(disponibles).order_by('disponible_en', 'id').values_list('id', flat=True)[:limite]
+        )
+        NotificacionJob.objects.filter(id__in=ids).update(
+            estado=NotificacionJob.ESTADO_PROCESANDO, bloqueado_en=ahora, intentos=F('intentos') + 1, updated_at=ahora
+        )
+    return list(NotificacionJob.objects.filter(id__in=ids).order_by('disponible_en', 'id'))
+
+
+def procesar_trabajo(job):
+    """
+    Ejecuta el envío de un trabajo ya reclamado.
+
+    Si el envío lanza una excepción, el trabajo se reprograma con espera
+    exponencial y jitter hasta agotar JOB_MAX_ATTEMPTS intentos; luego queda 'fallido'.
+    Mientras envía, el worker renueva `bloqueado_en` en cada lote; si aun así otro worker
+    reclamó el trabajo (el bloqueo venció), este se retira sin tocar el trabajo.
+    """
+    try:
+        _renovar_bloqueo(job)
+        send_push_notification(job.notificacion_id, job=job)
+    except TrabajoReclamadoError as e:
+        logger.warning(str(e))
+        return job
+    except Exception as e:
+        logger.error(f"Error procesando el trabajo de notificación {job.id}: {e}")
+        job.error = str(e)
+        if job.intentos >= JOB_MAX_ATTEMPTS:
+            job.estado = NotificacionJob.ESTADO_FALLIDO
+        else:
+            job.estado = NotificacionJob.ESTADO_PENDIENTE
+            espera = _espera_con_jitter(JOB_RETRY_DELAY, job.intentos - 1, JOB_RETRY_MAX)
+            job.disponible_en = timezone.now() + timedelta(seconds=espera)
+    else:
+        job.estado = NotificacionJob.ESTADO_COMPLETADO
+        job.error = ''
+    # Solo si el trabajo sigue siendo de este worker
+    actualizados = NotificacionJob.objects.filter(pk=job.pk, bloqueado_en=job.bloqueado_en).update(
+        estado=job.estado, error=job.error, disponible_en=job.disponible_en, bloqueado_en=None, updated_at=timezone.now()
+    )
+    if not actualizados:
+        logger.warning(f"El trabajo de notificación {job.id} fue reclamado por otro worker; no se registra este resultado.")
+    job.bloqueado_en = None
+    return job
+
+
+def _renovar_bloqueo(job):
+    """
+    Latido del trabajo: renueva `bloqueado_en` para que no se considere abandonado.
+
+    Raises:
+        TrabajoReclamadoError: Si otro worker ya lo reclamó.
+    """
+    ahora = timezone.now()
+    if not NotificacionJob.objects.filter(pk=job.pk, bloqueado_en=job.bloqueado_en).update(bloqueado_en=ahora, updated_at=ahora):
+        raise TrabajoReclamadoError(f"El trabajo de notificación {job.id} fue reclamado por otro worker.")
+    job.bloqueado_en = ahora
+
+
+def procesar_cola(limite=QUEUE_BATCH_SIZE):
+    """
+    Reclama y procesa un lote de trabajos de la cola.
+
+    Returns:
+        int: Cantidad de trabajos procesados (0 si la cola estaba vacía).
+    """
+    trabajos = reclamar_trabajos(limite)
+    for job in trabajos:
+        procesar_trabajo(job)
+    return len(trabajos)
+
+
+class EnvioIncompletoError(Exception):
+    """Quedaron lotes de tokens sin entregar; el trabajo de la cola debe reintentarse."""
+    pass
+
+
+class TrabajoReclamadoError(Exception):
+    """Otro worker reclamó el trabajo (venció su bloqueo): este debe dejar de enviar."""
+    pass
+
+
+def send_push_notification(notificacion_id, job=None):
     """
-    Envía una notificación push a todos los dispositivos activos vía FCM.
+    Envía una notificación push a los dispositivos activos de su audiencia vía FCM.
+
+    Esta función la ejecuta el worker de la cola cuando un evento se publica.
+    La audiencia (grupos, suscriptores de la categoría, tipo de dispositivo) se
+    guarda en `audiencia`; si la notificación tiene destinatario, solo a sus dispositivos.
+    FCM acepta hasta 500 tokens por multicast: los tokens se leen de la base en
+    lotes de ese tamaño y los lotes se envían en paralelo (NOTIFICATIONS_SEND_WORKERS
+    hilos), acumulando los conteos de éxito y fallo en `datos`.
+
+    Cada lote entregado se registra en `datos['lotes_enviados']` (rango de ids de
+    token) apenas termina: si el trabajo se reintenta, esos tokens se omiten, de
+    modo que un reintento nunca entrega dos veces el mismo lote. Con `job`, cada lote
+    terminado renueva además su bloqueo antes de registrarse.
 
-    Esta función es llamada por una señal cuando un evento se publica.
-    Busca la notificación, obtiene los tokens, construye y envía el mensaje.
-    
     Args:
         notificacion_id (int): El ID del objeto Notificacion a enviar.
+        job (NotificacionJob, opcional): El trabajo de la cola que hace el envío.
+
+    Raises:
+        EnvioIncompletoError: Si algún lote no pudo entregarse tras sus reintentos.
+        TrabajoReclamadoError: Si otro worker reclamó `job` durante el envío.
     """
     try:
-        notificacion = Notificacion.objects.get(id=notificacion_id)
+        notificacion = Notificacion.objects.select_related('evento').get(id=notificacion_id)
     except Notificacion.DoesNotExist:
         logger.error(f"Notificación con id={notificacion_id} no encontrada.")
         return
 
     # Verificar que no se haya enviado ya
-    if notificacion.leido:
+    if notificacion.estado == Notificacion.ESTADO_ENVIADA:
         logger.info(f"Notificación con id={notificacion_id} ya fue procesada.")
         return
 
-    tokens = list(DeviceToken.objects.filter(is_active=True).values_list('token', flat=True))
-    
-    if not tokens:
-        logger.warning('No se encontraron tokens de dispositivo activos.')
-        notificacion.mensaje = 'No se encontraron tokens de dispositivo activos.'
-        notificacion.save()
-        return
+    campos = ['titulo', 'mensaje', 'estado', 'updated_at']
+    # Las notificaciones anteriores a la audiencia guardada al crearlas la fijan en el primer intento
+    if notificacion.audiencia is None:
+        notificacion.audiencia = audiencia_de_evento(notificacion.evento)
+        campos.append('audiencia')
 
     # Preparar el contenido de la notificación
     titulo = notificacion.evento.titulo
     descripcion = notificacion.evento.descripcion[:240]  # Límite recomendado para visibilidad
-    
+
     # Actualizar la notificación con el contenido
     notificacion.titulo = titulo
     notificacion.mensaje = descripcion
-    
-    message = messaging.MulticastMessage(
-        notification=messaging.Notification(
-            title=titulo,
-            body=descripcion
-        ),
-        data={
+    notificacion.estado = Notificacion.ESTADO_ENVIANDO
+    notificacion.save(update_fields=campos)
+
+    contenido = {
+        'notification': messaging.Notification(title=titulo, body=descripcion),
+        'data': {
             'evento_id': str(notificacion.evento.id),
+            # Permite a la app descartar duplicados de la misma notificación
+            'notificacion_id': str(notificacion.id),
             'titulo': titulo,
             'tipo': 'nuevo_evento'
         },
-        tokens=tokens,
+    }
+    datos = {'success_count': 0, 'failure_count': 0, 'total_tokens': 0, 'lotes': 0, 'lotes_enviados': []}
+    datos.update(notificacion.datos or {})
+    datos.pop('error', None)
+    resultado = _enviar_en_lotes(notificacion, contenido, datos, job)
+
+    if resultado['lotes_fallidos']:
+        datos['error'] = resultado['error']
+        entregada = datos['success_count'] > 0
+        notificacion.estado = Notificacion.ESTADO_PARCIAL if entregada else Notificacion.ESTADO_FALLIDA
+    else:
+        notificacion.estado = Notificacion.ESTADO_ENVIADA
+    notificacion.datos = datos
+    notificacion.save(update_fields=['estado', 'datos', 'updated_at'])
+
+    if not datos['total_tokens'] and not resultado['lotes_fallidos']:
+        logger.warning('No se encontraron tokens de dispositivo activos.')
+    else:
+        logger.info(f"Notificaciones enviadas: {datos['success_count']} éxito, {datos['failure_count']} fallo.")
+    if resultado['lotes_fallidos']:
+        raise EnvioIncompletoError(
+            f"{resultado['lotes_fallidos']} lotes sin entregar: {resultado['error']}"
+        )
+
+
+def audiencia_de_evento(evento):
+    """Audiencia del push de un evento: sus grupos destino y, si es solo para suscriptores, su categoría."""
+    audiencia = {}
+    grupos = sorted(evento.grupos_destino.values_list('name', flat=True))
+    if grupos:
+        audiencia['grupos'] = grupos
+    if evento.solo_suscriptores and evento.categoria_id:
+        audiencia['categorias'] = [evento.categoria_id]
+    return audiencia
+
+
+def actualizar_audiencia_pendiente(evento):
+    """
+    Recalcula la audiencia de las notificaciones del evento que aún no se envían.
+
+    Los grupos destino (M2M) se guardan después del post_save que crea la notificación;
+    el evento, sus grupos y el trabajo de envío se confirman en la misma transacción,
+    así que el worker nunca toma el trabajo con la audiencia a medias.
+    """
+    audiencia = audiencia_de_evento(evento)
+    for notificacion in Notificacion.objects.filter(evento=evento, estado=Notificacion.ESTADO_PENDIENTE):
+        if notificacion.audiencia != audiencia:
+            notificacion.audiencia = audiencia
+            # El post_save reescribe los segmentos e invalida los contadores de no leídas
+            notificacion.save(update_fields=['audiencia', 'updated_at'])
+
+
+def guardar_segmentos(notificacion):
+    """Reescribe los SegmentoNotificacion de la notificación a partir de su `audiencia`."""
+    SegmentoNotificacion.objects.filter(notificacion=notificacion).delete()
+    SegmentoNotificacion.objects.bulk_create([
+        SegmentoNotificacion(notificacion=notificacion, tipo=tipo, valor=str(valor))
+        for tipo, valores in (notificacion.audiencia or {}).items()
+        for valor in set(valores or [])
+    ])
+
+
+def tokens_de_audiencia(audiencia=None, destinatario_id=None):
+    """
+    Tokens activos que reciben la notificación, resueltos en una sola consulta.
+
+    Cada segmento de `audiencia` ('grupos' por nombre, 'categorias' suscritas,
+    'device_types') se combina con AND; los grupos y las suscripciones se resuelven
+    con un semi-join (EXISTS) sobre el usuario del token, sin duplicar filas.
+    Sin segmentos (y sin `destinatario_id`) son todos los tokens activos.
+    """
+    audiencia = audiencia or {}
+    tokens = DeviceToken.objects.filter(is_active=True)
+    if destinatario_id:
+        tokens = tokens.filter(user_id=destinatario_id)
+    if audiencia.get('grupos'):
+        tokens = tokens.filter(Exists(Group.objects.filter(user=OuterRef('user_id'), name__in=audiencia['grupos'])))
+    if audiencia.get('categorias'):
+        tokens = tokens.filter(Exists(SuscripcionCategoria.objects.filter(
+            user_id=OuterRef('user_id'), categoria_id__in=audiencia['categorias']
+        )))
+    if audiencia.get('device_types'):
+        tokens = tokens.filter(device_type__in=audiencia['device_types'])
+    return tokens
+
+
+def _lotes_de_tokens(tokens, enviados=(), tamano=FCM_MAX_TOKENS):
+    """
+    Recorre los `tokens` en lotes de `tamano` pares (id, token) sin cargarlos
+    todos en memoria, omitiendo los ids comprendidos en los rangos `enviados`.
+    """
+    rangos = sorted(tuple(rango) for rango in enviados)
+    inicios = [inicio for inicio, _ in rangos]
+
+    def ya_enviado(token_id):
+        posicion = bisect_right(inicios, token_id) - 1
+        return posicion >= 0 and token_id <= rangos[posicion][1]
+
+    tokens = tokens.order_by('id').values_list('id', 'token')
+    iterador = (fila for fila in tokens.iterator(chunk_size=tamano) if not ya_enviado(fila[0]))
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+
+def _espera_con_jitter(base, intento, maximo):
+    """Espera exponencial (base × 2^intento, con tope) con jitter: entre la mitad y el total."""
+    tope = min(maximo, base * 2 ** intento)
+    return tope / 2 + random.uniform(0, tope / 2)
+
+
+def _enviar_lote(transporte, contenido, tokens):
+    """
+    Envía un lote y reintenta, con espera exponencial, los tokens que fallaron por
+    un motivo transitorio (MOTIVOS_REINTENTABLES).
+
+    Returns:
+        messaging.BatchResponse: Una respuesta por token, en el orden de `tokens`.
+    """
+    respuestas = [None] * len(tokens)
+    pendientes = list(range(len(tokens)))
+    for intento in range(SEND_MAX_RETRIES + 1):
+        if intento:
+            time.sleep(_espera_con_jitter(SEND_RETRY_BASE, intento - 1, SEND_RETRY_MAX))
+        mensaje = messaging.MulticastMessage(tokens=[tokens[i] for i in pendientes], **contenido)
+        try:
+            batch_response = transporte.enviar(mensaje)
+        except Exception as e:
+            # Si un intento anterior ya llegó a FCM, el lote se da por enviado con esas respuestas
+            if intento == SEND_MAX_RETRIES or _motivo_fallo(e) not in MOTIVOS_REINTENTABLES:
+                if None in respuestas:
+                    raise
+                break
+            logger.warning(f"Reintentando un lote de {len(pendientes)} tokens: {e}")
+            continue
+        for posicion, response in zip(pendientes, batch_response.responses):
+            respuestas[posicion] = response
+        pendientes = [
+            posicion for posicion in pendientes
+            if not respuestas[posicion].success and _motivo_fallo(respuestas[posicion].exception) in MOTIVOS_REINTENTABLES
+        ]
+        if not pendientes:
+            break
+    return messaging.BatchResponse(respuestas)
+
+
+def _enviar_en_lotes(notificacion, contenido, datos, job=None):
+    """
+    Envía cada lote de tokens pendiente en el pool y acumula las respuestas en `datos`.
+
+    Como mucho 2 × SEND_WORKERS lotes quedan en vuelo, de modo que la lectura de
+    tokens avanza al ritmo del envío. Los tokens fallidos y el progreso se
+    registran en este hilo, tras renovar el bloqueo de `job`.
+    """
+    resultado = {'lotes_fallidos': 0, 'error': None}
+
+    def recoger(terminados):
+        for futuro in terminados:
+            lote = en_vuelo.pop(futuro)
+            try:
+                batch_response = futuro.result()
+            except Exception as e:
+                logger.error(f"Error enviando un lote de {len(lote)} tokens: {e}")
+                resultado['lotes_fallidos'] += 1
+                resultado['error'] = str(e)
+                continue
+            if job is not None:
+                _renovar_bloqueo(job)
+            tokens = [token for _, token in lote]
+            datos['success_count'] += batch_response.success_count
+            datos['failure_count'] += batch_response.failure_count
+            datos['total_tokens'] += len(tokens)
+            datos['lotes'] += 1
+            datos['lotes_enviados'].append([lote[0][0], lote[-1][0]])
+            Notificacion.objects.filter(pk=notificacion.pk).update(datos=datos, updated_at=timezone.now())
+            # Manejar tokens que fallaron para desactivarlos si son inválidos
+            if batch_response.failure_count > 0:
+                _handle_failed_tokens(batch_response, tokens)
+
+    transporte = obtener_transporte()
+    en_vuelo = {}
+    tokens = tokens_de_audiencia(notificacion.audiencia, notificacion.destinatario_id)
+    for lote in _lotes_de_tokens(tokens, datos['lotes_enviados']):
+        if len(en_vuelo) >= SEND_WORKERS * 2:
+            terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            recoger(terminados)
+        en_vuelo[_pool_envio.submit(_enviar_lote, transporte, contenido, [token for _, token in lote])] = lote
+    recoger(list(en_vuelo))
+    return resultado
+
+
+def _motivo_fallo(exception):
+    """Código de error de FCM de un envío fallido."""
+    if isinstance(exception, messaging.UnregisteredError):
+        return 'UNREGISTERED'
+    if isinstance(exception, messaging.SenderIdMismatchError):
+        return 'SENDER_ID_MISMATCH'
+    if isinstance(exception, messaging.QuotaExceededError):
+        return 'QUOTA_EXCEEDED'
+    return getattr(exception, 'code', None) or 'UNKNOWN'
+
+
+def _handle_failed_tokens(batch_response, tokens):
+    """
+    Procesa la respuesta de FCM para registrar los fallos y desactivar tokens inválidos.
+
+    Los tokens se agrupan por motivo y cada grupo se actualiza con un solo UPDATE
+    (`token__in`, en bloques de TOKEN_UPDATE_CHUNK), en lugar de uno por token.
+
+    Returns:
+        int: Cantidad de tokens desactivados.
+    """
+    por_motivo = defaultdict(list)
+    for token, response in zip(tokens, batch_response.responses):
+        if not response.success:
+            por_motivo[_motivo_fallo(getattr(response, 'exception', None))].append(token)
+
+    ahora = timezone.now()
+    desactivados = 0
+    for motivo, fallidos in por_motivo.items():
+        cambios = {
+            'failure_count': F('failure_count') + 1,
+            'last_failure_at': ahora,
+            'last_failure_reason': motivo[:50],
+            'updated_at': ahora,
+        }
+        # Si el token es inválido o no registrado, lo desactivamos
+        if motivo in MOTIVOS_TOKEN_INVALIDO:
+            cambios['is_active'] = False
+            desactivados += len(fallidos)
+        for inicio in range(0, len(fallidos), TOKEN_UPDATE_CHUNK):
+            DeviceToken.objects.filter(token__in=fallidos[inicio:inicio + TOKEN_UPDATE_CHUNK]).update(**cambios)
+
+    total_fallidos = sum(len(fallidos) for fallidos in por_motivo.values())
+    if total_fallidos:
+        logger.warning(f"Fallaron {total_fallidos} tokens de {len(tokens)} totales; {desactivados} desactivados.")
+    return desactivados
+
+
+def registrar_token(user, token, device_type='android'):
+    """
+    Registra el token de un dispositivo para `user` en una sola escritura.
+
+    Es un upsert sobre el token único (INSERT ... ON DUPLICATE KEY UPDATE en MySQL,
+    ON CONFLICT DO UPDATE en SQLite y PostgreSQL): si ya existe, aunque sea de otro
+    usuario, se reasigna, se reactiva y se actualiza `last_seen`. Sin lectura previa,
+    dos arranques simultáneos de la app no chocan con un IntegrityError.
+
+    Returns:
+        DeviceToken: El token registrado, leído de la base tras la escritura (si ya existía,
+        conserva su `created_at` y `created_by`).
+    """
+    instancia = DeviceToken(
+        user=user, token=token, device_type=device_type, is_active=True, failure_count=0,
+        last_failure_at=None, last_failure_reason='', last_seen=timezone.now(),
+        created_by=user, updated_by=user,
     )
+    if not connection.features.supports_update_conflicts:
+        return _registrar_token_sin_upsert(instancia)
+
+    DeviceToken.objects.bulk_create(
+        [instancia],
+        update_conflicts=True,
+        # MySQL no admite indicar la columna del conflicto: la resuelve cualquier índice único
+        unique_fields=['token'] if connection.features.supports_update_conflicts_with_target else None,
+        update_fields=CAMPOS_REGISTRO_TOKEN,
+    )
+    # La instancia en memoria no refleja la fila si ya existía (ni su id en MySQL, sin RETURNING)
+    return DeviceToken.objects.get(token=token)
+
+
+def _registrar_token_sin_upsert(instancia):
+    valores = {campo: getattr(instancia, campo) for campo in CAMPOS_REGISTRO_TOKEN if campo != 'updated_at'}
+    valores['updated_at'] = instancia.last_seen
+    if not DeviceToken.objects.filter(token=instancia.token).update(**valores):
+        try:
+            with transaction.atomic():
+                instancia.save(force_insert=True)
+                return instancia
+        except IntegrityError:
+            # Otro proceso registró el mismo token entre el UPDATE y el INSERT
+            DeviceToken.objects.filter(token=instancia.token).update(**valores)
+    return DeviceToken.objects.get(token=instancia.token)
+
 
+def podar_tokens(max_fallos=TOKEN_MAX_FAILURES, dias_inactivos=TOKEN_PRUNE_DAYS, dias_sin_uso=TOKEN_STALE_DAYS):
+    """
+    Limpia los tokens que ya no reciben notificaciones.
+
+    Desactiva los activos que acumulan `max_fallos` envíos fallidos o que la app no
+    registra hace `dias_sin_uso` días. Elimina los inactivos cuyo último fallo tiene
+    más de `dias_inactivos` días, o que llevan ese tiempo desactivados por falta de uso.
+
+    Returns:
+        dict: Cantidad de tokens desactivados y eliminados.
+    """
+    ahora = timezone.now()
+    desactivados = DeviceToken.objects.filter(is_active=True).filter(
+        Q(failure_count__gte=max_fallos) | Q(last_seen__lt=ahora - timedelta(days=dias_sin_uso))
+    ).update(is_active=False, updated_at=ahora)
+    eliminados, _ = DeviceToken.objects.filter(is_active=False).filter(
+        Q(last_failure_at__lt=ahora - timedelta(days=dias_inactivos))
+        | Q(last_seen__lt=ahora - timedelta(days=dias_sin_uso + dias_inactivos))
+    ).delete()
+    return {'desactivados': desactivados, 'eliminados': eliminados}
+
+
+@contextmanager
+def usar_pool_envio(workers):
+    """Reemplaza temporalmente el pool de envío por uno de `workers` hilos (pruebas de carga)."""
+    global _pool_envio, SEND_WORKERS
+    anterior = (_pool_envio, SEND_WORKERS)
+    _pool_envio = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fcm-send')
+    SEND_WORKERS = workers
     try:
-        batch_response = messaging.send_each_for_multicast(message)
-        logger.info(f"Notificaciones enviadas: {batch_response.success_count} éxito, {batch_response.failure_count} fallo.")
-
-        # Manejar tokens que fallaron para desactivarlos si son inválidos
-        if batch_response.failure_count > 0:
-            _handle_failed_tokens(batch_response, tokens)
-        
-        # Marcar como procesada
-        notificacion.leido = True
-        notificacion.datos = {
-            'success_count': batch_response.success_count,
-            'failure_count': batch_response.failure_count,
-            'total_tokens': len(tokens)
+        yield
+    finally:
+        _pool_envio.shutdown()
+        _pool_envio, SEND_WORKERS = anterior
+
+
+def simular_difusion(cantidad_tokens, transporte=None, workers=SEND_WORKERS):
+    """
+    Envía una notificación a `cantidad_tokens` tokens sintéticos con el pipeline real
+    (lectura en lotes, pool, reintentos, registro de fallos) sobre un TransporteFalso.
+
+    Todo se hace dentro de una transacción revertida: los tokens, el evento y la
+    notificación sintéticos no se conservan.
+
+    Returns:
+        dict: Tokens, lotes, llamadas al transporte, segundos y tokens por segundo.
+    """
+    from eventos.models import Evento
+
+    transporte = transporte or TransporteFalso()
+    with transaction.atomic():
+        usuario = get_user_model().objects.create(username=f'simulacion-push-{time.time_ns()}')
+        DeviceToken.objects.bulk_create(
+            (DeviceToken(user=usuario, token=f'simulado-{i}') for i in range(cantidad_tokens)),
+            batch_size=1000
+        )
+        # Sin publicar: la señal no encola la notificación
+        evento = Evento.objects.create(
+            titulo='Simulación de difusión', descripcion='Notificación sintética.', fecha=timezone.now(), autor=usuario
+        )
+        notificacion = Notificacion.objects.create(evento=evento)
+
+        inicio = time.perf_counter()
+        with usar_transporte(transporte), usar_pool_envio(workers):
+            try:
+                send_push_notification(notificacion.id)
+            except EnvioIncompletoError as e:
+                logger.warning(f"Simulación incompleta: {e}")
+        segundos = time.perf_counter() - inicio
+
+        notificacion.refresh_from_db()
+        informe = {
+            'tokens': cantidad_tokens,
+            'workers': workers,
+            'estado': notificacion.estado,
+            'lotes': notificacion.datos['lotes'],
+            'llamadas': transporte.llamadas,
+            'success_count': notificacion.datos['success_count'],
+            'failure_count': notificacion.datos['failure_count'],
+            'desactivados': DeviceToken.objects.filter(user=usuario, is_active=False).count(),
+            'segundos': round(segundos, 3),
+            'tokens_por_segundo': round(cantidad_tokens / segundos, 1) if segundos else None,
         }
+        transaction.set_rollback(True)
+    return informe
 
-    except Exception as e:
-        logger.error(f"Error crítico al enviar notificaciones push: {e}")
-        notificacion.mensaje = f"Error al enviar: {str(e)}"
-    
-    notificacion.save()
 
-def _handle_failed_tokens(batch_response, tokens):
+def _en_audiencia(user):
     """
-    Procesa la respuesta de FCM para desactivar tokens inválidos.
+    Filtro de los broadcasts cuya audiencia incluye al usuario, con el criterio de
+    `tokens_de_audiencia`: cada tipo de segmento presente debe cumplirse y basta uno
+    de sus valores. Los valores del usuario van como subconsultas (una sola consulta).
+
+    Los contadores de no leídas se invalidan al cambiar los grupos o las suscripciones
+    del usuario; un cambio de sus tokens se refleja cuando expira el contador.
     """
-    responses = batch_response.responses
-    failed_tokens = []
-    
-    for idx, response in enumerate(responses):
-        if not response.success:
-            token = tokens[idx]
-            failed_tokens.append(token)
-            
-            # Si el token es inválido o no registrado, lo desactivamos
-            if hasattr(response, 'exception') and response.exception:
-                error_code = getattr(response.exception, 'code', None)
-                if error_code in ('UNREGISTERED', 'INVALID_ARGUMENT'):
-                    DeviceToken.objects.filter(token=token).update(is_active=False)
-                    logger.info(f"Token desactivado por ser inválido: {token[:20]}...")
-
-    if failed_tokens:
-        logger.warning(f"Fallaron {len(failed_tokens)} tokens de {len(tokens)} totales.")
+    valores_del_usuario = {
+        SegmentoNotificacion.GRUPOS: Group.objects.filter(user=user).values('name'),
+        SegmentoNotificacion.CATEGORIAS: SuscripcionCategoria.objects.filter(user=user).values(
+            valor=Cast('categoria_id', CharField())
+        ),
+        SegmentoNotificacion.DEVICE_TYPES: DeviceToken.objects.filter(user=user, is_active=True).values('device_type'),
+    }
+    filtro = Q()
+    for tipo, valores in valores_del_usuario.items():
+        segmentos = SegmentoNotificacion.objects.filter(notificacion=OuterRef('pk'), tipo=tipo)
+        filtro &= ~Exists(segmentos) | Exists(segmentos.filter(valor__in=valores))
+    return filtro
+
+
+def notificaciones_visibles(user):
+    """Notificaciones del historial del usuario: las dirigidas a él y los broadcasts de su audiencia."""
+    return Notificacion.objects.filter(Q(destinatario=user) | (Q(destinatario__isnull=True) & _en_audiencia(user)))
+
+
+def _ramas_visibles(user):
+    # El OR entre destinatario y broadcast impide usar el índice (destinatario, created_at);
+    # cada rama por separado sí lo usa.
+    return [
+        Notificacion.objects.filter(destinatario=user),
+        Notificacion.objects.filter(_en_audiencia(user), destinatario__isnull=True),
+    ]
+
+
+def pagina_de_notificaciones(user, posicion=None, limite=20):
+    """
+    Página del historial del usuario, de la más reciente a la más antigua, a partir de
+    `posicion` = (created_at, id), con `leida` anotado.
+
+    Es una UNION ALL de las notificaciones directas y los broadcasts (una sola consulta).
+    Donde el motor lo admite (MySQL), cada rama se ordena y limita por su cuenta, así que
+    cada una lee como mucho `limite` filas del índice.
+    """
+    from core.pagination import despues_de
+
+    leidas = LecturaNotificacion.objects.filter(user=user, notificacion=OuterRef('pk'))
+    orden = ('-created_at', '-id')
+    ramas = []
+    for rama in _ramas_visibles(user):
+        rama = rama.filter(despues_de(posicion)).annotate(leida=Exists(leidas)).select_related(
+            'evento__created_by'
+        ).only(*CAMPOS_HISTORIAL)
+        if connection.features.supports_slicing_ordering_in_compound:
+            rama = rama.order_by(*orden)[:limite]
+        else:
+            rama = rama.order_by()
+        ramas.append(rama)
+    return ramas[0].union(*ramas[1:], all=True).order_by(*orden)[:limite]
 
+
+def _clave_no_leidas(user_id):
+    version = cache.get_or_set(UNREAD_VERSION_KEY, 1, None)
+    return f'{UNREAD_CACHE_PREFIX}:{version}:{user_id}'
+
+
+def contar_no_leidas(user):
+    """
+    Cantidad de notificaciones visibles que el usuario no ha leído.
+
+    Se sirve desde la caché; solo tras una invalidación se recalcula con un COUNT.
+    """
+    clave = _clave_no_leidas(user.id)
+    total = cache.get(clave)
+    if total is None:
+        leidas = LecturaNotificacion.objects.filter(user=user, notificacion=OuterRef('pk'))
+        total = sum(rama.filter(~Exists(leidas)).count() for rama in _ramas_visibles(user))
+        cache.set(clave, total, _duracion_no_leidas())
+    return total
+
+
+def _duracion_no_leidas():
+    if isinstance(caches['default'], LocMemCache):
+        return min(UNREAD_CACHE_TIMEOUT, UNREAD_LOCAL_CACHE_TIMEOUT)
+    return UNREAD_CACHE_TIMEOUT
+
+
+def marcar_leidas(user, ids=None):
+    """
+    Marca como leídas las notificaciones `ids` del usuario (todas las visibles si es None).
+
+    Las que no son visibles para el usuario o ya estaban leídas se ignoran. El contador en
+    caché se invalida en lugar de descontarse: con peticiones concurrentes `ignore_conflicts`
+    descarta filas que igual se habrían restado dos veces.
+
+    Returns:
+        int: Cantidad de notificaciones marcadas ahora.
+    """
+    visibles = notificaciones_visibles(user)
+    if ids is not None:
+        visibles = visibles.filter(id__in=ids)
+    leidas = LecturaNotificacion.objects.filter(user=user, notificacion=OuterRef('pk'))
+    nuevas = list(visibles.filter(~Exists(leidas)).values_list('id', flat=True))
+    if not nuevas:
+        return 0
+
+    ahora = timezone.now()
+    LecturaNotificacion.objects.bulk_create(
+        [LecturaNotificacion(user=user, notificacion_id=notificacion_id, leida_en=ahora) for notificacion_id in nuevas],
+        batch_size=MARK_READ_MAX_IDS,
+        ignore_conflicts=True
+    )
+    invalidar_no_leidas(user.id)
+    return len(nuevas)
+
+
+def invalidar_no_leidas(user_id=None):
+    """Invalida el contador de no leídas de un usuario, o el de todos si `user_id` es None."""
+    if user_id is not None:
+        cache.delete(_clave_no_leidas(user_id))
+        return
+    try:
+        cache.incr(UNREAD_VERSION_KEY)
+    except ValueError:
+        cache.set(UNREAD_VERSION_KEY, 2, None)
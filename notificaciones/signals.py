@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Notificacion, SuscripcionCategoria
+from .services import guardar_segmentos, invalidar_no_leidas
+
+
+@receiver(post_save, sender=Notificacion)
+def sincronizar_audiencia(sender, instance, created, update_fields, **kwargs):
+    """
+    Una notificación nueva cambia el contador de no leídas: el de su destinatario o,
+    si es un broadcast, el de todos los usuarios. Lo mismo si cambia su audiencia,
+    que además se replica en sus segmentos.
+    """
+    cambio_audiencia = update_fields is None or 'audiencia' in update_fields
+    if cambio_audiencia:
+        guardar_segmentos(instance)
+    if created or cambio_audiencia:
+        invalidar_no_leidas(instance.destinatario_id)
+
+
+@receiver(post_delete, sender=Notificacion)
+def invalidar_contador_no_leidas(sender, instance, **kwargs):
+    """Una notificación eliminada deja de contar como no leída."""
+    invalidar_no_leidas(instance.destinatario_id)
+
+
+@receiver(post_save, sender=SuscripcionCategoria)
+@receiver(post_delete, sender=SuscripcionCategoria)
+def invalidar_no_leidas_al_suscribir(sender, instance, **kwargs):
+    """Las suscripciones definen qué broadcasts ve el usuario en su historial."""
+    invalidar_no_leidas(instance.user_id)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidar_no_leidas_al_cambiar_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    """Los grupos del usuario definen qué broadcasts ve en su historial."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidar_no_leidas(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidar_no_leidas(user_id)
+    else:
+        # Se vació un grupo: no se sabe a quiénes alcanzaba
+        invalidar_no_leidas()
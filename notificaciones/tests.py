@@ -1,3 +1,655 @@
+"""
+Tests del módulo de notificaciones.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from firebase_admin import exceptions, messaging
+
+from eventos.models import Categoria, Evento
+from .models import DeviceToken, LecturaNotificacion, Notificacion, NotificacionJob, SuscripcionCategoria
+from .services import (
+    FCM_MAX_TOKENS, JOB_MAX_ATTEMPTS, SEND_MAX_RETRIES, EnvioIncompletoError, _handle_failed_tokens, marcar_leidas,
+    procesar_cola, procesar_trabajo, reclamar_trabajos, registrar_token, send_push_notification, tokens_de_audiencia
+)
+from .transports import TransporteFalso, usar_transporte
+
+User = get_user_model()
+
+
+class NotificacionQueueTestCase(TestCase):
+    """Tests para la cola de envío de notificaciones push."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='testpass123')
+
+    def publicar_evento(self, **campos):
+        return Evento.objects.create(
+            titulo='Nuevo horario', descripcion='Cambia el horario de atención.', fecha=timezone.now(),
+            publicado=True, autor=self.user, created_by=self.user, updated_by=self.user, **campos
+        )
+
+    @patch('notificaciones.services.send_push_notification')
+    def test_publicar_encola_sin_enviar(self, mock_send):
+        """Publicar un evento crea la notificación y su trabajo, sin llamar a FCM."""
+        evento = self.publicar_evento()
+
+        job = NotificacionJob.objects.get(notificacion__evento=evento)
+        self.assertEqual(job.estado, NotificacionJob.ESTADO_PENDIENTE)
+        mock_send.assert_not_called()
+
+        # Guardar de nuevo mientras el envío sigue en cola no duplica la notificación
+        evento.save()
+        self.assertEqual(Notificacion.objects.filter(evento=evento).count(), 1)
+
+    @patch('notificaciones.services.send_push_notification')
+    def test_worker_procesa_trabajos(self, mock_send):
+        evento = self.publicar_evento()
+        notificacion = Notificacion.objects.get(evento=evento)
+
+        out = StringIO()
+        call_command('process_notification_queue', '--once', stdout=out)
+
+        mock_send.assert_called_once()
+        self.assertEqual(mock_send.call_args.args, (notificacion.id,))
+        job = NotificacionJob.objects.get(notificacion=notificacion)
+        self.assertEqual(job.estado, NotificacionJob.ESTADO_COMPLETADO)
+        self.assertEqual(job.intentos, 1)
+        self.assertIn('1 trabajos', out.getvalue())
+        self.assertEqual(procesar_cola(), 0)
+
+    @patch('notificaciones.services.send_push_notification', side_effect=RuntimeError('FCM caído'))
+    def test_error_reprograma_hasta_agotar_intentos(self, mock_send):
+        self.publicar_evento()
+
+        self.assertEqual(procesar_cola(), 1)
+        job = NotificacionJob.objects.get()
+        self.assertEqual(job.estado, NotificacionJob.ESTADO_PENDIENTE)
+        self.assertGreater(job.disponible_en, timezone.now())
+        self.assertEqual(job.error, 'FCM caído')
+        # Reprogramado: todavía no está disponible
+        self.assertEqual(procesar_cola(), 0)
+
+        for _ in range(JOB_MAX_ATTEMPTS - 1):
+            NotificacionJob.objects.update(disponible_en=timezone.now())
+            procesar_cola()
+        job.refresh_from_db()
+        self.assertEqual(job.estado, NotificacionJob.ESTADO_FALLIDO)
+        self.assertEqual(job.intentos, JOB_MAX_ATTEMPTS)
+
+    @patch('notificaciones.services.send_push_notification')
+    def test_trabajo_abandonado_se_retoma(self, mock_send):
+        """Un trabajo que quedó 'procesando' por un worker caído se vuelve a tomar."""
+        self.publicar_evento()
+        NotificacionJob.objects.update(
+            estado=NotificacionJob.ESTADO_PROCESANDO, bloqueado_en=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(procesar_cola(), 1)
+        self.assertEqual(NotificacionJob.objects.get().estado, NotificacionJob.ESTADO_COMPLETADO)
+
+    @patch('notificaciones.services.send_push_notification')
+    def test_trabajo_reclamado_por_otro_worker_no_se_pisa(self, mock_send):
+        """Si el bloqueo venció y otro worker tomó el trabajo, este no envía ni registra su resultado."""
+        self.publicar_evento()
+        job, = reclamar_trabajos()
+        otro_bloqueo = timezone.now() + timedelta(seconds=1)
+        NotificacionJob.objects.update(bloqueado_en=otro_bloqueo, intentos=2)
+
+        procesar_trabajo(job)
+
+        mock_send.assert_not_called()
+        reclamado = NotificacionJob.objects.get()
+        self.assertEqual((reclamado.estado, reclamado.bloqueado_en), (NotificacionJob.ESTADO_PROCESANDO, otro_bloqueo))
+
+
+def respuesta_multicast(message):
+    """Respuesta de FCM en la que todos los tokens del lote se entregan."""
+    return messaging.BatchResponse([Mock(success=True, exception=None) for _ in message.tokens])
+
+
+class EnvioPushTestCase(TestCase):
+    """Tests para el envío de notificaciones push en lotes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='testpass123')
+        with patch('notificaciones.services.encolar_notificacion'):
+            self.evento = Evento.objects.create(
+                titulo='Nuevo horario', descripcion='Cambia el horario de atención.', fecha=timezone.now(),
+                publicado=True, autor=self.user
+            )
+        self.notificacion = Notificacion.objects.get(evento=self.evento)
+
+    def crear_tokens(self, cantidad):
+        DeviceToken.objects.bulk_create(
+            DeviceToken(user=self.user, token=f'token-{i}') for i in range(cantidad)
+        )
+
+    @patch('notificaciones.services.messaging.send_each_for_multicast', side_effect=respuesta_multicast)
+    def test_envio_en_lotes_de_500(self, mock_send):
+        self.crear_tokens(2 * FCM_MAX_TOKENS + 1)
+
+        send_push_notification(self.notificacion.id)
+
+        tamanos = sorted(len(llamada.args[0].tokens) for llamada in mock_send.call_args_list)
+        self.assertEqual(tamanos, [1, FCM_MAX_TOKENS, FCM_MAX_TOKENS])
+        self.notificacion.refresh_from_db()
+        self.assertEqual(self.notificacion.estado, Notificacion.ESTADO_ENVIADA)
+        self.assertEqual(self.notificacion.datos['success_count'], 2 * FCM_MAX_TOKENS + 1)
+        self.assertEqual(self.notificacion.datos['lotes'], 3)
+
+    @patch('notificaciones.services.messaging.send_each_for_multicast', side_effect=respuesta_multicast)
+    def test_cada_lote_renueva_el_bloqueo_del_trabajo(self, mock_send):
+        from .services import _renovar_bloqueo
+        self.crear_tokens(2 * FCM_MAX_TOKENS + 1)
+        job = NotificacionJob.objects.create(
+            notificacion=self.notificacion, estado=NotificacionJob.ESTADO_PROCESANDO,
+            bloqueado_en=timezone.now() - timedelta(minutes=9), intentos=1
+        )
+
+        with patch('notificaciones.services._renovar_bloqueo', wraps=_renovar_bloqueo) as latidos:
+            procesar_trabajo(job)
+
+        # Al tomar el trabajo y tras cada uno de los 3 lotes
+        self.assertEqual(latidos.call_count, 4)
+        job.refresh_from_db()
+        self.assertEqual((job.estado, job.bloqueado_en), (NotificacionJob.ESTADO_COMPLETADO, None))
+
+    @patch('notificaciones.services.SEND_RETRY_BASE', 0)
+    def test_reintento_no_reenvia_lotes_entregados(self):
+        """Un lote que no llega a FCM deja la notificación parcial; el reintento solo envía ese lote."""
+        self.crear_tokens(FCM_MAX_TOKENS + 10)
+
+        def enviar(message):
+            if len(message.tokens) == FCM_MAX_TOKENS:
+                raise exceptions.UnavailableError('FCM caído')
+            return respuesta_multicast(message)
+
+        with patch('notificaciones.services.messaging.send_each_for_multicast', side_effect=enviar) as mock_send:
+            with self.assertRaises(EnvioIncompletoError):
+                send_push_notification(self.notificacion.id)
+        self.assertEqual(mock_send.call_count, SEND_MAX_RETRIES + 2)
+        self.notificacion.refresh_from_db()
+        self.assertEqual(self.notificacion.estado, Notificacion.ESTADO_PARCIAL)
+        self.assertEqual(self.notificacion.datos['success_count'], 10)
+
+        with patch('notificaciones.services.messaging.send_each_for_multicast', side_effect=respuesta_multicast) as mock_send:
+            send_push_notification(self.notificacion.id)
+        self.assertEqual([len(llamada.args[0].tokens) for llamada in mock_send.call_args_list], [FCM_MAX_TOKENS])
+        self.notificacion.refresh_from_db()
+        self.assertEqual(self.notificacion.estado, Notificacion.ESTADO_ENVIADA)
+        self.assertEqual(self.notificacion.datos['success_count'], FCM_MAX_TOKENS + 10)
+
+        # Una notificación enviada no se vuelve a enviar
+        with patch('notificaciones.services.messaging.send_each_for_multicast') as mock_send:
+            send_push_notification(self.notificacion.id)
+        mock_send.assert_not_called()
+
+    @patch('notificaciones.services.SEND_RETRY_BASE', 0)
+    def test_tokens_con_error_transitorio_se_reintentan(self):
+        self.crear_tokens(5)
+        primera = messaging.BatchResponse([Mock(success=True, exception=None)] * 3 + [
+            Mock(success=False, exception=exceptions.UnavailableError('no disponible')),
+            Mock(success=False, exception=messaging.UnregisteredError('no registrado')),
+        ])
+
+        with patch('notificaciones.services.messaging.send_each_for_multicast',
+                   side_effect=[primera, respuesta_multicast(Mock(tokens=[None]))]) as mock_send:
+            send_push_notification(self.notificacion.id)
+
+        # Solo el token con error transitorio se reenvía
+        self.assertEqual(mock_send.call_args_list[1].args[0].tokens, ['token-3'])
+        self.notificacion.refresh_from_db()
+        self.assertEqual((self.notificacion.datos['success_count'], self.notificacion.datos['failure_count']), (4, 1))
+        self.assertFalse(DeviceToken.objects.get(token='token-4').is_active)
+
+
+class TokensFallidosTestCase(TestCase):
+    """Tests para el registro de fallos y la poda de tokens de dispositivo."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='movil', password='testpass123')
+        DeviceToken.objects.bulk_create(DeviceToken(user=self.user, token=f'token-{i}') for i in range(6))
+
+    def test_fallos_se_registran_con_un_update_por_motivo(self):
+        tokens = [f'token-{i}' for i in range(6)]
+        responses = [Mock(success=True, exception=None)] * 2 + [
+            Mock(success=False, exception=messaging.UnregisteredError('no registrado')),
+            Mock(success=False, exception=messaging.UnregisteredError('no registrado')),
+            Mock(success=False, exception=messaging.UnregisteredError('no registrado')),
+            Mock(success=False, exception=exceptions.UnavailableError('no disponible')),
+        ]
+
+        with CaptureQueriesContext(connection) as consultas:
+            desactivados = _handle_failed_tokens(Mock(responses=responses), tokens)
+
+        self.assertEqual(desactivados, 3)
+        self.assertEqual(len(consultas), 2)
+        self.assertEqual(DeviceToken.objects.filter(is_active=False, last_failure_reason='UNREGISTERED').count(), 3)
+        transitorio = DeviceToken.objects.get(token='token-5')
+        self.assertTrue(transitorio.is_active)
+        self.assertEqual((transitorio.failure_count, transitorio.last_failure_reason), (1, 'UNAVAILABLE'))
+
+    def test_poda_de_tokens(self):
+        DeviceToken.objects.filter(token='token-0').update(failure_count=10)
+        DeviceToken.objects.filter(token='token-1').update(
+            is_active=False, last_failure_at=timezone.now() - timedelta(days=120)
+        )
+
+        out = StringIO()
+        call_command('prune_device_tokens', '--max-failures', '10', '--days', '90', stdout=out)
+
+        self.assertIn('1 tokens desactivados, 1 eliminados', out.getvalue())
+        self.assertFalse(DeviceToken.objects.get(token='token-0').is_active)
+        self.assertFalse(DeviceToken.objects.filter(token='token-1').exists())
+
+
+class TransporteFalsoTestCase(TestCase):
+    """Tests para el FCM simulado y la simulación de difusión."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='testpass123')
+        with patch('notificaciones.services.encolar_notificacion'):
+            evento = Evento.objects.create(
+                titulo='Nuevo horario', descripcion='Cambia el horario de atención.', fecha=timezone.now(),
+                publicado=True, autor=self.user
+            )
+        self.notificacion = Notificacion.objects.get(evento=evento)
+
+    def test_envio_con_transporte_falso(self):
+        DeviceToken.objects.bulk_create(DeviceToken(user=self.user, token=f'token-{i}') for i in range(4))
+        transporte = TransporteFalso(latencia=0, errores={'token-1': 'UNREGISTERED', 'token-2': 'SENDER_ID_MISMATCH'})
+
+        with usar_transporte(transporte):
+            send_push_notification(self.notificacion.id)
+
+        self.notificacion.refresh_from_db()
+        self.assertEqual((self.notificacion.datos['success_count'], self.notificacion.datos['failure_count']), (2, 2))
+        self.assertEqual(transporte.llamadas, 1)
+        self.assertEqual(
+            dict(DeviceToken.objects.filter(is_active=False).values_list('token', 'last_failure_reason')),
+            {'token-1': 'UNREGISTERED', 'token-2': 'SENDER_ID_MISMATCH'}
+        )
+
+    def test_codigo_desconocido(self):
+        with self.assertRaises(ValueError):
+            TransporteFalso(errores={'token-1': 'NO_EXISTE'})
+
+    def test_comando_simula_difusion(self):
+        out = StringIO()
+        call_command(
+            'simulate_push_broadcast', '--tokens', '1200', '--latency', '0', '--invalid-rate', '0.1', stdout=out
+        )
+
+        salida = out.getvalue()
+        self.assertIn('1200 tokens', salida)
+        self.assertIn('lotes 3 | llamadas a FCM 3', salida)
+        # La simulación se revierte: no quedan tokens sintéticos
+        self.assertFalse(DeviceToken.objects.filter(token__startswith='simulado-').exists())
+
+
+class AudienciaTestCase(TestCase):
+    """Tests para la segmentación de notificaciones por grupo, categoría y dispositivo."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123')
+        self.trabajador = User.objects.create_user(username='trabajador', password='testpass123')
+        self.otro = User.objects.create_user(username='otro', password='testpass123')
+        self.admin.groups.add(Group.objects.get(name='Admin'))
+        self.trabajador.groups.add(Group.objects.get(name='Trabajador'), Group.objects.get(name='QA'))
+        self.categoria = Categoria.objects.create(nombre='Reconocimientos')
+        SuscripcionCategoria.objects.create(user=self.otro, categoria=self.categoria)
+        SuscripcionCategoria.objects.create(user=self.trabajador, categoria=self.categoria)
+        for usuario, device_type in ((self.admin, 'android'), (self.trabajador, 'ios'), (self.otro, 'android')):
+            DeviceToken.objects.create(user=usuario, token=f'token-{usuario.username}', device_type=device_type)
+
+    def destinos(self, **kwargs):
+        return set(tokens_de_audiencia(**kwargs).values_list('token', flat=True))
+
+    def test_segmentos(self):
+        self.assertEqual(len(self.destinos()), 3)
+        # Un usuario en varios grupos de la audiencia recibe una sola vez
+        self.assertEqual(self.destinos(audiencia={'grupos': ['Trabajador', 'QA']}), {'token-trabajador'})
+        self.assertEqual(self.destinos(audiencia={'categorias': [self.categoria.id]}), {'token-trabajador', 'token-otro'})
+        self.assertEqual(
+            self.destinos(audiencia={'categorias': [self.categoria.id], 'device_types': ['android']}), {'token-otro'}
+        )
+        self.assertEqual(self.destinos(destinatario_id=self.admin.id), {'token-admin'})
+
+    def test_una_sola_consulta(self):
+        with CaptureQueriesContext(connection) as consultas:
+            list(tokens_de_audiencia({'grupos': ['Trabajador'], 'categorias': [self.categoria.id]}).values_list('token'))
+        self.assertEqual(len(consultas), 1)
+
+    def test_evento_notifica_solo_a_su_audiencia(self):
+        with patch('notificaciones.services.encolar_notificacion'):
+            evento = Evento.objects.create(
+                titulo='Premio anual', descripcion='Reconocimientos del año.', fecha=timezone.now(),
+                publicado=True, autor=self.admin, categoria=self.categoria, solo_suscriptores=True
+            )
+        # Los grupos se asignan después del post_save, como en el admin y la API
+        evento.grupos_destino.add(Group.objects.get(name='Trabajador'))
+        notificacion = Notificacion.objects.get(evento=evento)
+        transporte = TransporteFalso(latencia=0)
+
+        with usar_transporte(transporte):
+            send_push_notification(notificacion.id)
+
+        notificacion.refresh_from_db()
+        self.assertEqual(notificacion.audiencia, {'grupos': ['Trabajador'], 'categorias': [self.categoria.id]})
+        self.assertEqual(transporte.tokens_recibidos, 1)
+        self.assertEqual(notificacion.datos['success_count'], 1)
+
+    def test_evento_creado_por_la_api_con_grupos(self):
+        self.client.force_login(self.admin)
+
+        respuesta = self.client.post('/api/eventos/', {
+            'titulo': 'Charla de seguridad', 'descripcion': 'Obligatoria para planta.', 'fecha': timezone.now(),
+            'publicado': True, 'grupos_destino': ['Trabajador'],
+        }, content_type='application/json')
+
+        self.assertEqual(respuesta.status_code, 201)
+        # La audiencia ya incluye los grupos antes de que el worker tome el trabajo
+        notificacion = Notificacion.objects.get(evento_id=respuesta.json()['id'])
+        self.assertEqual(notificacion.audiencia, {'grupos': ['Trabajador']})
+
+        transporte = TransporteFalso(latencia=0)
+        with usar_transporte(transporte):
+            self.assertEqual(procesar_cola(), 1)
+        self.assertEqual(transporte.tokens_recibidos, 1)
+
+    def test_historial_solo_muestra_su_audiencia(self):
+        for titulo, audiencia in (
+            ('Para todos', {}),
+            ('Para trabajadores', {'grupos': ['Trabajador']}),
+            ('Para suscriptores', {'categorias': [self.categoria.id]}),
+            ('Para iOS', {'device_types': ['ios']}),
+        ):
+            Notificacion.objects.create(titulo=titulo, audiencia=audiencia)
+
+        def historial(usuario):
+            self.client.force_login(usuario)
+            titulos = {n['titulo'] for n in self.client.get('/api/notifications/').json()['results']}
+            self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], len(titulos))
+            return titulos
+
+        self.assertEqual(historial(self.admin), {'Para todos'})
+        self.assertEqual(historial(self.otro), {'Para todos', 'Para suscriptores'})
+        self.assertEqual(len(historial(self.trabajador)), 4)
+
+        # Cambiar los grupos del usuario invalida su contador
+        self.otro.groups.add(Group.objects.get(name='Trabajador'))
+        self.assertEqual(historial(self.otro), {'Para todos', 'Para suscriptores', 'Para trabajadores'})
+
+    def test_api_suscripciones(self):
+        self.client.force_login(self.admin)
+
+        respuesta = self.client.post('/api/category-subscriptions/', {'categoria': self.categoria.id})
+        self.assertEqual(respuesta.status_code, 201)
+        # Suscribirse otra vez no duplica
+        self.client.post('/api/category-subscriptions/', {'categoria': self.categoria.id})
+        self.assertEqual(SuscripcionCategoria.objects.filter(user=self.admin).count(), 1)
+
+        respuesta = self.client.get('/api/category-subscriptions/')
+        self.assertEqual([s['categoria_nombre'] for s in respuesta.json()], ['Reconocimientos'])
+
+
+class LecturaNotificacionesTestCase(TestCase):
+    """Tests para el estado de lectura por usuario y el contador de no leídas."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='lector', password='testpass123')
+        self.otro = User.objects.create_user(username='otro', password='testpass123')
+        self.broadcasts = [Notificacion.objects.create(titulo=f'Aviso {i}') for i in range(3)]
+        self.directa = Notificacion.objects.create(titulo='Solo para ti', destinatario=self.user)
+        self.ajena = Notificacion.objects.create(titulo='Para otro', destinatario=self.otro)
+        self.client.force_login(self.user)
+
+    def test_contador_desde_cache(self):
+        respuesta = self.client.get('/api/notifications/unread-count/')
+        self.assertEqual(respuesta.json(), {'unread': 4})
+
+        # Segunda consulta: solo la sesión y el usuario, ningún COUNT
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get('/api/notifications/unread-count/')
+        self.assertEqual(respuesta.json(), {'unread': 4})
+        self.assertFalse([q for q in consultas.captured_queries if 'COUNT' in q['sql'].upper()])
+
+    def test_contador_dura_poco_con_cache_por_proceso(self):
+        """Con LocMem otro worker no ve las invalidaciones: el contador caduca en segundos."""
+        from django.test import override_settings
+        from .services import UNREAD_CACHE_TIMEOUT, UNREAD_LOCAL_CACHE_TIMEOUT, _duracion_no_leidas
+        self.assertEqual(_duracion_no_leidas(), UNREAD_LOCAL_CACHE_TIMEOUT)
+        compartida = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache_compartida'}}
+        with override_settings(CACHES=compartida):
+            self.assertEqual(_duracion_no_leidas(), UNREAD_CACHE_TIMEOUT)
+
+    def test_marcar_leidas(self):
+        self.client.get('/api/notifications/unread-count/')
+
+        respuesta = self.client.post(
+            '/api/notifications/mark-read/', {'ids': [self.broadcasts[0].id, self.ajena.id]}, content_type='application/json'
+        )
+        # La notificación de otro usuario se ignora
+        self.assertEqual(respuesta.json(), {'marked': 1, 'unread': 3})
+        # Marcar otra vez no cambia nada
+        respuesta = self.client.post(
+            '/api/notifications/mark-read/', {'ids': [self.broadcasts[0].id]}, content_type='application/json'
+        )
+        self.assertEqual(respuesta.json(), {'marked': 0, 'unread': 3})
+
+        leidas = {n['id']: n['leida'] for n in self.client.get('/api/notifications/').json()['results']}
+        self.assertTrue(leidas[self.broadcasts[0].id])
+        self.assertFalse(leidas[self.directa.id])
+        # Las lecturas son por usuario
+        self.assertFalse(LecturaNotificacion.objects.filter(user=self.otro).exists())
+
+        respuesta = self.client.post('/api/notifications/mark-read/', {}, content_type='application/json')
+        self.assertEqual(respuesta.json(), {'marked': 3, 'unread': 0})
+
+    def test_marcar_leidas_concurrente_no_descuadra_el_contador(self):
+        from unittest.mock import patch
+        self.client.get('/api/notifications/unread-count/')
+        bulk_create = LecturaNotificacion.objects.bulk_create
+
+        otra_peticion = []
+
+        def con_otra_peticion(lecturas, **kwargs):
+            # Otra petición marca la misma notificación entre la consulta y la inserción
+            if not otra_peticion:
+                otra_peticion.append(True)
+                marcar_leidas(self.user, [self.broadcasts[0].id])
+            return bulk_create(lecturas, **kwargs)
+
+        with patch.object(LecturaNotificacion.objects, 'bulk_create', side_effect=con_otra_peticion):
+            self.client.post('/api/notifications/mark-read/', {'ids': [self.broadcasts[0].id]}, content_type='application/json')
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], 3)
+
+    def test_notificaciones_nuevas_invalidan_el_contador(self):
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], 4)
+
+        Notificacion.objects.create(titulo='Otro aviso')
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], 5)
+        Notificacion.objects.create(titulo='Directa nueva', destinatario=self.user)
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], 6)
+        self.broadcasts[0].delete()
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json()['unread'], 5)
+
+
+class HistorialPaginadoTestCase(TestCase):
+    """Tests para la paginación por cursor del historial de notificaciones."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lector', password='testpass123')
+        self.otro = User.objects.create_user(username='otro', password='testpass123')
+        for i in range(15):
+            Notificacion.objects.create(titulo=f'Broadcast {i}')
+            if i % 2:
+                Notificacion.objects.create(titulo=f'Directa {i}', destinatario=self.user)
+        Notificacion.objects.create(titulo='Ajena', destinatario=self.otro)
+        # Varias notificaciones con la misma fecha: el id desempata
+        Notificacion.objects.filter(titulo__in=['Broadcast 3', 'Broadcast 4', 'Directa 3']).update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+        self.client.force_login(self.user)
+
+    def test_recorrer_paginas(self):
+        esperadas = list(
+            Notificacion.objects.exclude(destinatario=self.otro).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        vistas, url, paginas = [], '/api/notifications/?page_size=5', 0
+        while url:
+            datos = self.client.get(url).json()
+            vistas += [n['id'] for n in datos['results']]
+            url, paginas = datos['next'], paginas + 1
+
+        self.assertEqual(vistas, esperadas)
+        self.assertEqual(paginas, 5)
+
+    def test_pagina_en_una_consulta(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get('/api/notifications/?page_size=10')
+        self.assertEqual(len(respuesta.json()['results']), 10)
+        tabla = 'notificaciones_notificacion'
+        self.assertEqual(len([q for q in consultas.captured_queries if tabla in q['sql']]), 1)
+        self.assertIn('UNION', next(q['sql'] for q in consultas.captured_queries if tabla in q['sql']))
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get('/api/notifications/?cursor=no-es-un-cursor').status_code, 404)
+
+
+class HistorialSinNMasUnoTestCase(TestCase):
+    """Tests para la carga del autor del evento en el historial."""
+
+    def setUp(self):
+        self.lector = User.objects.create_user(username='lector', password='testpass123')
+        for i in range(50):
+            autor = User.objects.create_user(
+                username=f'autor{i}', first_name='Autor', last_name=str(i), foto_perfil=f'fotos_perfil/autor{i}.png'
+            )
+            with patch('notificaciones.services.encolar_notificacion'):
+                Evento.objects.create(
+                    titulo=f'Evento {i}', descripcion='Descripción.', fecha=timezone.now(), publicado=True,
+                    autor=autor, created_by=autor, updated_by=autor
+                )
+        self.client.force_login(self.lector)
+
+    def test_listar_50_en_una_consulta(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get('/api/notifications/?page_size=50')
+
+        resultados = respuesta.json()['results']
+        self.assertEqual(len(resultados), 50)
+        self.assertEqual(len([q for q in consultas.captured_queries if 'notificaciones_notificacion' in q['sql']]), 1)
+        # Sin consultas por autor: sesión, usuario de la petición y la página
+        self.assertEqual(len(consultas), 3)
+
+        autor = resultados[0]['evento']['autor']
+        self.assertEqual(autor['full_name'], 'Autor 49')
+        self.assertEqual(autor['foto_perfil'], 'http://testserver/media/fotos_perfil/autor49.png')
+
+    def test_detalle_con_el_mismo_formato(self):
+        notificacion = Notificacion.objects.order_by('-id').first()
+        respuesta = self.client.get(f'/api/notifications/{notificacion.id}/').json()
+
+        self.assertEqual(
+            set(respuesta), {'id', 'titulo', 'mensaje', 'fecha_creacion', 'leida', 'tipo', 'evento'}
+        )
+        self.assertEqual(respuesta['tipo'], 'evento')
+        self.assertFalse(respuesta['leida'])
+        self.assertEqual(respuesta['evento']['autor']['id'], notificacion.evento.created_by_id)
+
+
+class RegistroTokenTestCase(TestCase):
+    """Tests para el alta de tokens de dispositivo (upsert en POST api/fcm-token/)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='movil', password='testpass123')
+        self.otro = User.objects.create_user(username='otro', password='testpass123')
+        self.client.force_login(self.user)
+
+    def registrar(self, token='token-app', device_type='ios'):
+        return self.client.post('/api/fcm-token/', {'token': token, 'device_type': device_type})
+
+    def test_alta_en_una_escritura(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.registrar()
+
+        self.assertEqual(respuesta.status_code, 201)
+        escrituras = [
+            q for q in consultas.captured_queries
+            if 'notificaciones_devicetoken' in q['sql'] and not q['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(len(escrituras), 1)
+        self.assertTrue(escrituras[0]['sql'].startswith('INSERT'))
+        token = DeviceToken.objects.get(token='token-app')
+        self.assertEqual(respuesta.json()['id'], token.id)
+        self.assertEqual((token.user, token.device_type, token.created_by), (self.user, 'ios', self.user))
+
+    def test_nuevo_registro_reactiva_y_limpia_fallos(self):
+        self.registrar()
+        hace_un_mes = timezone.now() - timedelta(days=30)
+        DeviceToken.objects.filter(token='token-app').update(
+            is_active=False, failure_count=4, last_failure_reason='UNREGISTERED', last_seen=hace_un_mes
+        )
+
+        respuesta = self.registrar(device_type='android')
+
+        self.assertEqual(respuesta.status_code, 201)
+        token = DeviceToken.objects.get(token='token-app')
+        self.assertEqual(respuesta.json()['id'], token.id)
+        self.assertTrue(token.is_active)
+        self.assertEqual((token.failure_count, token.last_failure_reason, token.device_type), (0, '', 'android'))
+        self.assertGreater(token.last_seen, hace_un_mes)
+        self.assertEqual(DeviceToken.objects.count(), 1)
+
+    def test_token_de_otro_usuario_se_reasigna(self):
+        original = DeviceToken.objects.create(user=self.otro, token='token-app', created_by=self.otro)
+
+        registrado = registrar_token(self.user, 'token-app')
+        self.assertEqual((registrado.pk, registrado.created_at), (original.pk, original.created_at))
+        self.assertEqual((registrado.user, registrado.created_by), (self.user, self.otro))
+
+        self.registrar()
+
+        token = DeviceToken.objects.get(token='token-app')
+        self.assertEqual(token.pk, original.pk)
+        self.assertEqual((token.user, token.updated_by, token.created_by), (self.user, self.user, self.otro))
+
+    def test_editar_no_toma_el_token_de_otro(self):
+        DeviceToken.objects.create(user=self.otro, token='token-ajeno')
+        propio = DeviceToken.objects.create(user=self.user, token='token-propio')
+
+        respuesta = self.client.patch(
+            f'/api/fcm-token/{propio.id}/', {'token': 'token-ajeno'}, content_type='application/json'
+        )
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('token', respuesta.json())
+        self.assertEqual(DeviceToken.objects.get(token='token-ajeno').user, self.otro)
+
+    def test_poda_de_tokens_sin_uso(self):
+        DeviceToken.objects.create(user=self.user, token='token-viejo', last_seen=timezone.now() - timedelta(days=300))
+        DeviceToken.objects.create(user=self.user, token='token-reciente')
+        DeviceToken.objects.create(
+            user=self.user, token='token-abandonado', is_active=False, last_seen=timezone.now() - timedelta(days=400)
+        )
+
+        out = StringIO()
+        call_command('prune_device_tokens', '--stale-days', '270', stdout=out)
 
-# Create your tests here.
+        self.assertIn('1 tokens desactivados, 1 eliminados', out.getvalue())
+        self.assertFalse(DeviceToken.objects.get(token='token-viejo').is_active)
+        self.assertFalse(DeviceToken.objects.filter(token='token-abandonado').exists())
+        self.assertTrue(DeviceToken.objects.get(token='token-reciente').is_active)
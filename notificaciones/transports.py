@@ -0,0 +1,136 @@
+"""
+Transportes de notificaciones push.
+
+El servicio de envío entrega cada lote a un transporte: FCM en producción, o un FCM
+simulado en proceso para pruebas de carga sin salir a la red. Se elige con
+NOTIFICATIONS_PUSH_TRANSPORT ('fcm' o 'fake'); ambos reciben un
+`messaging.MulticastMessage` y devuelven un `messaging.BatchResponse`.
+"""
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from firebase_admin import exceptions, messaging
+
+
+class TransportePush:
+    """Interfaz de los transportes: envía un multicast y devuelve una respuesta por token."""
+
+    nombre = None
+
+    def enviar(self, mensaje):
+        raise NotImplementedError
+
+
+class TransporteFCM(TransportePush):
+    """Envío real a través de Firebase Cloud Messaging."""
+
+    nombre = 'fcm'
+
+    def enviar(self, mensaje):
+        return messaging.send_each_for_multicast(mensaje)
+
+
+# Excepción de firebase_admin que corresponde a cada código de error simulado.
+ERRORES_SIMULADOS = {
+    'UNREGISTERED': messaging.UnregisteredError,
+    'SENDER_ID_MISMATCH': messaging.SenderIdMismatchError,
+    'QUOTA_EXCEEDED': messaging.QuotaExceededError,
+    'INVALID_ARGUMENT': exceptions.InvalidArgumentError,
+    'UNAVAILABLE': exceptions.UnavailableError,
+    'INTERNAL': exceptions.InternalError,
+}
+
+
+class TransporteFalso(TransportePush):
+    """
+    FCM simulado para pruebas de carga del pipeline de notificaciones.
+
+    Cada llamada tarda `latencia` segundos; cada token falla con probabilidad
+    `tasa_invalidos` (UNREGISTERED) o `tasa_fallo` (UNAVAILABLE, transitorio), y
+    `errores` fija el código de tokens concretos. Con probabilidad `tasa_fallo_lote`
+    la llamada completa lanza UnavailableError. Cuenta llamadas y tokens recibidos.
+    """
+
+    nombre = 'fake'
+
+    def __init__(self, latencia=0.05, tasa_fallo=0.0, tasa_invalidos=0.0, tasa_fallo_lote=0.0,
+                 errores=None, seed=None):
+        desconocidos = set((errores or {}).values()) - set(ERRORES_SIMULADOS)
+        if desconocidos:
+            raise ValueError(f"Códigos de error desconocidos: {', '.join(sorted(desconocidos))}")
+        self.latencia = latencia
+        self.tasa_fallo = tasa_fallo
+        self.tasa_invalidos = tasa_invalidos
+        self.tasa_fallo_lote = tasa_fallo_lote
+        self.errores = dict(errores or {})
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.llamadas = 0
+        self.tokens_recibidos = 0
+
+    def enviar(self, mensaje):
+        with self._lock:
+            self.llamadas += 1
+            self.tokens_recibidos += len(mensaje.tokens)
+            azar_lote = self._random.random()
+            azares = [self._random.random() for _ in mensaje.tokens]
+        if self.latencia:
+            time.sleep(self.latencia)
+        if azar_lote < self.tasa_fallo_lote:
+            raise exceptions.UnavailableError('Fallo simulado del lote')
+
+        respuestas = []
+        for token, azar in zip(mensaje.tokens, azares):
+            codigo = self.errores.get(token)
+            if codigo is None and azar < self.tasa_invalidos:
+                codigo = 'UNREGISTERED'
+            elif codigo is None and azar < self.tasa_invalidos + self.tasa_fallo:
+                codigo = 'UNAVAILABLE'
+            if codigo:
+                respuestas.append(messaging.SendResponse(None, ERRORES_SIMULADOS[codigo](f'Error simulado: {codigo}')))
+            else:
+                respuestas.append(messaging.SendResponse({'name': f'projects/fake/messages/{next(self._ids)}'}, None))
+        return messaging.BatchResponse(respuestas)
+
+
+def _crear_transporte():
+    nombre = getattr(settings, 'NOTIFICATIONS_PUSH_TRANSPORT', 'fcm')
+    if nombre == 'fcm':
+        return TransporteFCM()
+    if nombre == 'fake':
+        return TransporteFalso(
+            latencia=getattr(settings, 'NOTIFICATIONS_FAKE_LATENCY', 0.05),
+            tasa_fallo=getattr(settings, 'NOTIFICATIONS_FAKE_FAILURE_RATE', 0.0),
+            tasa_invalidos=getattr(settings, 'NOTIFICATIONS_FAKE_INVALID_RATE', 0.0),
+            tasa_fallo_lote=getattr(settings, 'NOTIFICATIONS_FAKE_BATCH_FAILURE_RATE', 0.0),
+            errores=getattr(settings, 'NOTIFICATIONS_FAKE_TOKEN_ERRORS', None),
+        )
+    raise ValueError(f"NOTIFICATIONS_PUSH_TRANSPORT desconocido: {nombre}")
+
+
+_transporte = None
+
+
+def obtener_transporte():
+    """Transporte configurado en NOTIFICATIONS_PUSH_TRANSPORT (uno por proceso)."""
+    global _transporte
+    if _transporte is None:
+        _transporte = _crear_transporte()
+    return _transporte
+
+
+@contextmanager
+def usar_transporte(transporte):
+    """Reemplaza temporalmente el transporte de envío (p. ej. por un TransporteFalso)."""
+    global _transporte
+    anterior = _transporte
+    _transporte = transporte
+    try:
+        yield transporte
+    finally:
+        _transporte = anterior
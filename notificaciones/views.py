@@ -1,9 +1,19 @@
 from django.db import models
 from rest_framework import viewsets, permissions
-from drf_spectacular.utils import extend_schema
-
-from .models import Notificacion, DeviceToken
-from .serializers import NotificacionSerializer, DeviceTokenSerializer
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from drf_spectacular.utils import extend_schema, OpenApiTypes
+
+from .models import DeviceToken, LecturaNotificacion, SuscripcionCategoria
+from .serializers import (
+    NotificacionSerializer, NotificacionFeedSerializer, DeviceTokenSerializer, MarcarLeidasSerializer,
+    SuscripcionCategoriaSerializer
+)
+from .services import (
+    CAMPOS_HISTORIAL, contar_no_leidas, marcar_leidas, notificaciones_visibles, pagina_de_notificaciones,
+    registrar_token
+)
+from core.pagination import KeysetPagination
 from core.permissions import IsOwner
 from core.viewsets import AuditModelViewSet
 
@@ -26,30 +36,15 @@ class DeviceTokenViewSet(AuditModelViewSet):
         """
         Registra un token para el usuario actual.
 
-        Si el token ya existe para el usuario, lo reactiva.
-        Si no existe, lo crea. Esto previene duplicados.
+        Si el token ya existe lo reactiva, y si pertenecía a otro usuario (otra
+        sesión en el mismo dispositivo) lo reasigna. Es una sola escritura (upsert),
+        segura ante registros simultáneos del mismo token.
         """
-        token = serializer.validated_data.get('token')
-        device_type = serializer.validated_data.get('device_type')
-        
-        # Usar get_or_create para manejar tokens existentes.
-        instance, created = DeviceToken.objects.get_or_create(
-            user=self.request.user, 
-            token=token,
-            defaults={
-                'device_type': device_type, 
-                'created_by': self.request.user,
-                'updated_by': self.request.user
-            }
+        serializer.instance = registrar_token(
+            self.request.user,
+            serializer.validated_data['token'],
+            serializer.validated_data.get('device_type', 'android')
         )
-        
-        # Si el token ya existía pero estaba inactivo, se reactiva.
-        if not created and not instance.is_active:
-            instance.is_active = True
-            instance.updated_by = self.request.user
-            instance.save(update_fields=['is_active', 'updated_by'])
-
-        serializer.instance = instance
 
     def get_permissions(self):
         """
@@ -94,34 +89,102 @@ class DeviceTokenViewSet(AuditModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
+@extend_schema(tags=['Notificaciones'])
+class SuscripcionCategoriaViewSet(AuditModelViewSet):
+    """
+    Gestiona las suscripciones del usuario a categorías de eventos.
+
+    Los eventos marcados como 'solo suscriptores' notifican únicamente a los
+    usuarios suscritos a su categoría.
+    """
+    serializer_class = SuscripcionCategoriaSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        """Filtra las suscripciones para devolver solo las del usuario autenticado."""
+        return SuscripcionCategoria.objects.filter(user=self.request.user).select_related('categoria')
+
+    def perform_create(self, serializer):
+        """Suscribe al usuario actual; si ya estaba suscrito, devuelve la suscripción existente."""
+        instance, _ = SuscripcionCategoria.objects.get_or_create(
+            user=self.request.user,
+            categoria=serializer.validated_data['categoria'],
+            defaults={'created_by': self.request.user, 'updated_by': self.request.user}
+        )
+        serializer.instance = instance
+
+    @extend_schema(summary="Listar mis Suscripciones a Categorías")
+    def list(self, request, *args, **kwargs):
+        """Obtiene las categorías de eventos a las que está suscrito el usuario actual."""
+        return super().list(request, *args, **kwargs)
+
+    @extend_schema(summary="Suscribirme a una Categoría")
+    def create(self, request, *args, **kwargs):
+        """Suscribe al usuario actual a una categoría de eventos."""
+        return super().create(request, *args, **kwargs)
+
+    @extend_schema(summary="Obtener una Suscripción")
+    def retrieve(self, request, *args, **kwargs):
+        """Obtiene una suscripción del usuario actual por su ID."""
+        return super().retrieve(request, *args, **kwargs)
+
+    @extend_schema(summary="Cancelar una Suscripción")
+    def destroy(self, request, *args, **kwargs):
+        """Elimina una suscripción del usuario actual."""
+        return super().destroy(request, *args, **kwargs)
+
+
 @extend_schema(tags=['Notificaciones'])
 class NotificacionViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Expone el historial de notificaciones para el usuario autenticado.
     
     Un usuario puede ver sus notificaciones directas y las de tipo 'broadcast'.
+    El listado se pagina por cursor (`next`), de la más reciente a la más antigua.
     """
-    serializer_class = NotificacionSerializer
+    serializer_class = NotificacionFeedSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """
         Filtra las notificaciones para el usuario actual.
 
         Incluye notificaciones donde el usuario es el destinatario directo
-        o aquellas sin destinatario (broadcast).
+        o aquellas sin destinatario (broadcast), con su estado de lectura.
         """
         user = self.request.user
-        return Notificacion.objects.filter(
-            models.Q(destinatario=user) | models.Q(destinatario__isnull=True)
-        ).select_related('evento').order_by('-created_at')
+        leidas = LecturaNotificacion.objects.filter(user=user, notificacion=models.OuterRef('pk'))
+        return notificaciones_visibles(user).annotate(
+            leida=models.Exists(leidas)
+        ).select_related('evento__created_by').only(*CAMPOS_HISTORIAL).order_by('-created_at')
 
-    @extend_schema(summary="Listar mis Notificaciones")
+    def obtener_pagina(self, posicion, limite):
+        """Página del listado para `KeysetPagination`: UNION de directas y broadcasts."""
+        return pagina_de_notificaciones(self.request.user, posicion, limite)
+
+    @extend_schema(summary="Listar mis Notificaciones", responses=NotificacionSerializer(many=True))
     def list(self, request, *args, **kwargs):
         """Obtiene el historial de notificaciones del usuario (directas y broadcast)."""
         return super().list(request, *args, **kwargs)
 
-    @extend_schema(summary="Obtener una Notificación")
+    @extend_schema(summary="Obtener una Notificación", responses=NotificacionSerializer)
     def retrieve(self, request, *args, **kwargs):
         """Obtiene una notificación específica del historial del usuario por su ID."""
-        return super().retrieve(request, *args, **kwargs)
\ No newline at end of file
+        return super().retrieve(request, *args, **kwargs)
+
+    @extend_schema(summary="Contar mis Notificaciones no Leídas", responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Cantidad de notificaciones no leídas del usuario (servida desde caché)."""
+        return Response({'unread': contar_no_leidas(request.user)})
+
+    @extend_schema(summary="Marcar Notificaciones como Leídas", request=MarcarLeidasSerializer, responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """Marca como leídas las notificaciones indicadas en `ids`, o todas si no se envía."""
+        serializer = MarcarLeidasSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marcadas = marcar_leidas(request.user, serializer.validated_data.get('ids'))
+        return Response({'marked': marcadas, 'unread': contar_no_leidas(request.user)})